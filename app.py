@@ -1,10 +1,28 @@
 import sys
 
-from PySide6.QtWidgets import QApplication
+from launcher.utils.profiling.startup_timer import StartupTimer
 
-from launcher.gui.pyside6.gui3 import ChatWindow
+# Seconds after launch by which the window should be painted and the default model ready.
+STARTUP_BUDGETS = {'first paint': 1.5, 'ready': 30.0}
 
-app = QApplication(sys.argv)
-window = ChatWindow()
+startup_timer = StartupTimer(budgets=STARTUP_BUDGETS)
+
+QtCore = startup_timer.import_module('PySide6.QtCore')
+QtWidgets = startup_timer.import_module('PySide6.QtWidgets')
+gui = startup_timer.import_module('launcher.gui.pyside6.gui3')
+
+
+def print_startup_report():
+    # Usage: python app.py --startup-report [report.json]
+    print(startup_timer.format_report())
+    arguments = sys.argv[sys.argv.index('--startup-report') + 1:]
+    if arguments and not arguments[0].startswith('-'):
+        startup_timer.save_report(arguments[0])
+
+
+app = QtWidgets.QApplication(sys.argv)
+window = gui.ChatWindow(startup_timer=startup_timer)
+if '--startup-report' in sys.argv:
+    window.model_ready.connect(print_startup_report, QtCore.Qt.SingleShotConnection)
 window.show()
-sys.exit(app.exec())
\ No newline at end of file
+sys.exit(app.exec())
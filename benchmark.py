@@ -0,0 +1,62 @@
+import argparse
+import json
+import os
+import sys
+
+from launcher.generators.ai.parameters import BACKENDS, PRECISIONS
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="Benchmark generation latency, throughput and memory over a matrix of configurations.")
+    parser.add_argument('--models', nargs='+', default=['tiny-gpt2', 'tiny-gpt-neo'],
+                        help="Model names or paths; 'tiny-gpt2' and 'tiny-gpt-neo' are random tiny models "
+                             "that work offline.")
+    parser.add_argument('--devices', nargs='+', default=['cpu'])
+    parser.add_argument('--precisions', nargs='+', default=['fp32'], choices=PRECISIONS)
+    parser.add_argument('--backends', nargs='+', default=['torch'], choices=BACKENDS)
+    parser.add_argument('--prompt-lengths', nargs='+', type=int, default=[16, 128], help="Prompt lengths in tokens.")
+    parser.add_argument('--max-lengths', nargs='+', type=int, default=[32], help="Number of tokens to generate.")
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--cache-dir', help="Directory to keep the tiny models in between runs.")
+    parser.add_argument('--output', help="Write the report as JSON to this file.")
+    parser.add_argument('--baseline', help="Compare against a report saved by an earlier run.")
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help="Relative change from which a worse metric counts as a regression.")
+    parser.add_argument('--fail-on-regression', action='store_true', help="Exit with status 1 on regressions.")
+    parser.add_argument('--offline', action='store_true', help="Never contact the Hugging Face Hub.")
+    return parser.parse_args()
+
+
+def main():
+    arguments = parse_arguments()
+    if arguments.offline:
+        # Must be set before transformers is imported.
+        os.environ['HF_HUB_OFFLINE'] = '1'
+
+    from launcher.utils.benchmarks.generation_benchmark import compare_with_baseline, run_benchmark
+
+    report = run_benchmark(arguments.models, arguments.devices, arguments.precisions, arguments.prompt_lengths,
+                           arguments.max_lengths, repeats=arguments.repeats, warmup=arguments.warmup,
+                           cache_dir=arguments.cache_dir, backends=arguments.backends)
+    if arguments.output:
+        with open(arguments.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+
+    if arguments.baseline:
+        with open(arguments.baseline, encoding='utf-8') as file:
+            baseline = json.load(file)
+        comparisons = compare_with_baseline(report, baseline, threshold=arguments.threshold)
+        regressions = [comparison for comparison in comparisons if comparison['regression']]
+        print(f"\nCompared {len(comparisons)} metrics with {arguments.baseline}, {len(regressions)} regressions:")
+        for comparison in regressions:
+            config = ', '.join(f"{key}={value}" for key, value in comparison['config'].items())
+            print(f" - {config}: {comparison['metric']} {comparison['baseline']:.4g} -> "
+                  f"{comparison['current']:.4g} ({comparison['change']:+.1%})")
+        if regressions and arguments.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
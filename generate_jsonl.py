@@ -0,0 +1,58 @@
+import argparse
+import os
+
+from launcher.generators.ai.parameters import BACKENDS, PRECISIONS, SAMPLING_PARAMETERS
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="Generate completions for every prompt of a JSONL file, in length-bucketed batches. "
+                    "Interrupted runs resume where they stopped.")
+    parser.add_argument('input', help="JSONL file with one {\"prompt\": ...} object per line; lines may also set "
+                                      "'id', sampling parameters, 'do_sample' and 'stop'.")
+    parser.add_argument('output', help="JSONL file receiving one {\"line\", \"id\", \"text\"} object per prompt.")
+    parser.add_argument('--model', default='gpt2', help="Model name or path to a local model directory.")
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--precision', default='fp32', choices=PRECISIONS)
+    parser.add_argument('--backend', default='torch', choices=BACKENDS)
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--window', type=int, default=1024,
+                        help="Prompts read and sorted by length at a time; memory use depends on this, not on the "
+                             "size of the input.")
+    for name, (value_type, _, _, default) in SAMPLING_PARAMETERS.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=value_type, default=default,
+                            help="Default for the lines that don't set it.")
+    parser.add_argument('--greedy', action='store_true', help="Pick the most likely token instead of sampling.")
+    parser.add_argument('--stop', nargs='+', help="Strings ending the completions.")
+    parser.add_argument('--compile', action='store_true',
+                        help="Decode with a torch.compile'd model; the compiled kernels are cached on disk.")
+    parser.add_argument('--offline', action='store_true', help="Never contact the Hugging Face Hub.")
+    return parser.parse_args()
+
+
+def main():
+    arguments = parse_arguments()
+    if arguments.offline:
+        # Must be set before transformers is imported.
+        os.environ['HF_HUB_OFFLINE'] = '1'
+
+    from launcher.generators.ai.NLP_Generator import AdvancedTextGenerator
+    from launcher.generators.ai.bulk import generate_jsonl
+
+    # Batches never hit the prompt caches, their memory is better left to the batches.
+    generator = AdvancedTextGenerator(model_name=arguments.model, device_id=arguments.device,
+                                      precision=arguments.precision, load_on_init=False, prefix_cache_mb=0,
+                                      response_cache_size=0, compile_mode=arguments.compile,
+                                      backend=arguments.backend)
+    generator.apply_model(generator.prepare_model(arguments.model))
+
+    defaults = {name: getattr(arguments, name) for name in SAMPLING_PARAMETERS}
+    defaults['do_sample'] = not arguments.greedy
+    defaults['stop'] = arguments.stop
+    lines = generate_jsonl(generator, arguments.input, arguments.output, defaults=defaults,
+                           batch_size=arguments.batch_size, window=arguments.window)
+    print(f"Done, {lines} lines of {arguments.input} processed into {arguments.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,49 +1,728 @@
-from transformers import AutoTokenizer, AutoModelForCausalLM
+import time
+from contextlib import nullcontext
+from threading import Event, Thread
+
+from transformers import (AutoConfig, StoppingCriteriaList, StopStringCriteria, TextStreamer,
+                          TextIteratorStreamer)
+from transformers.generation.streamers import BaseStreamer
+from launcher.generators.ai.admission import DEFAULT_HEADROOM_MB, AdmissionController, estimate_generation_mb
+from launcher.generators.ai.caches import PrefixKVCache, ResponseCache, legacy_key_values
+from launcher.generators.ai.compiled import DEFAULT_COMPILE_CACHE_DIR, CompiledDecoder
+from launcher.generators.ai.context import context_report, context_size, fit_to_context
+from launcher.generators.ai.metrics import MetricsStreamer
+from launcher.generators.ai.model_pool import ModelPool
+from launcher.generators.ai.precision import PRECISION_DTYPES, PRECISIONS, precision_from_half
+from launcher.generators.ai.speculative import check_draft_compatible, configure_draft_model
+from launcher.generators.ai.stopping import (StopStringFilter, build_stopping_criteria, stopped_early,
+                                             trim_at_stop_strings)
+from launcher.generators.backends.registry import DEFAULT_BACKEND, get_backend
+from launcher.generators.backends.torch_backend import TorchBackend, cuda_device_indices
+from launcher.utils.devices.cpu_tuning import CpuProfileStore, apply_cpu_settings, machine_id, tune_cpu
 from launcher.utils.devices.device_manager import DeviceManager
+from launcher.utils.devices.placement import AUTO_DEVICE, plan_placement
+from launcher.utils.profiling.memory import PeakMemorySampler
 import torch
 
 
+class CallbackTextStreamer(TextStreamer):
+    """
+    Text streamer that hands every finalized piece of decoded text to a callback instead of printing it.
+    """
+
+    def __init__(self, tokenizer, callback, skip_prompt=True, **decode_kwargs):
+        super().__init__(tokenizer, skip_prompt=skip_prompt, **decode_kwargs)
+        self.callback = callback
+
+    def on_finalized_text(self, text, stream_end=False):
+        if text:
+            self.callback(text)
+
+
+class BatchTextStreamer(BaseStreamer):
+    """
+    Streamer for batched generation that hands the decoded pieces of every row to that row's callback.
+    """
+
+    def __init__(self, tokenizer, callbacks, **decode_kwargs):
+        """
+        :param callbacks: One callback per batch row, None for rows that don't need streaming.
+        """
+        self.tokenizer = tokenizer
+        self.callbacks = list(callbacks)
+        self.decode_kwargs = decode_kwargs
+        self.token_ids = [[] for _ in self.callbacks]
+        self.printed_length = [0] * len(self.callbacks)
+        self.next_tokens_are_prompt = True
+
+    def put(self, value):
+        if self.next_tokens_are_prompt:
+            self.next_tokens_are_prompt = False
+            return
+        if value.dim() == 1:
+            value = value.unsqueeze(-1)
+        for row, tokens in enumerate(value.tolist()):
+            self.token_ids[row].extend(tokens)
+            self._emit(row, final=False)
+
+    def end(self):
+        for row in range(len(self.callbacks)):
+            self._emit(row, final=True)
+        self.next_tokens_are_prompt = True
+
+    def _emit(self, row, final):
+        callback = self.callbacks[row]
+        if callback is None:
+            return
+        text = self.tokenizer.decode(self.token_ids[row], **self.decode_kwargs)
+        # Hold back incomplete multi-byte characters until the next token completes them.
+        if not final and text.endswith('\ufffd'):
+            return
+        piece = text[self.printed_length[row]:]
+        if piece:
+            self.printed_length[row] = len(text)
+            callback(piece)
+
+
+class ModelLoadCancelled(Exception):
+    """
+    Raised by AdvancedTextGenerator.prepare_model when the load was cancelled.
+    """
+
+
 class AdvancedTextGenerator:
-    def __init__(self, model_name='gpt2', device_id='cpu', half_model_accuracy=False):
+    def __init__(self, model_name='gpt2', device_id='cpu', half_model_accuracy=False, model_pool=None,
+                 load_on_init=True, precision=None, prefix_cache_mb=256, response_cache_size=256, cpu_tuning=True,
+                 cpu_profiles=None, compile_mode=False, compile_cache_dir=DEFAULT_COMPILE_CACHE_DIR,
+                 backend=DEFAULT_BACKEND, admission_headroom_mb=DEFAULT_HEADROOM_MB, apply_cpu_profiles=None):
+        """
+        :param half_model_accuracy: Shortcut for precision='fp16', kept for older callers.
+        :param precision: Precision mode to load models in, one of PRECISIONS ('fp32', 'fp16', 'bf16', 'int8').
+        :param prefix_cache_mb: Memory budget for the key/values of earlier prompts, 0 disables the prefix cache.
+        :param response_cache_size: Number of greedy or seeded results to remember, 0 disables the response cache.
+        :param cpu_tuning: Benchmark thread counts and CPU affinities the first time a model is loaded on CPU on this
+                           machine, see launcher.utils.devices.cpu_tuning. False also leaves the stored settings
+                           unapplied, unless apply_cpu_profiles says otherwise.
+        :param cpu_profiles: CpuProfileStore holding the tuned settings, defaults to ~/.lcnlp/cpu_profiles.json.
+        :param apply_cpu_profiles: Apply the stored settings whenever the CPU is selected, defaults to cpu_tuning.
+                                   False leaves the thread count and affinity of the process as they are, e.g. in
+                                   replicas pinned to their own cores.
+        :param compile_mode: Decode with a torch.compile'd model, compiled in the background after every load, see
+                             launcher.generators.ai.compiled. Not used for models split across devices.
+        :param compile_cache_dir: Where the compiled kernels are kept between launches.
+        :param backend: Name of the engine to run models with, see launcher.generators.backends.registry.
+        :param admission_headroom_mb: Free memory kept out of reach of generations, which wait, generate fewer tokens
+                                      or are rejected when their estimated memory doesn't fit (see
+                                      launcher.generators.ai.admission). None disables admission control.
+        """
         self.model = None
         self.tokenizer = None
+        self.draft_model = None
+        self.draft_model_name = None
+        self.model_name = model_name
+        self.placement = None
+        self.backend = get_backend(backend)
+        self.precision = precision if precision is not None else precision_from_half(half_model_accuracy)
+        self.model_pool = model_pool if model_pool is not None else ModelPool()
         self.device_manager = DeviceManager()
+        self.prefix_cache = PrefixKVCache(max_size_mb=prefix_cache_mb) if prefix_cache_mb else None
+        self.response_cache = ResponseCache(max_entries=response_cache_size) if response_cache_size else None
+        self.last_metrics = None
+        self.last_load_metrics = None
+        self.metrics_callbacks = []
+        self.cpu_tuning = cpu_tuning
+        self.apply_cpu_profiles = cpu_tuning if apply_cpu_profiles is None else apply_cpu_profiles
+        self.cpu_profiles = cpu_profiles if cpu_profiles is not None else CpuProfileStore()
+        self._cpu_info = None
+        self.compile_mode = compile_mode
+        self.compile_cache_dir = compile_cache_dir
+        self.compiled = None
+        self.admission = (AdmissionController(self.free_memory_mb, headroom_mb=admission_headroom_mb)
+                          if admission_headroom_mb is not None else None)
         self.set_device(device_id)
-        self.load_model(model_name)
-        self.model_name = model_name
-        self.half_model_accuracy = half_model_accuracy
+        if load_on_init:
+            self.load_model(model_name)
+
+    @property
+    def half_model_accuracy(self):
+        return self.precision == 'fp16'
+
+    @half_model_accuracy.setter
+    def half_model_accuracy(self, value):
+        self.precision = precision_from_half(value)
 
     def set_device(self, device_id):
-        self.device_manager.set_device(device_id)
+        """
+        Select the device for the next load_model call.
+
+        :param device_id: One of device_manager.available_devices, or 'auto' to split the model across all of them.
+        """
+        if device_id == AUTO_DEVICE:
+            # Until a model is placed, the first GPU (or the CPU) is the best guess of where inputs go.
+            self.device_manager.set_device(self.device_manager.available_devices[0])
+        else:
+            self.device_manager.set_device(device_id)
+        self.device_id = device_id
         self.device = self.device_manager.get_device()
+        if self.device.type == 'cpu':
+            self.apply_cpu_profile(self.model_name, self.precision)
+
+    def get_dtype(self, precision=None):
+        return PRECISION_DTYPES[precision or self.precision]
+
+    def get_context_size(self):
+        """
+        Number of positions of the current model, which the prompt and the new tokens have to fit into.
+        """
+        return context_size(self.model.config)
+
+    def free_memory_mb(self):
+        """
+        Memory of the current device that generations can still use, including what PyTorch's CUDA allocator has
+        cached but not handed out.
+        """
+        device_info = self.device_manager.get_device_info(verbose=False)
+        free_mb = device_info['Available Memory (MB)']
+        if self.device.type == 'cuda':
+            free_mb += device_info['Memory Cached (MB)'] - device_info['Memory Allocated (MB)']
+        return free_mb
+
+    def supported_precisions(self, device_id=None, backend=None):
+        """
+        List the precision modes the backend, the current one by default, can run on the device.
+        """
+        backend = get_backend(backend) if backend is not None else self.backend
+        device = self.device if device_id is None or device_id == AUTO_DEVICE else torch.device(device_id)
+        supported = []
+        for precision in PRECISIONS:
+            try:
+                backend.check(device, precision)
+            except ValueError:
+                continue
+            supported.append(precision)
+        return supported
+
+    def plan_placement(self, model_name, precision=None, inventory=None):
+        """
+        Plan how the model would be split across the devices, see launcher.utils.devices.placement.
+
+        :param inventory: Devices to plan for, defaults to the free memory of the devices of this machine.
+        """
+        if inventory is None:
+            inventory = self.device_manager.get_inventory()
+        config = AutoConfig.from_pretrained(model_name)
+        # int8 models are loaded in fp32 before they are quantized.
+        dtype_bytes = self.get_dtype(precision).itemsize
+        return plan_placement(config, inventory, dtype_bytes=dtype_bytes)
+
+    def cpu_profile_key(self, model_name, precision):
+        """
+        Key of the tuned CPU settings: the machine, and the model along with its precision since both change the
+        kernels that run.
+        """
+        return machine_id(self.get_cpu_info()), f"{model_name} ({precision})"
+
+    def get_cpu_info(self):
+        if self._cpu_info is None:
+            cpu_manager = DeviceManager()
+            cpu_manager.set_device('cpu')
+            self._cpu_info = cpu_manager.get_device_info(verbose=False)
+        return self._cpu_info
+
+    def apply_cpu_profile(self, model_name, precision):
+        """
+        Apply the tuned CPU settings of the model on this machine, if it was tuned and profiles are applied.
+
+        :return: The applied profile, or None.
+        """
+        if not self.apply_cpu_profiles:
+            return None
+        profile = self.cpu_profiles.get(*self.cpu_profile_key(model_name, precision))
+        if profile is not None:
+            apply_cpu_settings(profile)
+        return profile
+
+    def tune_cpu(self, model_name, precision, model, tokenizer, new_tokens=32, cancel_event=None):
+        """
+        Benchmark a short greedy generation over the candidate CPU settings, then save and apply the fastest.
+
+        :param cancel_event: Optional threading.Event; once set, no further candidate is measured and nothing is
+                             saved.
+        :return: The profile, or None when cancelled.
+        """
+        inputs = tokenizer("What is quasar? A quasar is", return_tensors='pt').to(model.device)
+
+        def benchmark():
+            start = time.perf_counter()
+            model.generate(**inputs, max_new_tokens=new_tokens, min_new_tokens=new_tokens, do_sample=False,
+                           pad_token_id=tokenizer.eos_token_id)
+            return new_tokens / (time.perf_counter() - start)
+
+        profile = tune_cpu(benchmark, self.get_cpu_info()['CPU Cores'], log=print, cancel_event=cancel_event)
+        if profile is None:
+            return None
+        self.cpu_profiles.put(*self.cpu_profile_key(model_name, precision), profile)
+        print(f"CPU tuned for {model_name}: {profile['num_threads']} threads, {profile['affinity']} affinity, "
+              f"{profile['tokens_per_s']:.1f} tokens/s")
+        return profile
 
     def load_model(self, model_name):
+        """
+        Make the model current on the selected device and precision, reusing it from the model pool when resident.
+        """
         try:
-            self.tokenizer = AutoTokenizer.from_pretrained(model_name)
-            self.model = AutoModelForCausalLM.from_pretrained(model_name).to(self.device)
-            if self.half_model_accuracy:
-                self.model = self.model.half()
+            self.apply_model(self.prepare_model(model_name))
         except Exception as e:
             print(f"Error loading model: {e}, line: {e.__traceback__.tb_lineno}")
 
-    def generate_text(self, prompt, max_length=50, temperature=1.0, top_k=50, top_p=0.95, repetition_penalty=1.0):
-        inputs = self.tokenizer(prompt, return_tensors='pt').to(self.device)
-        input_ids = inputs['input_ids']
-        attention_mask = inputs.get('attention_mask')
+    def prepare_model(self, model_name, device_id=None, precision=None, progress_callback=None, cancel_event=None,
+                      draft_model_name=None, backend=None):
+        """
+        Load a model without making it current, so the current model keeps serving until apply_model is called.
+        Safe to call from a background thread.
+
+        :param device_id: Device to load on, defaults to the selected device. With 'auto', the model is split across
+                          the available devices according to plan_placement.
+        :param precision: Precision mode to load in, defaults to the current one. Raises ValueError when the device
+                          doesn't support it.
+        :param draft_model_name: Optional small model with the same tokenizer, loaded alongside to enable
+                                 speculative decoding (see launcher.generators.ai.speculative).
+        :param backend: Name of the engine to load with, defaults to the current one.
+        :param progress_callback: Optional callable receiving (stage, percent) while loading.
+        :param cancel_event: Optional threading.Event; once set, loading stops at the next stage with
+                             ModelLoadCancelled.
+        :return: Dictionary to pass to apply_model.
+        """
+        if device_id is None:
+            device_id = self.device_id
+        if precision is None:
+            precision = self.precision
+        backend = get_backend(backend) if backend is not None else self.backend
+        if device_id != AUTO_DEVICE:
+            if device_id not in self.device_manager.available_devices:
+                raise ValueError(f"Device '{device_id}' is not available. "
+                                 f"Available devices: {self.device_manager.available_devices}")
+            backend.check(torch.device(device_id), precision)
+        elif not isinstance(backend, TorchBackend):
+            raise ValueError(f"Only the PyTorch backend can split a model across devices, not {backend.label}")
+        if draft_model_name is not None and not isinstance(backend, TorchBackend):
+            raise ValueError(f"Speculative decoding needs the PyTorch backend, not {backend.label}")
+
+        def report(stage, percent):
+            if cancel_event is not None and cancel_event.is_set():
+                raise ModelLoadCancelled(f"Loading of '{model_name}' was cancelled during '{stage}'")
+            if progress_callback is not None:
+                progress_callback(stage, percent)
+
+        def load():
+            if device_id != AUTO_DEVICE:
+                return backend.load(model_name, torch.device(device_id), precision, report, load_metrics)
+            # Planned on a miss only, a resident split model keeps the placement it was loaded with.
+            placement = self.plan_placement(model_name, precision)
+            for placed_device in placement['devices']:
+                backend.check(torch.device(placed_device), precision)
+            model, tokenizer = backend.load(model_name, torch.device(placement['primary_device']), precision,
+                                            report, load_metrics, placement)
+            model.placement_plan = placement
+            return model, tokenizer
+
+        load_metrics = {}
+        model, tokenizer = self.model_pool.get(model_name, device_id, precision, load, backend=backend.name)
+        placement = getattr(model, 'placement_plan', None) if device_id == AUTO_DEVICE else None
+        device = torch.device(placement['primary_device']) if placement else torch.device(device_id)
+
+        draft_model = None
+        if draft_model_name is not None:
+            report('draft model', 95)
+            draft_model, draft_tokenizer = self.model_pool.get(
+                draft_model_name, device, precision,
+                lambda: backend.load(draft_model_name, device, precision,
+                                     lambda stage, _: report(f"draft model: {stage}", 95)))
+            check_draft_compatible(tokenizer, draft_tokenizer)
+            configure_draft_model(draft_model)
+
+        if progress_callback is not None:
+            progress_callback('ready', 100)
+        return {
+            'model_name': model_name,
+            'device': device,
+            'precision': precision,
+            'model': model,
+            'tokenizer': tokenizer,
+            'draft_model_name': draft_model_name,
+            'draft_model': draft_model,
+            'placement': placement,
+            'backend': backend,
+            # Empty when the model came from the model pool.
+            'load_metrics': load_metrics,
+            'cancel_event': cancel_event
+        }
+
+    def apply_model(self, prepared):
+        """
+        Swap in a model returned by prepare_model.
+
+        The first time a model runs on this machine's CPU, its thread count and affinity are tuned here, after the
+        swap, so the benchmark never competes with a generation of the previous model and the settings never change
+        under one. Callers serving requests call this between generations, e.g. with GenerationScheduler.submit_call.
+        Setting the load's cancel_event stops the tuning early, keeping the best settings measured so far.
+        """
+        self.device_manager.set_device(str(prepared['device']))
+        self.device = prepared['device']
+        self.placement = prepared.get('placement')
+        self.backend = prepared.get('backend', self.backend)
+        self.device_id = AUTO_DEVICE if self.placement else str(self.device)
+        self.precision = prepared['precision']
+        self.model_name = prepared['model_name']
+        self.tokenizer = prepared['tokenizer']
+        self.model = prepared['model']
+        self.draft_model_name = prepared.get('draft_model_name')
+        self.draft_model = prepared.get('draft_model')
+        if prepared.get('load_metrics'):
+            self.last_load_metrics = prepared['load_metrics']
+        # Other engines size their own thread pools.
+        if (self.device.type == 'cpu' and isinstance(self.backend, TorchBackend)
+                and self.apply_cpu_profile(self.model_name, self.precision) is None
+                and self.cpu_tuning and self.apply_cpu_profiles and self.placement is None):
+            self.tune_cpu(self.model_name, self.precision, self.model, self.tokenizer,
+                          cancel_event=prepared.get('cancel_event'))
+        self.compiled = self._compiled_decoder(self.model)
 
-        outputs = self.model.generate(
+    def _compiled_decoder(self, model):
+        """
+        The CompiledDecoder of a model, compiling it and starting its warmup the first time it is used in compile
+        mode. Pooled models keep theirs, so switching back to one doesn't compile it again.
+        """
+        decoder = getattr(model, 'compiled_decoder', None)
+        if (decoder is not None or not self.compile_mode or self.placement
+                or not isinstance(self.backend, TorchBackend)):
+            return decoder
+        try:
+            decoder = CompiledDecoder(model, self.model_name, self.device, model.dtype,
+                                      cache_dir=self.compile_cache_dir)
+        except Exception as e:
+            print(f"Can't compile {self.model_name}, using eager mode: {e}")
+            return None
+        model.compiled_decoder = decoder
+        pad_token_id = self.tokenizer.pad_token_id
+        decoder.start_warmup(pad_token_id if pad_token_id is not None else self.tokenizer.eos_token_id)
+        return decoder
+
+    def generate_text(self, prompt, max_length=50, temperature=1.0, top_k=50, top_p=0.95, repetition_penalty=1.0,
+                      on_text=None, streamer=None, do_sample=True, seed=None, stop_strings=None, cancel_event=None,
+                      deadline=None):
+        """
+        Generate a continuation of the prompt.
+
+        Greedy and seeded generations are answered from the response cache when the same request was made before.
+
+        :param on_text: Optional callback receiving decoded pieces of the reply as soon as each token is produced.
+        :param streamer: Optional transformers streamer receiving the token ids instead, ignored if on_text is given.
+        :param do_sample: Sample the next token, or always pick the most likely one (greedy) when False.
+        :param seed: Optional random seed that makes a sampled generation reproducible.
+        :param stop_strings: Optional strings ending the reply as soon as it contains one of them. The stop string is
+                             left out of the result and of the streamed text.
+        :param cancel_event: Optional threading.Event; once set, generation stops after the current token and the
+                             text generated so far is returned.
+        :param deadline: Optional time.monotonic() timestamp after which generation stops the same way.
+        """
+        stop_strings = tuple(stop_strings or ())
+        cache_key = None
+        if self.response_cache is not None and (not do_sample or seed is not None):
+            cache_key = (self.model_name, self.draft_model_name, str(self.device), self.precision, self.backend.name,
+                         prompt, max_length, temperature, top_k, top_p, repetition_penalty, do_sample, seed,
+                         stop_strings)
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                generated_text, reply = cached
+                if on_text is not None and reply:
+                    on_text(reply)
+                return generated_text
+
+        text_filter = None
+        if on_text is not None:
+            if stop_strings:
+                on_text = text_filter = StopStringFilter(on_text, stop_strings)
+            streamer = CallbackTextStreamer(self.tokenizer, on_text, skip_special_tokens=True)
+        if seed is not None:
+            torch.manual_seed(seed)
+        generated_text, reply = self._generate(prompt, max_length, temperature, top_k, top_p, repetition_penalty,
+                                               streamer, do_sample, stop_strings, cancel_event, deadline)
+        if text_filter is not None:
+            text_filter.flush()
+        # A cancelled, timed out or memory-limited generation isn't what the same request would give next time.
+        if (cache_key is not None and not stopped_early(cancel_event, deadline)
+                and not self.last_metrics.get('memory_cut_new_tokens')):
+            self.response_cache.put(cache_key, (generated_text, reply))
+        return generated_text
+
+    def stream_text(self, prompt, max_length=50, temperature=1.0, top_k=50, top_p=0.95, repetition_penalty=1.0):
+        """
+        Iterate over decoded pieces of the reply while the model is still generating it. Generation stops when the
+        iteration is abandoned, e.g. on break or when the iterator is closed.
+        """
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        cancel_event = Event()
+
+        def run():
+            try:
+                self.generate_text(prompt, max_length, temperature, top_k, top_p, repetition_penalty,
+                                   streamer=streamer, cancel_event=cancel_event)
+            finally:
+                # Unblock the consumer even if generation failed half-way.
+                streamer.end()
+
+        worker = Thread(target=run, daemon=True)
+        worker.start()
+        try:
+            for text in streamer:
+                if text:
+                    yield text
+        finally:
+            cancel_event.set()
+        worker.join()
+
+    def generate_batch(self, prompts, max_length=50, temperature=1.0, top_k=50, top_p=0.95, repetition_penalty=1.0,
+                       on_text=None, do_sample=True, seed=None, stop_strings=None, cancel_events=None, deadlines=None):
+        """
+        Generate continuations for several prompts in one padded batch.
+
+        :param on_text: Optional list with one streaming callback (or None) per prompt.
+        :param do_sample: Sample the next token, or always pick the most likely one (greedy) when False.
+        :param seed: Optional random seed for the whole batch.
+        :param stop_strings: Optional stop strings for every prompt, see generate_text.
+        :param cancel_events: Optional list with one threading.Event (or None) per prompt, stopping only its row.
+        :param deadlines: Optional list with one time.monotonic() deadline (or None) per prompt.
+        :return: List of generated texts in the order of the prompts.
+        """
+        stop_strings = tuple(stop_strings or ())
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        # Decoder-only models continue from the last position, so the padding has to go on the left.
+        self.tokenizer.padding_side = 'left'
+        size = self.get_context_size()
+        token_ids = self.tokenizer(list(prompts))['input_ids']
+        requested_new_tokens = max_length
+        max_length = min(fit_to_context(ids, requested_new_tokens, size)[1] for ids in token_ids)
+        dropped = [fit_to_context(ids, max_length, size)[2] for ids in token_ids]
+        inputs = self.tokenizer.pad({'input_ids': [ids[count:] for ids, count in zip(token_ids, dropped)]},
+                                    return_tensors='pt').to(self.device)
+        if self.compiled is not None:
+            inputs['input_ids'], inputs['attention_mask'] = self.compiled.pad_to_bucket(
+                inputs['input_ids'], inputs['attention_mask'], self.tokenizer.pad_token_id, max_length)
+
+        streamer = None
+        text_filters = []
+        if on_text is not None and any(callback is not None for callback in on_text):
+            if stop_strings:
+                on_text = [StopStringFilter(callback, stop_strings) if callback is not None else None
+                           for callback in on_text]
+                text_filters = [callback for callback in on_text if callback is not None]
+            streamer = BatchTextStreamer(self.tokenizer, on_text, skip_special_tokens=True)
+        if seed is not None:
+            torch.manual_seed(seed)
+        stop_kwargs = {'stop_strings': list(stop_strings), 'tokenizer': self.tokenizer} if stop_strings else {}
+
+        outputs = self.generate_with_metrics(
+            input_ids=inputs['input_ids'],
+            attention_mask=inputs['attention_mask'],
+            max_new_tokens=max_length,
+            temperature=temperature,
+            top_k=top_k,
+            top_p=top_p,
+            repetition_penalty=repetition_penalty,
+            do_sample=do_sample,
+            pad_token_id=self.tokenizer.pad_token_id,
+            stopping_criteria=build_stopping_criteria(cancel_events, deadlines),
+            cancel_events=cancel_events,
+            deadlines=deadlines,
+            streamer=streamer,
+            context=context_report(size, sum(dropped), max_length, requested_new_tokens),
+            **stop_kwargs
+        )
+        for text_filter in text_filters:
+            text_filter.flush()
+        # The texts start with the whole prompts, including the tokens that didn't fit.
+        texts = [self.tokenizer.decode(ids[:count] + row.tolist(), skip_special_tokens=True)
+                 for ids, count, row in zip(token_ids, dropped, outputs)]
+        if not stop_strings:
+            return texts
+        replies = self.tokenizer.batch_decode(outputs[:, inputs['input_ids'].shape[-1]:], skip_special_tokens=True)
+        return [self._trim_reply(text, reply, stop_strings) for text, reply in zip(texts, replies)]
+
+    def add_metrics_callback(self, callback):
+        """
+        Subscribe to the metrics of every generation.
+
+        :param callback: Callable receiving the metrics dictionary (see generate_with_metrics), called on the thread
+                         that ran the generation.
+        """
+        self.metrics_callbacks.append(callback)
+
+    def remove_metrics_callback(self, callback):
+        if callback in self.metrics_callbacks:
+            self.metrics_callbacks.remove(callback)
+
+    def generate_with_metrics(self, input_ids, streamer=None, context=None, cancel_events=None, deadlines=None,
+                              **generate_kwargs):
+        """
+        Run model.generate and collect its performance metrics into last_metrics:
+        prompt_tokens, batch_size, generated_tokens, prefill_s, decode_tokens_per_s, total_s, peak_rss_mb and
+        peak_vram_mb, along with the model, device and precision. The metrics are also passed to every callback
+        added with add_metrics_callback.
+
+        :param context: Optional token accounting from launcher.generators.ai.context.context_report, added to the
+                        metrics so the UI can tell what didn't fit into the context.
+        :param cancel_events: Optional threading.Events of the rows, ending the wait for memory once all are set.
+        :param deadlines: Optional time.monotonic() deadlines of the rows, the wait for memory ends at the latest.
+
+        Generations first go through admission control: one whose estimated memory isn't free waits for the running
+        generations, generates fewer tokens, or is rejected with AdmissionRejected.
+
+        With a draft model loaded, single-prompt generations use speculative decoding. In compile mode, generations
+        take turns on the compiled model.
+
+        :return: What model.generate returned.
+        """
+        if self.draft_model is not None and input_ids.shape[0] == 1:
+            generate_kwargs['assistant_model'] = self.draft_model
+            # The draft model's own generate would get the stop strings without the tokenizer and fail, so they are
+            # checked as a stopping criterion of the large model only. Stop strings in the middle of a batch of
+            # accepted draft tokens are missed here and cut off by the callers' trimming.
+            stop_strings = generate_kwargs.pop('stop_strings', None)
+            tokenizer = generate_kwargs.pop('tokenizer', None)
+            if stop_strings:
+                stopping_criteria = StoppingCriteriaList(generate_kwargs.get('stopping_criteria') or [])
+                stopping_criteria.append(StopStringCriteria(tokenizer or self.tokenizer, stop_strings))
+                generate_kwargs['stopping_criteria'] = stopping_criteria
+        elif self.compiled is not None:
+            generate_kwargs.update(self.compiled.generate_kwargs(generate_kwargs.get('past_key_values')))
+        admission = self._admit(input_ids, generate_kwargs, cancel_events, deadlines)
+        if admission is not None:
+            generate_kwargs['max_new_tokens'] = admission.max_new_tokens
+        metrics_streamer = MetricsStreamer(streamer)
+        cuda_devices = cuda_device_indices(self.device, self.placement)
+        compiled_session = self.compiled.session() if self.compiled is not None else nullcontext()
+        with admission or nullcontext(), compiled_session, PeakMemorySampler(cuda_devices=cuda_devices) as memory:
+            outputs = self.model.generate(input_ids=input_ids, streamer=metrics_streamer, **generate_kwargs)
+
+        metrics = {
+            'model': self.model_name,
+            'device': str(self.device),
+            'precision': self.precision,
+            'draft_model': self.draft_model_name if 'assistant_model' in generate_kwargs else None,
+            'prompt_tokens': input_ids.shape[-1],
+        }
+        metrics.update(context or {})
+        if admission is not None:
+            metrics.update(admission.report())
+            metrics['max_new_tokens'] = admission.max_new_tokens
+            metrics['cut_new_tokens'] = metrics.get('cut_new_tokens', 0) + metrics['memory_cut_new_tokens']
+        metrics.update(metrics_streamer.collect())
+        metrics['peak_rss_mb'] = memory.peak_rss_mb
+        metrics['peak_vram_mb'] = memory.peak_vram_mb
+        self.last_metrics = metrics
+        for callback in list(self.metrics_callbacks):
+            try:
+                callback(metrics)
+            except Exception as e:
+                print(f"Error in metrics callback: {e}")
+        return outputs
+
+    def _admit(self, input_ids, generate_kwargs, cancel_events=None, deadlines=None):
+        """
+        Wait until the estimated memory of a generation is free, see AdmissionController.admit.
+
+        :return: Admission to release once generated, or None when admission control doesn't apply. Models split
+                 across devices aren't checked, their key/values are spread over the devices like their layers.
+        """
+        if self.admission is None or self.placement or 'max_new_tokens' not in generate_kwargs:
+            return None
+        batch_size, total_tokens = input_ids.shape
+        past_key_values = generate_kwargs.get('past_key_values')
+        past_tokens = legacy_key_values(past_key_values)[0][0].shape[-2] if past_key_values is not None else 0
+        prompt_tokens = total_tokens - past_tokens
+        dtype_bytes = self.get_dtype().itemsize
+        configs = [self.model.config]
+        if 'assistant_model' in generate_kwargs:
+            configs.append(self.draft_model.config)
+
+        def estimate_mb(new_tokens):
+            return sum(estimate_generation_mb(config, prompt_tokens, new_tokens, batch_size, past_tokens, dtype_bytes)
+                       for config in configs)
+
+        cancel_events = [event for event in cancel_events or () if event is not None]
+        deadlines = [deadline for deadline in deadlines or () if deadline is not None]
+        return self.admission.admit(
+            estimate_mb, generate_kwargs['max_new_tokens'],
+            min_new_tokens=generate_kwargs.get('min_new_tokens') or 1,
+            # Every row has to be stopped before the whole batch gives up waiting.
+            deadline=max(deadlines) if deadlines and len(deadlines) == batch_size else None,
+            should_stop=(lambda: all(event.is_set() for event in cancel_events))
+            if cancel_events and len(cancel_events) == batch_size else None)
+
+    @staticmethod
+    def _trim_reply(generated_text, reply, stop_strings):
+        """
+        Cut the reply at its first stop string, in the reply and in the full generated text.
+
+        :return: The trimmed generated text.
+        """
+        trimmed = trim_at_stop_strings(reply, stop_strings)
+        if len(trimmed) == len(reply) or not generated_text.endswith(reply):
+            return generated_text
+        return generated_text[:len(generated_text) - len(reply)] + trimmed
+
+    def _generate(self, prompt, max_length, temperature, top_k, top_p, repetition_penalty, streamer=None,
+                  do_sample=True, stop_strings=(), cancel_event=None, deadline=None):
+        # The oldest tokens of a prompt that doesn't fit are dropped before anything runs.
+        size = self.get_context_size()
+        prompt_ids = self.tokenizer(prompt)['input_ids']
+        kept_ids, max_new_tokens, dropped = fit_to_context(prompt_ids, max_length, size)
+        input_ids = torch.tensor([kept_ids], dtype=torch.long, device=self.device)
+        attention_mask = torch.ones_like(input_ids)
+
+        # Reuse the key/values of a cached prompt that starts the same way, generate then only prefills the rest.
+        # Assisted generation keeps the key/values of both models in step, so it starts without a cached prefix.
+        # Compiled models get prompts padded to a bucket length instead, which the cached prefixes don't match.
+        past_key_values = None
+        model_key = (self.model_name, str(self.device), self.precision, id(self.model))
+        use_prefix_cache = self.prefix_cache is not None and self.draft_model is None and self.compiled is None
+        if self.compiled is not None and self.draft_model is None:
+            input_ids, attention_mask = self.compiled.pad_to_bucket(input_ids, attention_mask,
+                                                                    self.tokenizer.eos_token_id, max_new_tokens)
+        if use_prefix_cache:
+            _, past_key_values = self.prefix_cache.lookup(model_key, input_ids[0].tolist())
+
+        outputs = self.generate_with_metrics(
             input_ids=input_ids,
             attention_mask=attention_mask,
-            max_length=max_length + len(input_ids[0]),
+            past_key_values=past_key_values,
+            max_new_tokens=max_new_tokens,
             temperature=temperature,
             top_k=top_k,
             top_p=top_p,
             repetition_penalty=repetition_penalty,
-            do_sample=True
+            do_sample=do_sample,
+            pad_token_id=self.tokenizer.eos_token_id,
+            return_dict_in_generate=True,
+            stopping_criteria=build_stopping_criteria([cancel_event], [deadline]),
+            cancel_events=[cancel_event],
+            deadlines=[deadline],
+            streamer=streamer,
+            context=context_report(size, dropped, max_new_tokens, max_length),
+            # transformers' StopStringCriteria only looks at the last tokens after every step.
+            **({'stop_strings': list(stop_strings), 'tokenizer': self.tokenizer} if stop_strings else {})
         )
+        if use_prefix_cache and outputs.past_key_values is not None:
+            self.prefix_cache.store(model_key, input_ids[0].tolist(), outputs.past_key_values)
 
-        generated_text = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
-        return generated_text
+        generated_text = self.tokenizer.decode(prompt_ids[:dropped] + outputs.sequences[0].tolist(),
+                                               skip_special_tokens=True)
+        reply = self.tokenizer.decode(outputs.sequences[0, input_ids.shape[-1]:], skip_special_tokens=True)
+        if stop_strings:
+            generated_text = self._trim_reply(generated_text, reply, stop_strings)
+            reply = trim_at_stop_strings(reply, stop_strings)
+        return generated_text, reply
 
 
 if __name__ == '__main__':
@@ -57,13 +736,15 @@ if __name__ == '__main__':
     generator = AdvancedTextGenerator(model_name='gpt2-large', device_id=device_id)
     prompt = "What is quasar?"
 
+    print(prompt, end='', flush=True)
     generated_text = generator.generate_text(
         prompt,
         max_length=100,  # Adjust as needed
         temperature=0.7,
         top_k=50,
         top_p=0.9,
-        repetition_penalty=1.2
+        repetition_penalty=1.2,
+        on_text=lambda text: print(text, end='', flush=True)
     )
 
-    print(f"\nFinal Generated Text:\n{generated_text}")
+    print(f"\n\nFinal Generated Text:\n{generated_text}")
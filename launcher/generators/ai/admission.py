@@ -0,0 +1,186 @@
+"""
+Memory-aware admission of generation requests.
+
+Before a generation starts, the memory it will need is estimated from the model config: the key/values of every
+layer for the prompt and all new tokens, and the activations and logits of the prefill, which is the peak of the
+forward passes. AdmissionController compares the estimate with the free memory of the device, less what the
+generations already running have reserved, and then:
+
+ - runs the request when it fits,
+ - makes it wait while running generations hold the memory it needs, until they finish,
+ - lets it generate fewer new tokens when even the whole device wouldn't fit all of them,
+ - rejects it with AdmissionRejected when not even its prompt fits.
+
+Like launcher.utils.devices.placement, the estimates work on plain numbers and don't import torch.
+"""
+import threading
+import time
+from concurrent.futures import CancelledError
+
+# Free memory left alone for the allocator's fragmentation, the tokenizer and everything else of the process.
+DEFAULT_HEADROOM_MB = 256
+
+
+class AdmissionRejected(MemoryError):
+    """
+    Raised by AdmissionController.admit when a request can't fit into the device's memory.
+    """
+
+
+def kv_cache_bytes_per_token(config, dtype_bytes=4):
+    """
+    Memory of the keys and values of one token across all layers.
+    """
+    heads = config.num_attention_heads
+    kv_heads = getattr(config, 'num_key_value_heads', None) or heads
+    head_dim = config.hidden_size // heads
+    return 2 * config.num_hidden_layers * kv_heads * head_dim * dtype_bytes
+
+
+def estimate_generation_mb(config, prompt_tokens, new_tokens, batch_size=1, past_tokens=0, dtype_bytes=4):
+    """
+    Estimate the peak memory a generation needs on top of the model's weights.
+
+    :param prompt_tokens: Number of prompt tokens run through the prefill.
+    :param new_tokens: Number of tokens to generate.
+    :param past_tokens: Number of tokens whose key/values already exist, e.g. from the prefix cache.
+    :param dtype_bytes: Bytes per value of the activations and key/values, 4 for fp32 and int8, 2 for fp16/bf16.
+    :return: Estimate in MB.
+    """
+    hidden = config.hidden_size
+    inner = getattr(config, 'n_inner', None) or getattr(config, 'intermediate_size', None) or 4 * hidden
+    total_tokens = past_tokens + prompt_tokens + new_tokens
+
+    key_values = batch_size * total_tokens * kv_cache_bytes_per_token(config, dtype_bytes)
+    # The prefill keeps a few hidden states and one MLP intermediate alive per layer, the attention scores with
+    # their softmax, and the logits of every prompt position.
+    hidden_states = batch_size * prompt_tokens * (4 * hidden + inner) * dtype_bytes
+    attention = (2 * batch_size * config.num_attention_heads * prompt_tokens * (past_tokens + prompt_tokens)
+                 * dtype_bytes)
+    logits = batch_size * prompt_tokens * config.vocab_size * dtype_bytes
+    return (key_values + hidden_states + attention + logits) / (1024 ** 2)
+
+
+class Admission:
+    """
+    A request let through by AdmissionController, holding its reservation until it is released, e.g. at the end of
+    a with block.
+    """
+
+    def __init__(self, controller, estimate_mb, max_new_tokens, requested_new_tokens, waited_s):
+        self.controller = controller
+        self.estimate_mb = estimate_mb
+        self.max_new_tokens = max_new_tokens
+        self.requested_new_tokens = requested_new_tokens
+        self.waited_s = waited_s
+        self._released = False
+
+    def report(self):
+        """
+        What admission did to the request, merged into its metrics.
+        """
+        return {
+            'admission_estimate_mb': self.estimate_mb,
+            'admission_wait_s': self.waited_s,
+            'memory_cut_new_tokens': self.requested_new_tokens - self.max_new_tokens,
+        }
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.controller.release(self.estimate_mb)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class AdmissionController:
+    """
+    Lets generation requests onto a device only when their estimated memory is free.
+
+    The reservations of running generations are subtracted from the measured free memory although part of them is
+    already allocated, so the controller errs on the side of waiting. Whether a request has to be shrunk or rejected
+    is decided against the free memory with the reservations added back, what it could get with nothing else
+    running.
+    """
+
+    def __init__(self, free_memory_mb, headroom_mb=DEFAULT_HEADROOM_MB, poll_s=0.1):
+        """
+        :param free_memory_mb: Callable returning the free memory of the device in MB, e.g. from
+                               DeviceManager.get_device_info.
+        :param headroom_mb: Free memory that is never handed out.
+        :param poll_s: Seconds between two checks while a request waits, in case memory is freed outside the
+                       controller, e.g. by another process.
+        """
+        self.free_memory_mb = free_memory_mb
+        self.headroom_mb = headroom_mb
+        self.poll_s = poll_s
+        self.reserved_mb = 0.0
+        self._condition = threading.Condition()
+
+    def admit(self, estimate_mb, max_new_tokens, min_new_tokens=1, deadline=None, should_stop=None):
+        """
+        Wait until the request fits, shrinking its number of new tokens when it would never fit as asked.
+
+        :param estimate_mb: Callable returning the estimated memory in MB for a number of new tokens, see
+                            estimate_generation_mb.
+        :param min_new_tokens: Fewest new tokens worth running; below that the request is rejected.
+        :param deadline: Optional time.monotonic() timestamp; waiting past it raises TimeoutError.
+        :param should_stop: Optional callable; once it returns True, waiting stops with CancelledError.
+        :return: Admission to release once the generation finished. Raises AdmissionRejected when the request can't
+                 fit even with nothing else running.
+        """
+        start = time.monotonic()
+        min_new_tokens = min(min_new_tokens, max_new_tokens)
+        with self._condition:
+            while True:
+                free_mb = self.free_memory_mb() - self.headroom_mb
+                available_mb = free_mb - self.reserved_mb
+                # What the request could get once the running generations have finished.
+                usable_mb = free_mb + self.reserved_mb
+                new_tokens = self._tokens_that_fit(estimate_mb, max_new_tokens, min_new_tokens, usable_mb)
+                if new_tokens is None:
+                    raise AdmissionRejected(
+                        f"The request needs about {estimate_mb(min_new_tokens):.0f} MB, but only {usable_mb:.0f} MB "
+                        f"of memory can be used")
+                needed_mb = estimate_mb(new_tokens)
+                if needed_mb <= available_mb:
+                    self.reserved_mb += needed_mb
+                    return Admission(self, needed_mb, new_tokens, max_new_tokens, time.monotonic() - start)
+
+                if should_stop is not None and should_stop():
+                    raise CancelledError("The request was cancelled while waiting for memory")
+                timeout = self.poll_s
+                if deadline is not None:
+                    timeout = min(timeout, deadline - time.monotonic())
+                    if timeout <= 0:
+                        raise TimeoutError("The deadline passed while the request was waiting for memory")
+                self._condition.wait(timeout)
+
+    def release(self, estimate_mb):
+        with self._condition:
+            self.reserved_mb = max(0.0, self.reserved_mb - estimate_mb)
+            self._condition.notify_all()
+
+    @staticmethod
+    def _tokens_that_fit(estimate_mb, max_new_tokens, min_new_tokens, budget_mb):
+        """
+        Largest number of new tokens between min_new_tokens and max_new_tokens whose estimate fits into the budget,
+        or None.
+        """
+        if estimate_mb(max_new_tokens) <= budget_mb:
+            return max_new_tokens
+        low, high = min_new_tokens, max_new_tokens
+        if estimate_mb(low) > budget_mb:
+            return None
+        # The estimate grows with the number of new tokens.
+        while low < high:
+            middle = (low + high + 1) // 2
+            if estimate_mb(middle) <= budget_mb:
+                low = middle
+            else:
+                high = middle - 1
+        return low
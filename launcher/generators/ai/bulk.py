@@ -0,0 +1,184 @@
+"""
+Bulk generation over JSONL files.
+
+Prompts are read a window of lines at a time. Within a window they are grouped by sampling parameters and sorted by
+token length, so every batch pads as little as possible. Once a window is fully written, a checkpoint records how far
+the input and the output got, and an interrupted run resumes from there. Only one window is held in memory, whatever
+the size of the input.
+"""
+import json
+import os
+import time
+
+from launcher.generators.ai.parameters import validate_sampling_parameters
+
+
+def checkpoint_path(output_path):
+    return output_path + '.checkpoint.json'
+
+
+def read_checkpoint(output_path, input_path):
+    """
+    Load the checkpoint of an earlier run writing to output_path, or None when there is none.
+    """
+    try:
+        with open(checkpoint_path(output_path), encoding='utf-8') as file:
+            checkpoint = json.load(file)
+    except FileNotFoundError:
+        return None
+    if checkpoint['input'] != os.path.abspath(input_path):
+        raise ValueError(f"{output_path} was written from {checkpoint['input']}, not {input_path}")
+    return checkpoint
+
+
+def write_checkpoint(output_path, checkpoint):
+    path = checkpoint_path(output_path)
+    with open(path + '.tmp', 'w', encoding='utf-8') as file:
+        json.dump(checkpoint, file)
+    # Replacing is atomic, a crash leaves either the old or the new checkpoint.
+    os.replace(path + '.tmp', path)
+
+
+def read_window(file, size, first_line):
+    """
+    Read up to size non-empty lines.
+
+    :return: (entries, lines_read) where entries are {'line', 'request'} or {'line', 'error'} dictionaries.
+    """
+    entries = []
+    lines_read = 0
+    while len(entries) < size:
+        raw = file.readline()
+        if not raw:
+            break
+        lines_read += 1
+        line_number = first_line + lines_read
+        if not raw.strip():
+            continue
+        try:
+            request = json.loads(raw)
+            if not isinstance(request, dict) or not isinstance(request.get('prompt'), str) or not request['prompt']:
+                raise ValueError("Each line must be a JSON object with a non-empty 'prompt'")
+            entries.append({'line': line_number, 'request': request})
+        except ValueError as e:
+            entries.append({'line': line_number, 'error': str(e)})
+    return entries, lines_read
+
+
+def plan_batches(entries, tokenizer, defaults, batch_size):
+    """
+    Group the entries of a window into batches of identical sampling parameters and similar prompt length.
+
+    :return: List of (parameters, entries) pairs, plus the entries whose parameters were invalid.
+    """
+    groups = {}
+    invalid = []
+    for entry in entries:
+        if 'error' in entry:
+            invalid.append(entry)
+            continue
+        request = entry['request']
+        try:
+            parameters = validate_sampling_parameters(dict(defaults, **request))
+            stop = request.get('stop', defaults.get('stop'))
+            stop = [stop] if isinstance(stop, str) else stop
+            if stop is not None and not (isinstance(stop, list) and all(isinstance(item, str) and item
+                                                                        for item in stop)):
+                raise ValueError("'stop' must be a non-empty string or a list of non-empty strings")
+        except ValueError as e:
+            invalid.append(dict(entry, error=str(e)))
+            continue
+        parameters['stop_strings'] = tuple(stop or ())
+        parameters['do_sample'] = bool(request.get('do_sample', defaults.get('do_sample', True)))
+        entry['length'] = len(tokenizer(request['prompt'])['input_ids'])
+        groups.setdefault(tuple(sorted(parameters.items())), []).append(entry)
+
+    batches = []
+    for key, group in groups.items():
+        group.sort(key=lambda entry: entry['length'])
+        for start in range(0, len(group), batch_size):
+            batches.append((dict(key), group[start:start + batch_size]))
+    return batches, invalid
+
+
+def result_record(entry, text=None, error=None):
+    record = {'line': entry['line']}
+    request = entry.get('request') or {}
+    if 'id' in request:
+        record['id'] = request['id']
+    if error is not None:
+        record['error'] = error
+    else:
+        record['text'] = text
+    return record
+
+
+def run_batch(generator, parameters, batch):
+    """
+    Generate a batch, falling back to one prompt at a time when the batch fails, e.g. when it runs out of memory.
+    """
+    prompts = [entry['request']['prompt'] for entry in batch]
+    try:
+        texts = generator.generate_batch(prompts, **parameters)
+        return [result_record(entry, text) for entry, text in zip(batch, texts)]
+    except Exception as e:
+        if len(batch) == 1:
+            return [result_record(batch[0], error=str(e))]
+    return [record for entry in batch for record in run_batch(generator, parameters, [entry])]
+
+
+def generate_jsonl(generator, input_path, output_path, defaults=None, batch_size=16, window=1024, log=print):
+    """
+    Generate a completion for every prompt of a JSONL file into another JSONL file.
+
+    Input lines are objects with a 'prompt' and optionally an 'id', sampling parameters, 'do_sample' and 'stop'.
+    Output lines are {'line', 'id', 'text'} objects, or {'line', 'id', 'error'} for lines that failed, where 'line'
+    is the 1-based input line number. Output order follows the input order only per window.
+
+    :param defaults: Sampling parameters for the lines that don't set them.
+    :param window: Lines read, sorted and batched at a time. Bigger windows pad less but hold more in memory.
+    :return: Number of input lines done, including those of earlier runs.
+    """
+    defaults = dict(defaults or {})
+    checkpoint = read_checkpoint(output_path, input_path)
+    output_size = os.path.getsize(output_path) if os.path.exists(output_path) else None
+    if checkpoint is not None and (output_size or 0) < checkpoint['output_offset']:
+        # The results the checkpoint counts are gone, resuming would leave them out of the output.
+        log(f"{output_path} is missing or shorter than its checkpoint says, starting over")
+        checkpoint = None
+    if checkpoint is None:
+        # Without a checkpoint, an existing output file is from an unrelated run and is overwritten.
+        checkpoint = {'input': os.path.abspath(input_path), 'input_offset': 0, 'lines_done': 0, 'output_offset': 0}
+    elif checkpoint['lines_done']:
+        log(f"Resuming after line {checkpoint['lines_done']}")
+
+    mode = 'r+b' if output_size is not None else 'wb'
+    with open(input_path, 'rb') as input_file, open(output_path, mode) as output_file:
+        input_file.seek(checkpoint['input_offset'])
+        # Results written after the last checkpoint belong to the window that is redone.
+        output_file.truncate(checkpoint['output_offset'])
+        output_file.seek(checkpoint['output_offset'])
+
+        while True:
+            start = time.perf_counter()
+            entries, lines_read = read_window(input_file, window, checkpoint['lines_done'])
+            if not lines_read:
+                break
+            batches, invalid = plan_batches(entries, generator.tokenizer, defaults, batch_size)
+            for entry in invalid:
+                output_file.write((json.dumps(result_record(entry, error=entry['error'])) + '\n').encode('utf-8'))
+            for parameters, batch in batches:
+                for record in run_batch(generator, parameters, batch):
+                    output_file.write((json.dumps(record) + '\n').encode('utf-8'))
+                output_file.flush()
+
+            os.fsync(output_file.fileno())
+            checkpoint['input_offset'] = input_file.tell()
+            checkpoint['lines_done'] += lines_read
+            checkpoint['output_offset'] = output_file.tell()
+            write_checkpoint(output_path, checkpoint)
+            log(f"{checkpoint['lines_done']} lines done, {len(entries) / (time.perf_counter() - start):.1f} "
+                f"prompts/s")
+
+    # The checkpoint stays, so running again only processes lines appended to the input since.
+    return checkpoint['lines_done']
@@ -0,0 +1,134 @@
+import threading
+from collections import OrderedDict
+
+
+def legacy_key_values(past_key_values):
+    """
+    Return the key/values as the legacy tuple of (key, value) pairs per layer, whatever cache class the model uses.
+    """
+    if hasattr(past_key_values, 'to_legacy_cache'):
+        return past_key_values.to_legacy_cache()
+    return tuple(tuple(layer[:2]) for layer in past_key_values)
+
+
+def slice_key_values(past_key_values, length):
+    """
+    Keep the key/values of the first length positions. Tensors are (batch, heads, positions, head_dim).
+    """
+    return tuple((key[:, :, :length, :], value[:, :, :length, :]) for key, value in past_key_values)
+
+
+def key_values_size_mb(past_key_values):
+    return sum(tensor.numel() * tensor.element_size()
+               for layer in past_key_values for tensor in layer) / (1024 ** 2)
+
+
+class PrefixKVCache:
+    """
+    Key/values of earlier prompts, reused for new prompts that start with the same tokens.
+
+    Entries are keyed by model and token ids. A lookup returns the key/values of the longest common prefix with any
+    entry of the same model, so prompts sharing an instruction preamble skip its prefill even when what follows
+    differs. The least recently used entries are evicted once the cache is larger than its memory budget.
+    """
+
+    def __init__(self, max_size_mb=256, min_prefix_tokens=16):
+        """
+        :param max_size_mb: Memory budget of the cached key/values.
+        :param min_prefix_tokens: Shorter prefixes are neither cached nor reused, they are cheap to prefill.
+        """
+        self.max_size_mb = max_size_mb
+        self.min_prefix_tokens = min_prefix_tokens
+        self._entries = OrderedDict()
+        self._size_mb = 0.0
+        self._lock = threading.Lock()
+
+    def lookup(self, model_key, token_ids):
+        """
+        Find cached key/values for the longest prefix of token_ids.
+
+        At least the last token is always left out, generation needs one new token to compute the next logits.
+
+        :return: (prefix_length, past_key_values), or (0, None) on a miss.
+        """
+        token_ids = tuple(token_ids)
+        best_key, best_length = None, 0
+        with self._lock:
+            for key in self._entries:
+                if key[0] != model_key:
+                    continue
+                length = _common_prefix_length(key[1], token_ids)
+                if length > best_length:
+                    best_key, best_length = key, length
+            best_length = min(best_length, len(token_ids) - 1)
+            if best_key is None or best_length < self.min_prefix_tokens:
+                return 0, None
+            self._entries.move_to_end(best_key)
+            past_key_values, _ = self._entries[best_key]
+        return best_length, slice_key_values(past_key_values, best_length)
+
+    def store(self, model_key, token_ids, past_key_values):
+        """
+        Cache the key/values of the first len(token_ids) positions of past_key_values.
+        """
+        token_ids = tuple(token_ids)
+        if len(token_ids) < self.min_prefix_tokens:
+            return
+        past_key_values = slice_key_values(legacy_key_values(past_key_values), len(token_ids))
+        # Slices are views, copy them so the cache doesn't keep the whole generation's key/values alive.
+        past_key_values = tuple((key.clone(), value.clone()) for key, value in past_key_values)
+        size_mb = key_values_size_mb(past_key_values)
+        if size_mb > self.max_size_mb:
+            return
+        key = (model_key, token_ids)
+        with self._lock:
+            if key in self._entries:
+                self._size_mb -= self._entries.pop(key)[1]
+            self._entries[key] = (past_key_values, size_mb)
+            self._size_mb += size_mb
+            while self._size_mb > self.max_size_mb:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._size_mb -= evicted_size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size_mb = 0.0
+
+
+class ResponseCache:
+    """
+    Exact-result cache for generations that are reproducible, i.e. greedy or seeded ones.
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def _common_prefix_length(first, second):
+    length = 0
+    for a, b in zip(first, second):
+        if a != b:
+            break
+        length += 1
+    return length
@@ -0,0 +1,172 @@
+"""
+Compiled decode mode.
+
+The model's forward is compiled with torch.compile, which removes most of the Python and framework overhead of every
+decoding step on small models. Prompts are left-padded to a few bucket lengths so their shapes repeat, and inductor's
+FX graph cache keeps the compiled kernels on disk, so a later launch reuses them instead of compiling again.
+
+Architectures that support transformers' static KV cache generate with it, giving every decoding step the same
+shapes. GPT-2 and GPT-Neo don't support it in transformers 4.42 and use a dynamic-shape compile instead.
+"""
+import json
+import os
+import re
+import threading
+from contextlib import contextmanager
+
+import torch
+
+from launcher.generators.ai.context import context_size
+
+DEFAULT_COMPILE_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.lcnlp', 'compile_cache')
+
+# Prompt lengths in tokens that prompts are padded up to.
+PROMPT_BUCKETS = (32, 64, 128, 256, 512, 1024)
+
+# Inductor reads its cache directory from the environment whenever it compiles, which also happens when a generation
+# meets new shapes. Generations with a compiled forward hold this lock while the environment points at their model's
+# directory.
+_compile_lock = threading.Lock()
+
+
+def prompt_bucket(length, context_size=None, buckets=PROMPT_BUCKETS):
+    """
+    Smallest bucket holding a prompt of the given length, or the length itself when no bucket does.
+    """
+    for bucket in buckets:
+        if bucket >= length and (context_size is None or bucket <= context_size):
+            return bucket
+    return length
+
+
+def compile_cache_key(model_name, dtype, device):
+    """
+    Directory name for the compiled artifacts of a (model, dtype, device) combination.
+    """
+    key = f"{model_name}-{str(dtype).replace('torch.', '')}-{device.type}"
+    return re.sub(r'[^A-Za-z0-9_.-]+', '_', key)
+
+
+class CompiledDecoder:
+    """
+    Compiled forward of one loaded model, with its warmup state.
+
+    Generations using the compiled forward run inside session(), so a static cache allocated on the model is never
+    shared by two generations, the warmup runs between them, and recompiles write to this model's cache directory.
+    """
+
+    def __init__(self, model, model_name, device, dtype, cache_dir=DEFAULT_COMPILE_CACHE_DIR, buckets=PROMPT_BUCKETS):
+        self.model = model
+        self.directory = os.path.join(cache_dir, compile_cache_key(model_name, dtype, device))
+        self.buckets = buckets
+        self.static_cache = bool(getattr(model, '_supports_static_cache', False))
+        self.context_size = context_size(model.config)
+        self.lock = threading.RLock()
+        self.failed = None
+        manifest = self._read_manifest()
+        # Kernels compiled by another torch version aren't found in the cache.
+        self.warm_buckets = set(manifest.get('buckets', [])) if manifest.get('torch') == torch.__version__ else set()
+        self.eager_forward = model.forward
+
+        # torch.compile only wraps the forward, the compilation happens on its first calls.
+        if self.static_cache:
+            # Every step has the same shapes, CUDA graphs can replay them.
+            mode = 'reduce-overhead' if device.type == 'cuda' else None
+            self.compiled_forward = torch.compile(self.eager_forward, mode=mode, fullgraph=True)
+        else:
+            self.compiled_forward = torch.compile(self.eager_forward, dynamic=True)
+        model.forward = self.compiled_forward
+
+    @contextmanager
+    def session(self):
+        """
+        Hold the model and point inductor's cache at its directory for the duration of a generation.
+        """
+        with self.lock, _compile_lock:
+            os.makedirs(self.directory, exist_ok=True)
+            previous = os.environ.get('TORCHINDUCTOR_CACHE_DIR')
+            os.environ['TORCHINDUCTOR_CACHE_DIR'] = self.directory
+            torch._inductor.config.fx_graph_cache = True
+            try:
+                yield
+            finally:
+                if previous is None:
+                    os.environ.pop('TORCHINDUCTOR_CACHE_DIR', None)
+                else:
+                    os.environ['TORCHINDUCTOR_CACHE_DIR'] = previous
+
+    def _read_manifest(self):
+        try:
+            with open(os.path.join(self.directory, 'manifest.json'), encoding='utf-8') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_manifest(self):
+        with open(os.path.join(self.directory, 'manifest.json'), 'w', encoding='utf-8') as file:
+            json.dump({'buckets': sorted(self.warm_buckets), 'static_cache': self.static_cache,
+                       'torch': torch.__version__}, file)
+
+    def generate_kwargs(self, past_key_values=None):
+        """
+        Extra model.generate arguments for a generation with the compiled forward.
+        """
+        if self.static_cache and self.failed is None and past_key_values is None:
+            return {'cache_implementation': 'static'}
+        return {}
+
+    def pad_to_bucket(self, input_ids, attention_mask, pad_token_id, max_new_tokens=0):
+        """
+        Left-pad a batch of prompts to the length of their bucket, among the buckets that leave room for
+        max_new_tokens in the context.
+        """
+        length = input_ids.shape[-1]
+        limit = self.context_size - max_new_tokens if self.context_size else None
+        padding = prompt_bucket(length, limit, self.buckets) - length
+        if padding <= 0:
+            return input_ids, attention_mask
+        if attention_mask is None:
+            attention_mask = torch.ones_like(input_ids)
+        pad = input_ids.new_full((input_ids.shape[0], padding), pad_token_id)
+        return (torch.cat([pad, input_ids], dim=-1),
+                torch.cat([torch.zeros_like(pad), attention_mask], dim=-1))
+
+    def warmup(self, pad_token_id, new_tokens=4):
+        """
+        Compile for every prompt bucket by running a short generation. Buckets an earlier launch compiled, as
+        recorded in the manifest, are skipped: their first generation loads the kernels from the on-disk cache.
+        """
+        try:
+            for bucket in self.buckets:
+                if self.context_size and bucket + new_tokens > self.context_size:
+                    break
+                if bucket in self.warm_buckets:
+                    continue
+                input_ids = torch.full((1, bucket), pad_token_id, dtype=torch.long, device=self.model.device)
+                with self.session():
+                    self.model.generate(input_ids=input_ids, attention_mask=torch.ones_like(input_ids),
+                                        max_new_tokens=new_tokens, min_new_tokens=new_tokens, do_sample=False,
+                                        pad_token_id=pad_token_id, **self.generate_kwargs())
+                    self.warm_buckets.add(bucket)
+                    self._write_manifest()
+        except Exception as e:
+            # Some models or quantized layers don't compile, they keep running eagerly.
+            print(f"Compiling the model failed, using eager mode: {e}")
+            with self.lock:
+                self.failed = e
+                self.model.forward = self.eager_forward
+
+    def start_warmup(self, pad_token_id):
+        thread = threading.Thread(target=self.warmup, args=(pad_token_id,), name='CompileWarmup', daemon=True)
+        thread.start()
+        return thread
+
+    def release(self):
+        """
+        Give the model its eager forward back, dropping the compiled one. Called by ModelPool when the model is
+        evicted.
+        """
+        with self.lock:
+            self.model.forward = self.eager_forward
+            if getattr(self.model, 'compiled_decoder', None) is self:
+                del self.model.compiled_decoder
@@ -0,0 +1,53 @@
+"""
+Token budget of the model's context window.
+
+A prompt and the tokens generated after it have to fit into the model's positions, e.g. 1024 for GPT-2. Requests that
+don't fit are cut down before any compute: the oldest prompt tokens are dropped first, and the number of new tokens
+is only reduced when the prompt would otherwise lose more than half of the context.
+"""
+
+
+def context_size(config):
+    """
+    Number of positions of the model, or None when its config doesn't say.
+    """
+    for name in ('n_positions', 'max_position_embeddings', 'n_ctx'):
+        size = getattr(config, name, None)
+        if size:
+            return size
+    return None
+
+
+def new_token_budget(prompt_tokens, max_new_tokens, size):
+    """
+    Number of new tokens that fit, leaving the prompt at least half of the context, or all of it when shorter.
+    """
+    if size is None:
+        return max_new_tokens
+    return max(1, min(max_new_tokens, size - min(prompt_tokens, size // 2)))
+
+
+def fit_to_context(token_ids, max_new_tokens, size):
+    """
+    Cut a prompt and its number of new tokens down to the context size.
+
+    :param token_ids: List of the prompt's token ids.
+    :return: (kept token ids, max_new_tokens, number of dropped prompt tokens)
+    """
+    max_new_tokens = new_token_budget(len(token_ids), max_new_tokens, size)
+    if size is None:
+        return token_ids, max_new_tokens, 0
+    dropped = max(0, len(token_ids) + max_new_tokens - size)
+    return token_ids[dropped:], max_new_tokens, dropped
+
+
+def context_report(size, dropped_tokens, max_new_tokens, requested_new_tokens):
+    """
+    Token accounting of a generation, merged into its metrics.
+    """
+    return {
+        'context_size': size,
+        'dropped_tokens': dropped_tokens,
+        'max_new_tokens': max_new_tokens,
+        'cut_new_tokens': requested_new_tokens - max_new_tokens,
+    }
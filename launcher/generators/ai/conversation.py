@@ -0,0 +1,168 @@
+import threading
+
+import torch
+
+from launcher.generators.ai.NLP_Generator import CallbackTextStreamer
+from launcher.generators.ai.caches import legacy_key_values, slice_key_values
+from launcher.generators.ai.context import context_report, fit_to_context, new_token_budget
+from launcher.generators.ai.stopping import StopStringFilter, build_stopping_criteria, trim_at_stop_strings
+
+
+class ConversationSession:
+    """
+    Multi-turn chat on top of an AdvancedTextGenerator.
+
+    The session keeps the token ids and the key/value cache of all earlier turns, so every new turn only
+    prefills the tokens of the new user message instead of the whole conversation. Replies end as soon as the model
+    starts writing the next user turn itself. Once the conversation outgrows the model's context, its oldest turns
+    are dropped.
+    """
+
+    def __init__(self, generator, user_prefix='You:', ai_prefix='AI:'):
+        self.generator = generator
+        self.user_prefix = user_prefix
+        self.ai_prefix = ai_prefix
+        self._lock = threading.Lock()
+        self._epoch = 0
+        self._clear()
+
+    def reset(self):
+        """
+        Forget the conversation and drop the cached key/values.
+        """
+        with self._lock:
+            self._clear()
+
+    def _clear(self):
+        self._epoch += 1
+        self.history = []
+        self.token_ids = None
+        self.past_key_values = None
+        self._model_key = None
+
+    def _current_model_key(self):
+        generator = self.generator
+        # id(model) changes on every reload, the device and precision cover in-place moves and casts.
+        return id(generator.model), str(generator.device), generator.precision
+
+    def _turn_ids(self, prompt, first):
+        separator = '' if first else '\n'
+        return self.generator.tokenizer(f"{separator}{self.user_prefix} {prompt}\n{self.ai_prefix}")['input_ids']
+
+    def _slide_history(self, history, prompt, max_length, size):
+        """
+        Drop the oldest turns until the conversation and the reply fit into the context. When the new turn alone is
+        too long, its oldest tokens are dropped too.
+
+        :return: (token ids of the kept conversation, kept history, max_new_tokens)
+        """
+        tokenizer = self.generator.tokenizer
+        turns = [(history[index][1], history[index + 1][1]) for index in range(0, len(history) - 1, 2)]
+        # Keep the newest turns that fit; counted with their separator, which the first kept turn doesn't get.
+        length = len(self._turn_ids(prompt, False))
+        kept = 0
+        for user_text, reply in reversed(turns):
+            candidate = length + len(self._turn_ids(user_text, False) + tokenizer(reply)['input_ids'])
+            if candidate + new_token_budget(candidate, max_length, size) > size:
+                break
+            length = candidate
+            kept += 1
+        turns = turns[len(turns) - kept:]
+
+        token_ids = []
+        for index, (user_text, reply) in enumerate(turns):
+            token_ids += self._turn_ids(user_text, index == 0) + tokenizer(reply)['input_ids']
+        token_ids += self._turn_ids(prompt, not turns)
+        token_ids, max_new_tokens, _ = fit_to_context(token_ids, max_length, size)
+        history = [message for user_text, reply in turns for message in (('user', user_text), ('ai', reply))]
+        return token_ids, history, max_new_tokens
+
+    def generate_text(self, prompt, max_length=50, temperature=1.0, top_k=50, top_p=0.95, repetition_penalty=1.0,
+                      on_text=None, stop_strings=None, cancel_event=None, deadline=None):
+        """
+        Add a user turn to the conversation and generate the reply.
+
+        Takes the same arguments as AdvancedTextGenerator.generate_text, but returns only the reply. A reply cut
+        short by cancel_event or deadline stays in the conversation as far as it got.
+        """
+        stop_strings = [f"\n{self.user_prefix}"] + list(stop_strings or ())
+        generator = self.generator
+        with self._lock:
+            if self._model_key != self._current_model_key():
+                self._clear()
+                self._model_key = self._current_model_key()
+            epoch = self._epoch
+            token_ids = self.token_ids
+            past_key_values = self.past_key_values
+            history = list(self.history)
+
+        separator = '\n' if history else ''
+        turn = f"{separator}{self.user_prefix} {prompt}\n{self.ai_prefix}"
+        new_ids = generator.tokenizer(turn, return_tensors='pt')['input_ids'].to(generator.device)
+
+        input_ids = new_ids if token_ids is None else torch.cat([token_ids, new_ids], dim=-1)
+        size = generator.get_context_size()
+        max_new_tokens = new_token_budget(input_ids.shape[-1], max_length, size)
+        dropped = 0
+        if size and input_ids.shape[-1] + max_new_tokens > size:
+            # The positions of the kept turns change, so their key/values can't be reused.
+            kept_ids, history, max_new_tokens = self._slide_history(history, prompt, max_length, size)
+            dropped = input_ids.shape[-1] - len(kept_ids)
+            input_ids = torch.tensor([kept_ids], dtype=torch.long, device=generator.device)
+            past_key_values = None
+
+        streamer = None
+        text_filter = None
+        if on_text is not None:
+            text_filter = StopStringFilter(on_text, stop_strings)
+            streamer = CallbackTextStreamer(generator.tokenizer, text_filter, skip_special_tokens=True)
+
+        outputs = generator.generate_with_metrics(
+            input_ids=input_ids,
+            attention_mask=torch.ones_like(input_ids),
+            past_key_values=past_key_values,
+            max_new_tokens=max_new_tokens,
+            temperature=temperature,
+            top_k=top_k,
+            top_p=top_p,
+            repetition_penalty=repetition_penalty,
+            do_sample=True,
+            pad_token_id=generator.tokenizer.eos_token_id,
+            return_dict_in_generate=True,
+            stopping_criteria=build_stopping_criteria([cancel_event], [deadline]),
+            cancel_events=[cancel_event],
+            deadlines=[deadline],
+            stop_strings=stop_strings,
+            tokenizer=generator.tokenizer,
+            streamer=streamer,
+            context=context_report(size, dropped, max_new_tokens, max_length)
+        )
+        if text_filter is not None:
+            text_filter.flush()
+
+        prompt_length = input_ids.shape[-1]
+        reply_ids = outputs.sequences[0, prompt_length:]
+        reply = trim_at_stop_strings(generator.tokenizer.decode(reply_ids, skip_special_tokens=True), stop_strings)
+        token_ids, past_key_values = outputs.sequences, outputs.past_key_values
+        kept = self._reply_token_count(reply_ids, reply)
+        if kept < len(reply_ids):
+            # Drop the stop string's tokens, the next turn adds its own separator and prefix.
+            token_ids = token_ids[:, :prompt_length + kept]
+            past_key_values = slice_key_values(legacy_key_values(past_key_values), prompt_length + kept)
+
+        with self._lock:
+            # A reset while we were generating invalidates this turn.
+            if epoch == self._epoch:
+                self.token_ids = token_ids
+                self.past_key_values = past_key_values
+                self.history = history + [('user', prompt), ('ai', reply)]
+        return reply
+
+    def _reply_token_count(self, reply_ids, reply):
+        """
+        Number of leading reply tokens that decode to no more than the trimmed reply.
+        """
+        count = len(reply_ids)
+        while count and len(self.generator.tokenizer.decode(reply_ids[:count], skip_special_tokens=True)) > len(reply):
+            count -= 1
+        return count
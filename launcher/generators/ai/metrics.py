@@ -0,0 +1,88 @@
+import os
+import time
+
+from transformers.generation.streamers import BaseStreamer
+
+
+class MetricsStreamer(BaseStreamer):
+    """
+    Streamer recording when model.generate produces its tokens, forwarding everything to an optional inner streamer.
+    """
+
+    def __init__(self, inner=None):
+        self.inner = inner
+        self.start = time.perf_counter()
+        self.first_token_time = None
+        self.last_token_time = None
+        self.first_step_tokens = 0
+        self.generated_tokens = 0
+        self.batch_size = 0
+        self.next_tokens_are_prompt = True
+
+    def put(self, value):
+        if self.inner is not None:
+            self.inner.put(value)
+        if self.next_tokens_are_prompt:
+            self.next_tokens_are_prompt = False
+            self.batch_size = value.shape[0] if value.dim() == 2 else 1
+            return
+        now = time.perf_counter()
+        tokens = value.numel()
+        if self.first_token_time is None:
+            self.first_token_time = now
+            self.first_step_tokens = tokens
+        self.last_token_time = now
+        self.generated_tokens += tokens
+
+    def end(self):
+        if self.inner is not None:
+            self.inner.end()
+
+    def collect(self, end=None):
+        """
+        Build the timing part of the metrics once generation is done.
+        """
+        end = time.perf_counter() if end is None else end
+        decode_time = (self.last_token_time or 0) - (self.first_token_time or 0)
+        decode_tokens = self.generated_tokens - self.first_step_tokens
+        return {
+            'batch_size': self.batch_size,
+            'generated_tokens': self.generated_tokens,
+            # The first token comes out of the prefill forward pass.
+            'prefill_s': (self.first_token_time or end) - self.start,
+            'decode_tokens_per_s': decode_tokens / decode_time if decode_time > 0 else 0.0,
+            'total_s': end - self.start,
+        }
+
+
+def format_metrics(metrics):
+    """
+    One-line summary of the metrics of a generation, as shown in the window header.
+    """
+    summary = (f"Prefill: {metrics['prefill_s'] * 1000:.0f} ms  |  Decode: {metrics['decode_tokens_per_s']:.1f} tok/s"
+               f"  |  Tokens: {metrics['generated_tokens']}  |  Peak RAM: {metrics['peak_rss_mb']:.0f} MB")
+    if metrics.get('peak_vram_mb'):
+        summary += f"  |  Peak VRAM: {metrics['peak_vram_mb']:.0f} MB"
+    if metrics.get('draft_model'):
+        summary += f"  |  Draft: {metrics['draft_model']}"
+    if metrics.get('dropped_tokens'):
+        summary += f"  |  Context full: {metrics['dropped_tokens']} oldest tokens dropped"
+    if metrics.get('cut_new_tokens'):
+        reason = " by free memory" if metrics.get('memory_cut_new_tokens') else ""
+        summary += f"  |  Reply limited to {metrics['max_new_tokens']} tokens{reason}"
+    if metrics.get('admission_wait_s', 0) >= 0.1:
+        summary += f"  |  Waited {metrics['admission_wait_s']:.1f} s for memory"
+    return summary
+
+
+def format_load_metrics(load_metrics):
+    """
+    One-line summary of a model load, as measured by the backend that loaded the model.
+    """
+    summary = (f"Loaded in {load_metrics['load_s']:.1f} s  |  Peak RAM: {load_metrics['peak_rss_mb']:.0f} MB "
+               f"(+{load_metrics['rss_increase_mb']:.0f} MB)")
+    if load_metrics.get('peak_vram_mb'):
+        summary += f"  |  Peak VRAM: {load_metrics['peak_vram_mb']:.0f} MB"
+    if load_metrics.get('variant'):
+        summary += f"  |  From {os.path.basename(load_metrics['variant'])} variant"
+    return summary
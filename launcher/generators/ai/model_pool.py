@@ -0,0 +1,133 @@
+import gc
+import threading
+from collections import OrderedDict
+
+import torch
+
+from launcher.utils.devices.device_manager import DeviceManager
+from launcher.utils.devices.placement import AUTO_DEVICE
+
+
+def model_size_mb(model):
+    """
+    Memory taken by the parameters and buffers of a model, in MB.
+    """
+    if not isinstance(model, torch.nn.Module):
+        # Models of other backends measure themselves, see launcher.generators.backends.base.BackendModel.
+        return model.size_mb()
+    tensors = list(model.parameters()) + list(model.buffers())
+    size = sum(tensor.numel() * tensor.element_size() for tensor in tensors)
+    # Dynamically quantized Linear layers keep their int8 weights in packed params instead of parameters.
+    for module in model.modules():
+        if hasattr(module, '_packed_params') and callable(getattr(module, 'weight', None)):
+            size += module.weight().numel()
+    return size / (1024 ** 2)
+
+
+class ModelPool:
+    """
+    Keeps several (model, device, precision, backend) instances loaded at once.
+
+    When the models resident on a device take more memory than its budget, the least recently used ones are evicted.
+    The budget is a fraction of the 'Total Memory (MB)' reported by DeviceManager.get_device_info, unless an explicit
+    budget in MB is configured for the device. Models split across devices are kept under the 'auto' device and
+    are only evicted explicitly.
+    """
+
+    def __init__(self, budget_fraction=0.6, budget_mb=None):
+        """
+        :param budget_fraction: Fraction of the device memory that resident models may take.
+        :param budget_mb: Optional dictionary mapping device ids (e.g. 'cpu', 'cuda:0') to a budget in MB.
+        """
+        self.budget_fraction = budget_fraction
+        self.budget_mb = dict(budget_mb or {})
+        self.device_manager = DeviceManager()
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def make_key(model_name, device, precision, backend='torch'):
+        return model_name, str(device), str(precision), backend
+
+    def get(self, model_name, device, precision, loader, backend='torch'):
+        """
+        Return the (model, tokenizer) pair for the key, loading it with loader() on a miss.
+
+        :param loader: Callable returning a freshly loaded (model, tokenizer) pair.
+        :param backend: Name of the backend the model was loaded with.
+        """
+        key = self.make_key(model_name, device, precision, backend)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                model, tokenizer, _ = self._entries[key]
+                return model, tokenizer
+
+        model, tokenizer = loader()
+        with self._lock:
+            self._entries[key] = (model, tokenizer, model_size_mb(model))
+            self._evict(str(device), keep=key)
+        return model, tokenizer
+
+    def resident(self):
+        """
+        List the resident keys with their size in MB, least recently used first.
+        """
+        with self._lock:
+            return [(key, size) for key, (_, _, size) in self._entries.items()]
+
+    def get_budget_mb(self, device):
+        device = str(device)
+        if device in self.budget_mb:
+            return self.budget_mb[device]
+        if device == AUTO_DEVICE:
+            # Split models were planned against the free memory of every device when they were loaded.
+            return float('inf')
+        self.device_manager.set_device(device)
+        device_info = self.device_manager.get_device_info(verbose=False)
+        return device_info['Total Memory (MB)'] * self.budget_fraction
+
+    def remove(self, model_name, device, precision, backend='torch'):
+        with self._lock:
+            removed = self._entries.pop(self.make_key(model_name, device, precision, backend), None)
+        if removed is not None:
+            self._release_model(removed[0])
+            self._release(str(device))
+
+    def clear(self):
+        with self._lock:
+            devices = {key[1] for key in self._entries}
+            models = [model for model, _, _ in self._entries.values()]
+            self._entries.clear()
+        for model in models:
+            self._release_model(model)
+        for device in devices:
+            self._release(device)
+
+    def _evict(self, device, keep):
+        budget = self.get_budget_mb(device)
+        evicted = False
+        while True:
+            on_device = [key for key in self._entries if key[1] == device]
+            used = sum(self._entries[key][2] for key in on_device)
+            candidates = [key for key in on_device if key != keep]
+            if used <= budget or not candidates:
+                break
+            # OrderedDict keeps the least recently used entries first.
+            self._release_model(self._entries.pop(candidates[0])[0])
+            evicted = True
+        if evicted:
+            self._release(device)
+
+    @staticmethod
+    def _release_model(model):
+        # The compiled forward and its kernels would otherwise stay referenced by the model.
+        decoder = getattr(model, 'compiled_decoder', None)
+        if decoder is not None:
+            decoder.release()
+
+    @staticmethod
+    def _release(device):
+        gc.collect()
+        if device.startswith('cuda'):
+            torch.cuda.empty_cache()
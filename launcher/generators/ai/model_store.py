@@ -0,0 +1,427 @@
+"""
+Local store of the models on disk, and of safetensors variants converted ahead of time.
+
+The index lists every checkpoint found in the Hugging Face cache and in the store with its size, parameter count and
+dtypes, read from the safetensors headers without loading any weights. It is kept in ~/.lcnlp/models/index.json and
+only rescans the files whose size or modification time changed.
+
+convert saves a model once per dtype (fp32, fp16, bf16) as safetensors with its config and tokenizer. Loading a
+variant that already has the target dtype memory-maps the weights as they are: no Hub lookup, no .bin unpickling and
+no cast. int8 models load the fp32 variant and are quantized after loading, as usual.
+
+Variants are checked lazily: every load compares the size and modification time of their files with the manifest
+written by convert, and the files are only hashed again when these changed.
+
+Only convert imports torch and transformers, so the settings dialog can read the index before the model is loaded.
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import struct
+import threading
+
+DEFAULT_STORE_DIR = os.path.join(os.path.expanduser('~'), '.lcnlp', 'models')
+
+# Models offered by the settings dialog even before they were downloaded.
+KNOWN_MODELS = ('gpt2', 'gpt2-medium', 'gpt2-large', 'gpt2-xl', 'EleutherAI/gpt-neo-1.3B', 'EleutherAI/gpt-neo-2.7B',
+                'EleutherAI/gpt-neo-125M', 'EleutherAI/gpt-j-6B', 'distilgpt2')
+
+# Dtypes a model can be converted to, and the variant each precision mode loads from; int8 quantizes the fp32 one.
+VARIANT_DTYPES = ('fp32', 'fp16', 'bf16')
+PRECISION_VARIANTS = {'fp32': 'fp32', 'fp16': 'fp16', 'bf16': 'bf16', 'int8': 'fp32'}
+
+SAFETENSORS_DTYPES = {'F64': 'fp64', 'F32': 'fp32', 'F16': 'fp16', 'BF16': 'bf16', 'I64': 'int64', 'I32': 'int32',
+                      'I16': 'int16', 'I8': 'int8', 'U8': 'uint8', 'BOOL': 'bool'}
+
+# Bumped whenever the layout of the index or of the manifests changes, so they are rebuilt.
+STORE_FORMAT = 1
+
+
+def hub_cache_dir():
+    """
+    Directory of the Hugging Face Hub cache, following the same environment variables as huggingface_hub.
+    """
+    if os.environ.get('HF_HUB_CACHE'):
+        return os.environ['HF_HUB_CACHE']
+    hf_home = os.environ.get('HF_HOME') or os.path.join(
+        os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'), 'huggingface')
+    return os.path.join(hf_home, 'hub')
+
+
+def read_safetensors_header(path):
+    """
+    Read the tensor table of a safetensors file: an 8-byte little-endian length followed by a JSON header.
+
+    :return: Dictionary {tensor name: {'dtype', 'shape', 'data_offsets'}}, without the '__metadata__' entry.
+    """
+    with open(path, 'rb') as file:
+        (length,) = struct.unpack('<Q', file.read(8))
+        header = json.loads(file.read(length))
+    header.pop('__metadata__', None)
+    return header
+
+
+def file_state(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def weight_files(directory):
+    """
+    The weight files of a checkpoint directory, safetensors preferred over PyTorch pickles.
+    """
+    names = sorted(os.listdir(directory))
+    safetensors = [name for name in names if name.endswith('.safetensors')]
+    return safetensors or [name for name in names if name.endswith('.bin') and name.startswith('pytorch_model')]
+
+
+def describe_checkpoint(directory):
+    """
+    Size, parameter count and dtypes of the checkpoint in a directory, read from its config and safetensors headers.
+
+    :return: Dictionary with 'path', 'model_type', 'size_mb', 'parameters', 'dtypes' and the 'files' it was read
+             from with their state; None when the directory holds no weights. Parameters and dtypes are None for
+             .bin checkpoints, which can't be read without unpickling them.
+    """
+    files = weight_files(directory)
+    if not files:
+        return None
+    model_type = None
+    try:
+        with open(os.path.join(directory, 'config.json'), encoding='utf-8') as file:
+            model_type = json.load(file).get('model_type')
+    except (OSError, ValueError):
+        pass
+
+    states = {name: file_state(os.path.join(directory, name)) for name in files}
+    parameters, dtypes = None, None
+    if files[0].endswith('.safetensors'):
+        parameters, dtypes = 0, set()
+        for name in files:
+            for tensor in read_safetensors_header(os.path.join(directory, name)).values():
+                count = 1
+                for size in tensor['shape']:
+                    count *= size
+                parameters += count
+                dtypes.add(SAFETENSORS_DTYPES.get(tensor['dtype'], tensor['dtype'].lower()))
+        dtypes = sorted(dtypes)
+    return {
+        'path': directory,
+        'model_type': model_type,
+        'size_mb': sum(state['size'] for state in states.values()) / (1024 ** 2),
+        'parameters': parameters,
+        'dtypes': dtypes,
+        'files': states,
+    }
+
+
+def format_parameters(parameters):
+    if parameters is None:
+        return "unknown size"
+    if parameters >= 1e9:
+        return f"{parameters / 1e9:.1f}B parameters"
+    return f"{parameters / 1e6:.0f}M parameters"
+
+
+def format_model_info(entry):
+    """
+    One-line description of an index entry for the settings dialog.
+    """
+    if entry is None:
+        return "Not downloaded yet"
+    info = f"{format_parameters(entry['parameters'])}, {entry['size_mb'] / 1024:.1f} GB"
+    if entry['dtypes']:
+        info += f" ({', '.join(entry['dtypes'])})"
+    if entry['variants']:
+        info += f"  |  Converted: {', '.join(sorted(entry['variants']))}"
+    return info
+
+
+class ModelStore:
+    """
+    Index of the models on disk and their converted variants, see the module docstring.
+    """
+
+    def __init__(self, root=DEFAULT_STORE_DIR, hub_cache=None):
+        """
+        :param root: Directory of the converted variants and of the index.
+        :param hub_cache: Hugging Face Hub cache to index, defaults to hub_cache_dir().
+        """
+        self.root = root
+        self.hub_cache = hub_cache if hub_cache is not None else hub_cache_dir()
+        self.index_path = os.path.join(root, 'index.json')
+        self._lock = threading.RLock()
+        self._index = None
+
+    def variant_directory(self, model_name, dtype):
+        return os.path.join(self.root, re.sub(r'[^A-Za-z0-9_.-]+', '_', model_name), dtype)
+
+    def index(self, refresh=False):
+        """
+        The index, read from disk on first use.
+
+        :param refresh: Scan the Hub cache and the store again; files whose state didn't change aren't read again.
+        :return: Dictionary {model name: {'name', 'path', 'model_type', 'size_mb', 'parameters', 'dtypes',
+                 'variants'}}, where 'variants' maps converted dtypes to their directory.
+        """
+        with self._lock:
+            if self._index is None:
+                self._index = self._read_index()
+                if self._index is None:
+                    refresh = True
+                    self._index = {}
+            if refresh:
+                self._index = self._scan(self._index)
+                self._write_index()
+            return self._index
+
+    def cached_index(self):
+        """
+        The index as last scanned, without scanning and without waiting for a scan running on another thread; empty
+        when no scan ever finished.
+        """
+        index = self._index
+        if index is None:
+            index = self._read_index()
+        return index if index is not None else {}
+
+    def model_names(self, index=None):
+        """
+        Names for the settings dialog: the known models, then the other models found on disk.
+
+        :param index: Index to list the models of, defaults to index().
+        """
+        index = index if index is not None else self.index()
+        names = list(KNOWN_MODELS)
+        names += sorted(name for name in index if name not in KNOWN_MODELS)
+        return names
+
+    def describe(self, model_name):
+        return self.index().get(model_name)
+
+    def _read_index(self):
+        try:
+            with open(self.index_path, encoding='utf-8') as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if data.get('format') != STORE_FORMAT:
+            return None
+        return data['models']
+
+    def _write_index(self):
+        os.makedirs(self.root, exist_ok=True)
+        temporary = self.index_path + '.tmp'
+        with open(temporary, 'w', encoding='utf-8') as file:
+            json.dump({'format': STORE_FORMAT, 'models': self._index}, file, indent=1)
+        os.replace(temporary, self.index_path)
+
+    def _scan(self, previous):
+        found = {}
+        for name, directory in self._hub_checkpoints():
+            found[name] = self._describe_cached(previous.get(name), directory)
+        for name, variants in self._converted_variants().items():
+            entry = found.get(name)
+            if entry is None:
+                # Only converted here, e.g. from a local directory; the largest variant describes the model.
+                dtype = next(dtype for dtype in VARIANT_DTYPES if dtype in variants)
+                entry = self._describe_cached(previous.get(name), variants[dtype])
+            if entry is None:
+                continue
+            entry['variants'] = variants
+            found[name] = entry
+        return {name: entry for name, entry in found.items() if entry is not None}
+
+    @staticmethod
+    def _describe_cached(entry, directory):
+        """
+        The entry as it was when its files haven't changed, described again otherwise.
+        """
+        if entry is not None and entry['path'] == directory:
+            try:
+                unchanged = all(file_state(os.path.join(directory, name)) == state
+                                for name, state in entry['files'].items())
+            except OSError:
+                unchanged = False
+            if unchanged and set(entry['files']) == set(weight_files(directory)):
+                return dict(entry, variants={})
+        try:
+            description = describe_checkpoint(directory)
+        except (OSError, ValueError, struct.error) as e:
+            print(f"Can't read the checkpoint in {directory}: {e}")
+            return None
+        if description is not None:
+            description['variants'] = {}
+        return description
+
+    def _hub_checkpoints(self):
+        """
+        (model name, snapshot directory) of every model in the Hub cache, the most recent snapshot of each.
+        """
+        if not os.path.isdir(self.hub_cache):
+            return
+        for entry in sorted(os.listdir(self.hub_cache)):
+            if not entry.startswith('models--'):
+                continue
+            name = entry[len('models--'):].replace('--', '/')
+            snapshots = os.path.join(self.hub_cache, entry, 'snapshots')
+            if not os.path.isdir(snapshots):
+                continue
+            candidates = [os.path.join(snapshots, revision) for revision in os.listdir(snapshots)]
+            candidates = [directory for directory in candidates if weight_files(directory)]
+            if candidates:
+                yield name, max(candidates, key=os.path.getmtime)
+
+    def _converted_variants(self):
+        """
+        {model name: {dtype: directory}} of the complete variants in the store.
+        """
+        variants = {}
+        if not os.path.isdir(self.root):
+            return variants
+        for entry in sorted(os.listdir(self.root)):
+            for dtype in VARIANT_DTYPES:
+                directory = os.path.join(self.root, entry, dtype)
+                manifest = self.read_manifest(directory)
+                if manifest is not None:
+                    variants.setdefault(manifest['model_name'], {})[dtype] = directory
+        return variants
+
+    @staticmethod
+    def read_manifest(directory):
+        try:
+            with open(os.path.join(directory, 'store.json'), encoding='utf-8') as file:
+                manifest = json.load(file)
+        except (OSError, ValueError):
+            return None
+        return manifest if manifest.get('format') == STORE_FORMAT else None
+
+    def verify(self, directory, full=False):
+        """
+        Check the files of a converted variant against its manifest.
+
+        Files whose size and modification time match are trusted; the others, or all of them with full, are hashed
+        and compared with the recorded sha256. Files that were only touched get their new state recorded.
+
+        :return: True when the variant is intact.
+        """
+        manifest = self.read_manifest(directory)
+        if manifest is None:
+            return False
+        touched = False
+        for name, recorded in manifest['files'].items():
+            path = os.path.join(directory, name)
+            try:
+                state = file_state(path)
+            except OSError:
+                return False
+            if state['size'] != recorded['size']:
+                return False
+            if full or state['mtime'] != recorded['mtime']:
+                if file_sha256(path) != recorded['sha256']:
+                    return False
+                if state['mtime'] != recorded['mtime']:
+                    recorded['mtime'] = state['mtime']
+                    touched = True
+        if touched:
+            self._write_manifest(directory, manifest)
+        return True
+
+    @staticmethod
+    def _write_manifest(directory, manifest):
+        with open(os.path.join(directory, 'store.json'), 'w', encoding='utf-8') as file:
+            json.dump(manifest, file, indent=1)
+
+    def resolve(self, model_name, precision):
+        """
+        Where to load a model from: its converted variant for the precision when there is an intact one, else the
+        model name as given.
+
+        A variant in the target dtype is preferred; fp16 and bf16 loads fall back to the fp32 variant, which only
+        needs a cast. A variant that fails its check is removed from the store.
+        """
+        with self._lock:
+            entry = self.index().get(model_name)
+            if entry is None or not entry['variants']:
+                return model_name
+            preferred = PRECISION_VARIANTS.get(precision, 'fp32')
+            for dtype in dict.fromkeys((preferred, 'fp32')):
+                directory = entry['variants'].get(dtype)
+                if directory is None:
+                    continue
+                if self.verify(directory):
+                    return directory
+                print(f"The {dtype} variant of {model_name} is damaged and will be converted again when asked for")
+                shutil.rmtree(directory, ignore_errors=True)
+                del entry['variants'][dtype]
+                self._write_index()
+            return model_name
+
+    def convert(self, model_name, dtypes=('fp32',), log=print):
+        """
+        Save the model as safetensors in every dtype, with its config and tokenizer, replacing earlier variants.
+
+        :param model_name: Name on the Hub or path of a local model directory.
+        :return: {dtype: directory} of the new variants.
+        """
+        import torch
+        import transformers
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+
+        from launcher.generators.ai.precision import PRECISION_DTYPES
+
+        for dtype in dtypes:
+            if dtype not in VARIANT_DTYPES:
+                raise ValueError(f"Unknown variant dtype '{dtype}'. Available dtypes: {list(VARIANT_DTYPES)}")
+
+        converted = {}
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        for dtype in dtypes:
+            log(f"Converting {model_name} to {dtype}")
+            model = AutoModelForCausalLM.from_pretrained(model_name, torch_dtype=PRECISION_DTYPES[dtype],
+                                                         low_cpu_mem_usage=True)
+            directory = self.variant_directory(model_name, dtype)
+            # Written next to the final directory and renamed once complete, so a partial variant is never used.
+            temporary = directory + '.tmp'
+            shutil.rmtree(temporary, ignore_errors=True)
+            model.save_pretrained(temporary, safe_serialization=True)
+            tokenizer.save_pretrained(temporary)
+            del model
+
+            files = {}
+            for name in weight_files(temporary):
+                path = os.path.join(temporary, name)
+                files[name] = dict(file_state(path), sha256=file_sha256(path))
+            self._write_manifest(temporary, {
+                'format': STORE_FORMAT,
+                'model_name': model_name,
+                'dtype': dtype,
+                'transformers': transformers.__version__,
+                'torch': torch.__version__,
+                'files': files,
+            })
+            shutil.rmtree(directory, ignore_errors=True)
+            os.replace(temporary, directory)
+            converted[dtype] = directory
+            log(f"Saved {directory}")
+
+        self.index(refresh=True)
+        return converted
+
+    def remove(self, model_name, dtypes=VARIANT_DTYPES):
+        """
+        Delete converted variants of a model.
+        """
+        for dtype in dtypes:
+            shutil.rmtree(self.variant_directory(model_name, dtype), ignore_errors=True)
+        self.index(refresh=True)
@@ -0,0 +1,42 @@
+"""
+Sampling parameters understood by AdvancedTextGenerator.generate_text, with the ranges the settings dialog allows,
+and the available precision modes and backends.
+
+Kept free of torch and transformers imports so the GUI can use it before the generator is loaded.
+"""
+
+# Precision modes a model can be loaded in, see launcher.generators.ai.precision.
+PRECISIONS = ('fp32', 'fp16', 'bf16', 'int8')
+
+# Engines a model can run on, see launcher.generators.backends.registry.
+BACKENDS = ('torch', 'onnx')
+
+# name: (type, minimum, maximum, default)
+SAMPLING_PARAMETERS = {
+    'max_length': (int, 1, 4096, 50),
+    'temperature': (float, 0.1, 2.0, 1.0),
+    'top_k': (int, 0, 100, 50),
+    'top_p': (float, 0.0, 1.0, 0.95),
+    'repetition_penalty': (float, 1.0, 2.0, 1.0),
+}
+
+
+def validate_sampling_parameters(values):
+    """
+    Check sampling parameters against SAMPLING_PARAMETERS and fill in the defaults.
+
+    :param values: Dictionary with some or all of the sampling parameters. Other keys are ignored.
+    :return: Dictionary with all sampling parameters converted to their type.
+    """
+    parameters = {}
+    for name, (value_type, minimum, maximum, default) in SAMPLING_PARAMETERS.items():
+        value = values.get(name, default)
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError(f"'{name}' must be a number, got {value!r}")
+        if value_type is int and value != int(value):
+            raise ValueError(f"'{name}' must be an integer, got {value!r}")
+        value = value_type(value)
+        if not minimum <= value <= maximum:
+            raise ValueError(f"'{name}' must be between {minimum} and {maximum}, got {value}")
+        parameters[name] = value
+    return parameters
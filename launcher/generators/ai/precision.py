@@ -0,0 +1,96 @@
+import torch
+from torch import nn
+from transformers.pytorch_utils import Conv1D
+
+from launcher.generators.ai.parameters import PRECISIONS
+
+PRECISION_DTYPES = {
+    'fp32': torch.float32,
+    'fp16': torch.float16,
+    'bf16': torch.bfloat16,
+    # int8 dynamic quantization keeps fp32 activations and quantizes the Linear weights after loading.
+    'int8': torch.float32,
+}
+
+
+def precision_from_half(half_model_accuracy):
+    return 'fp16' if half_model_accuracy else 'fp32'
+
+
+def check_precision(precision, device):
+    """
+    Raise ValueError if the precision mode can't run on the device.
+
+    :param precision: One of PRECISIONS.
+    :param device: torch.device the model will run on.
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision '{precision}'. Available precisions: {list(PRECISIONS)}")
+    if precision == 'fp16' and device.type != 'cuda':
+        raise ValueError("fp16 is only supported on CUDA devices, use bf16 or int8 on CPU")
+    if precision == 'bf16' and device.type == 'cuda':
+        with torch.cuda.device(device):
+            if not torch.cuda.is_bf16_supported():
+                raise ValueError(f"{device} does not support bf16, use fp16 instead")
+    if precision == 'int8':
+        if device.type != 'cpu':
+            raise ValueError("int8 dynamic quantization is only supported on CPU")
+        if _quantization_engine() is None:
+            raise ValueError("This CPU has no quantized kernels (fbgemm, x86 or qnnpack) for int8")
+
+
+def supported_precisions(device):
+    """
+    List the precision modes that can run on the device.
+    """
+    supported = []
+    for precision in PRECISIONS:
+        try:
+            check_precision(precision, device)
+        except ValueError:
+            continue
+        supported.append(precision)
+    return supported
+
+
+def apply_precision(model, precision):
+    """
+    Cast or quantize a loaded model to the precision mode.
+
+    :return: The converted model.
+    """
+    if precision == 'int8':
+        torch.backends.quantized.engine = _quantization_engine()
+        # GPT-2 implements its projections as Conv1D, which quantize_dynamic doesn't know about.
+        _replace_conv1d_with_linear(model)
+        # The lm_head is tied to the token embeddings; quantizing it would add an int8 copy next to the fp32 weights
+        # the embeddings keep, so it stays in fp32 with them.
+        output_embeddings = model.get_output_embeddings()
+        names = {name for name, module in model.named_modules()
+                 if isinstance(module, nn.Linear) and module is not output_embeddings}
+        return torch.ao.quantization.quantize_dynamic(model, names, dtype=torch.qint8)
+    dtype = PRECISION_DTYPES[precision]
+    if dtype != torch.float32:
+        model = model.to(dtype)
+    return model
+
+
+def _quantization_engine():
+    engines = torch.backends.quantized.supported_engines
+    for engine in ('x86', 'fbgemm', 'qnnpack'):
+        if engine in engines:
+            return engine
+    return None
+
+
+def _replace_conv1d_with_linear(module):
+    for name, child in module.named_children():
+        if isinstance(child, Conv1D):
+            # Conv1D stores its weight as (in_features, out_features), the transpose of nn.Linear.
+            linear = nn.Linear(child.weight.shape[0], child.weight.shape[1], device=child.weight.device,
+                               dtype=child.weight.dtype)
+            linear.weight.data = child.weight.data.t().contiguous()
+            linear.bias.data = child.bias.data
+            setattr(module, name, linear)
+        else:
+            _replace_conv1d_with_linear(child)
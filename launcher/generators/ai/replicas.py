@@ -0,0 +1,299 @@
+import os
+import queue
+import threading
+from concurrent.futures import Future
+
+import torch.multiprocessing as multiprocessing
+
+from launcher.utils.devices.cpu_tuning import affinity_options, apply_cpu_settings
+
+
+def partition_cpus(replicas):
+    """
+    Split the CPUs into one contiguous core set per replica, using one logical CPU per physical core when the
+    topology is known.
+
+    :return: List of CPU lists, or a list of None when affinity isn't supported.
+    """
+    options = affinity_options()
+    cpus = options.get('physical') or options['all']
+    if cpus is None:
+        return [None] * replicas
+    if len(cpus) < replicas:
+        raise ValueError(f"Can't pin {replicas} replicas to {len(cpus)} CPUs")
+    size, extra = divmod(len(cpus), replicas)
+    core_sets = []
+    start = 0
+    for index in range(replicas):
+        end = start + size + (1 if index < extra else 0)
+        core_sets.append(cpus[start:end])
+        start = end
+    return core_sets
+
+
+def _replica_main(index, cpus, num_threads, model_source, requests, results):
+    """
+    Entry point of a replica process: serve the requests of its queue with its own AdvancedTextGenerator.
+    """
+    apply_cpu_settings({'cpus': cpus, 'num_threads': num_threads})
+    from launcher.generators.ai.NLP_Generator import AdvancedTextGenerator
+
+    # The machine-wide profile would undo the cores and threads this replica was given.
+    generator = AdvancedTextGenerator(model_name=model_source['model_name'], device_id='cpu',
+                                      precision=model_source['precision'], load_on_init=False, cpu_tuning=False,
+                                      apply_cpu_profiles=False, backend=model_source['backend'])
+    if model_source.get('prepared') is not None:
+        generator.apply_model(model_source['prepared'])
+    else:
+        generator.apply_model(generator.prepare_model(model_source['model_name'],
+                                                      draft_model_name=model_source.get('draft_model_name')))
+    results.put((index, None, 'ready', os.getpid()))
+
+    while True:
+        job = requests.get()
+        if job is None:
+            return
+        job_id, prompt, params, stream = job
+        on_text = (lambda piece: results.put((index, job_id, 'text', piece))) if stream else None
+        try:
+            text = generator.generate_text(prompt, on_text=on_text, **params)
+        except Exception as e:
+            results.put((index, job_id, 'error', f"{type(e).__name__}: {e}"))
+        else:
+            results.put((index, job_id, 'done', text))
+
+
+class ReplicaJob:
+    """
+    A prompt waiting for, or running on, a replica.
+    """
+
+    def __init__(self, job_id, prompt, params, on_text=None, cancel_event=None):
+        self.job_id = job_id
+        self.prompt = prompt
+        self.params = params
+        self.on_text = on_text
+        self.cancel_event = cancel_event
+        self.future = Future()
+
+
+class ReplicaPool:
+    """
+    Serves generations with several CPU replicas of a model, each in its own process pinned to its own cores.
+
+    The model, and the draft model for speculative decoding if the generator has one, is loaded once in this process
+    and its weights are moved to shared memory, so the replicas map the same pages instead of holding a copy each.
+    Quantized int8 weights can't be shared this way and are copied. A dispatcher thread hands every prompt to the
+    first idle replica and restarts replicas that crashed; the prompt a crashed replica was running fails. A replica
+    that exits before it is ready (e.g. the model doesn't load) isn't restarted.
+
+    Offers the same submit/start/stop interface as GenerationScheduler, so InferenceHTTPServer can use either.
+    """
+
+    def __init__(self, generator, replicas=None, threads_per_replica=None, share_weights=True):
+        """
+        :param generator: AdvancedTextGenerator with the model loaded on CPU.
+        :param replicas: Number of processes, defaults to one per 4 physical cores.
+        :param threads_per_replica: Intra-op threads per replica, defaults to the size of its core set.
+        :param share_weights: Share the loaded weights with the replicas instead of loading them in every process.
+        """
+        if generator.model is None or generator.device.type != 'cpu':
+            raise ValueError("Replicas need a model loaded on CPU")
+        if replicas is None:
+            replicas = max(1, (generator.get_cpu_info()['CPU Cores'] or 1) // 4)
+        self.generator = generator
+        self.core_sets = partition_cpus(replicas)
+        self.threads_per_replica = threads_per_replica
+        self.restarts = 0
+        self._context = multiprocessing.get_context('spawn')
+        self._results = self._context.Queue()
+        self._model_source = {'model_name': generator.model_name, 'precision': generator.precision,
+                              'backend': generator.backend.name, 'draft_model_name': generator.draft_model_name,
+                              'prepared': None}
+        # Only PyTorch weights can be moved to shared memory, other backends load from their own disk cache.
+        if share_weights and generator.backend.name == 'torch':
+            self._share_weights()
+        self._processes = [None] * replicas
+        self._requests = [None] * replicas
+        self._running = [None] * replicas
+        self._ready = [False] * replicas
+        self._idle = []
+        self._pending = queue.Queue()
+        self._jobs = {}
+        self._next_job_id = 0
+        self._lock = threading.Lock()
+        self._dispatcher = None
+        self._stopping = threading.Event()
+
+    def _share_weights(self):
+        generator = self.generator
+        try:
+            generator.model.share_memory()
+            if generator.draft_model is not None:
+                generator.draft_model.share_memory()
+        except RuntimeError as e:
+            # E.g. /dev/shm is too small, every replica loads its own copy instead.
+            print(f"Can't share the model weights, replicas will load their own copy: {e}")
+            return
+        self._model_source['prepared'] = {
+            'model_name': generator.model_name,
+            'device': generator.device,
+            'precision': generator.precision,
+            'model': generator.model,
+            'tokenizer': generator.tokenizer,
+            'draft_model_name': generator.draft_model_name,
+            'draft_model': generator.draft_model,
+        }
+
+    def start(self):
+        with self._lock:
+            if self._dispatcher is not None:
+                return self
+            self._stopping.clear()
+            for index in range(len(self._processes)):
+                self._start_replica(index)
+            self._dispatcher = threading.Thread(target=self._dispatch, name='ReplicaDispatcher', daemon=True)
+            self._dispatcher.start()
+        return self
+
+    def stop(self, wait=True):
+        with self._lock:
+            dispatcher = self._dispatcher
+            self._dispatcher = None
+        if dispatcher is None:
+            return
+        self._stopping.set()
+        for requests in self._requests:
+            requests.put(None)
+        if wait:
+            dispatcher.join()
+            for process in self._processes:
+                if process is not None:
+                    process.join()
+
+    def submit(self, prompt, max_length=50, temperature=1.0, top_k=50, top_p=0.95, repetition_penalty=1.0,
+               on_text=None, do_sample=True, seed=None, stop_strings=None, cancel_event=None, deadline=None):
+        """
+        Queue a prompt for the next idle replica.
+
+        :param cancel_event: Optional threading.Event; only honoured until the prompt is handed to a replica, the
+                             replica then finishes it.
+        :param deadline: Optional time.monotonic() timestamp, checked by the replica after every token.
+        :return: Future resolving to the generated text.
+        """
+        params = {
+            'max_length': max_length,
+            'temperature': temperature,
+            'top_k': top_k,
+            'top_p': top_p,
+            'repetition_penalty': repetition_penalty,
+            'do_sample': do_sample,
+            'seed': seed,
+            'stop_strings': tuple(stop_strings or ()),
+            # time.monotonic() is the same clock in every process of the machine.
+            'deadline': deadline
+        }
+        self.start()
+        with self._lock:
+            job = ReplicaJob(self._next_job_id, prompt, params, on_text, cancel_event)
+            self._next_job_id += 1
+            self._jobs[job.job_id] = job
+        self._pending.put(job)
+        return job.future
+
+    def _start_replica(self, index):
+        cpus = self.core_sets[index]
+        num_threads = self.threads_per_replica or (len(cpus) if cpus else
+                                                   max(1, os.cpu_count() // len(self._processes)))
+        self._requests[index] = self._context.Queue()
+        self._running[index] = None
+        self._ready[index] = False
+        process = self._context.Process(target=_replica_main, name=f'Replica-{index}', daemon=True,
+                                        args=(index, cpus, num_threads, self._model_source, self._requests[index],
+                                              self._results))
+        process.start()
+        self._processes[index] = process
+
+    def _dispatch(self):
+        while not self._stopping.is_set():
+            self._restart_crashed()
+            self._assign_pending()
+            try:
+                index, job_id, kind, payload = self._results.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+            if kind == 'ready':
+                self._ready[index] = True
+                self._idle.append(index)
+                continue
+            job = self._jobs.get(job_id)
+            if job is None:
+                continue
+            if kind == 'text':
+                if job.on_text is not None:
+                    job.on_text(payload)
+                continue
+
+            with self._lock:
+                del self._jobs[job_id]
+            self._running[index] = None
+            self._idle.append(index)
+            if kind == 'done':
+                job.future.set_result(payload)
+            else:
+                job.future.set_exception(RuntimeError(payload))
+
+        with self._lock:
+            jobs = list(self._jobs.values())
+            self._jobs.clear()
+        for job in jobs:
+            if job.future.running() or job.future.set_running_or_notify_cancel():
+                job.future.set_exception(RuntimeError("The replica pool was stopped"))
+
+    def _assign_pending(self):
+        while self._idle:
+            try:
+                job = self._pending.get_nowait()
+            except queue.Empty:
+                return
+            if job.cancel_event is not None and job.cancel_event.is_set():
+                job.future.cancel()
+            if not job.future.set_running_or_notify_cancel():
+                with self._lock:
+                    del self._jobs[job.job_id]
+                continue
+            index = self._idle.pop(0)
+            self._running[index] = job
+            self._requests[index].put((job.job_id, job.prompt, job.params, job.on_text is not None))
+
+    def _restart_crashed(self):
+        for index, process in enumerate(self._processes):
+            if process is None or process.is_alive():
+                continue
+            job = self._running[index]
+            if job is not None:
+                with self._lock:
+                    self._jobs.pop(job.job_id, None)
+                job.future.set_exception(RuntimeError(f"Replica {index} exited with code {process.exitcode}"))
+            if index in self._idle:
+                self._idle.remove(index)
+            if not self._ready[index]:
+                print(f"Replica {index} exited with code {process.exitcode} before it was ready")
+                self._processes[index] = None
+                continue
+            print(f"Replica {index} exited with code {process.exitcode}, restarting it")
+            self.restarts += 1
+            self._start_replica(index)
+
+        if not any(self._processes):
+            # No replica left to serve what is queued.
+            while True:
+                try:
+                    job = self._pending.get_nowait()
+                except queue.Empty:
+                    break
+                with self._lock:
+                    self._jobs.pop(job.job_id, None)
+                if job.future.set_running_or_notify_cancel():
+                    job.future.set_exception(RuntimeError("No replica could start"))
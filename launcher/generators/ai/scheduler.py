@@ -0,0 +1,196 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from launcher.generators.ai.admission import AdmissionRejected
+
+
+class GenerationRequest:
+    """
+    A prompt waiting in the GenerationScheduler queue.
+    """
+
+    def __init__(self, prompt, params, on_text=None, cancel_event=None, deadline=None):
+        self.prompt = prompt
+        self.params = params
+        self.on_text = on_text
+        self.cancel_event = cancel_event
+        self.deadline = deadline
+        self.future = Future()
+
+    def batch_key(self):
+        # Only requests with identical sampling parameters can share a model.generate call.
+        return tuple(sorted(self.params.items()))
+
+
+class ScheduledCall:
+    """
+    A callable that needs the model to itself, e.g. a conversation turn or a model swap.
+    """
+
+    def __init__(self, function, args, kwargs):
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+
+
+class GenerationScheduler:
+    """
+    Single owner of an AdvancedTextGenerator's model.
+
+    Requests are queued and served by one worker thread in the order they arrived. Generation requests that are
+    waiting at the same moment and share their sampling parameters are grouped into one padded batch. Every caller
+    gets a Future resolving to its own result.
+    """
+
+    def __init__(self, generator, max_batch_size=8, batch_wait=0.0):
+        """
+        :param max_batch_size: Maximum number of prompts per model.generate call.
+        :param batch_wait: Seconds to wait for more requests before running a batch.
+        """
+        self.generator = generator
+        self.max_batch_size = max_batch_size
+        self.batch_wait = batch_wait
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='GenerationScheduler', daemon=True)
+                self._thread.start()
+        return self
+
+    def stop(self, wait=True):
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is not None:
+            self._queue.put(None)
+            if wait:
+                thread.join()
+
+    def submit(self, prompt, max_length=50, temperature=1.0, top_k=50, top_p=0.95, repetition_penalty=1.0,
+               on_text=None, do_sample=True, seed=None, stop_strings=None, cancel_event=None, deadline=None):
+        """
+        Queue a prompt for AdvancedTextGenerator.generate_text.
+
+        :param cancel_event: Optional threading.Event; set before the prompt runs, its Future is cancelled, set while
+                             it runs, generation stops and the Future resolves to the text so far.
+        :param deadline: Optional time.monotonic() timestamp, including the time spent in the queue. Past it before
+                         the prompt runs, the Future fails with TimeoutError.
+        :return: Future resolving to the generated text.
+        """
+        params = {
+            'max_length': max_length,
+            'temperature': temperature,
+            'top_k': top_k,
+            'top_p': top_p,
+            'repetition_penalty': repetition_penalty,
+            'do_sample': do_sample,
+            'seed': seed,
+            'stop_strings': tuple(stop_strings or ())
+        }
+        return self._put(GenerationRequest(prompt, params, on_text, cancel_event, deadline))
+
+    def submit_call(self, function, *args, **kwargs):
+        """
+        Queue a callable that runs alone on the worker thread, between batches.
+
+        :return: Future resolving to the callable's return value.
+        """
+        return self._put(ScheduledCall(function, args, kwargs))
+
+    def _put(self, item):
+        self.start()
+        self._queue.put(item)
+        return item.future
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            pending = [item]
+            if self.batch_wait:
+                time.sleep(self.batch_wait)
+            stop = False
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                pending.append(item)
+
+            self._process(pending)
+            if stop:
+                return
+
+    def _process(self, pending):
+        requests = []
+        for item in pending:
+            if isinstance(item, ScheduledCall):
+                # Calls act as barriers: everything queued before them is served first.
+                self._run_requests(requests)
+                requests = []
+                self._run_call(item)
+            elif item.cancel_event is not None and item.cancel_event.is_set():
+                item.future.cancel()
+            elif item.deadline is not None and time.monotonic() >= item.deadline:
+                if item.future.set_running_or_notify_cancel():
+                    item.future.set_exception(TimeoutError("The deadline passed before the prompt was generated"))
+            elif item.future.set_running_or_notify_cancel():
+                requests.append(item)
+        self._run_requests(requests)
+
+    def _run_requests(self, requests):
+        groups = {}
+        for request in requests:
+            groups.setdefault(request.batch_key(), []).append(request)
+        for group in groups.values():
+            for start in range(0, len(group), self.max_batch_size):
+                self._run_batch(group[start:start + self.max_batch_size])
+
+    def _run_batch(self, batch):
+        try:
+            if len(batch) == 1:
+                request = batch[0]
+                results = [self.generator.generate_text(request.prompt, on_text=request.on_text,
+                                                        cancel_event=request.cancel_event, deadline=request.deadline,
+                                                        **request.params)]
+            else:
+                results = self.generator.generate_batch([request.prompt for request in batch],
+                                                        on_text=[request.on_text for request in batch],
+                                                        cancel_events=[request.cancel_event for request in batch],
+                                                        deadlines=[request.deadline for request in batch],
+                                                        **batch[0].params)
+        except AdmissionRejected as e:
+            if len(batch) == 1:
+                batch[0].future.set_exception(e)
+                return
+            # A batch too big for the free memory may still fit in halves.
+            middle = len(batch) // 2
+            self._run_batch(batch[:middle])
+            self._run_batch(batch[middle:])
+            return
+        except Exception as e:
+            for request in batch:
+                request.future.set_exception(e)
+            return
+        for request, result in zip(batch, results):
+            request.future.set_result(result)
+
+    @staticmethod
+    def _run_call(call):
+        if not call.future.set_running_or_notify_cancel():
+            return
+        try:
+            call.future.set_result(call.function(*call.args, **call.kwargs))
+        except Exception as e:
+            call.future.set_exception(e)
@@ -0,0 +1,41 @@
+"""
+Draft models for speculative decoding.
+
+A small draft model from the same tokenizer family proposes a few tokens, the large model checks all of them in one
+forward pass (transformers' assisted generation). With sampling, the accepted tokens follow the large model's own
+distribution, so only the speed changes.
+"""
+
+# Large model: the small model of the same family used as its draft.
+DRAFT_MODELS = {
+    'gpt2-medium': 'distilgpt2',
+    'gpt2-large': 'distilgpt2',
+    'gpt2-xl': 'distilgpt2',
+    'EleutherAI/gpt-neo-1.3B': 'EleutherAI/gpt-neo-125M',
+    'EleutherAI/gpt-neo-2.7B': 'EleutherAI/gpt-neo-125M',
+}
+
+# Number of tokens the draft model proposes per step at first; transformers adapts it to the acceptance rate.
+NUM_DRAFT_TOKENS = 5
+
+
+def default_draft_model(model_name):
+    """
+    Return the draft model for a model from the settings dialog, or None if it has none.
+    """
+    return DRAFT_MODELS.get(model_name)
+
+
+def check_draft_compatible(tokenizer, draft_tokenizer):
+    """
+    Raise ValueError unless both tokenizers map text to the same token ids.
+    """
+    if tokenizer.get_vocab() != draft_tokenizer.get_vocab():
+        raise ValueError("The draft model must use the same tokenizer as the model it drafts for")
+
+
+def configure_draft_model(draft_model):
+    generation_config = draft_model.generation_config
+    generation_config.num_assistant_tokens = NUM_DRAFT_TOKENS
+    generation_config.num_assistant_tokens_schedule = 'heuristic'
+    return draft_model
@@ -0,0 +1,128 @@
+"""
+Early exit for model.generate: cancellation, deadlines and stop strings.
+
+All of them are checked after every decoding step, through transformers' stopping criteria, which decide per row of
+a batch. A finished row is padded until the others are done, so one cancelled prompt doesn't stop its batch mates.
+"""
+import time
+
+import torch
+from transformers import StoppingCriteria, StoppingCriteriaList
+
+
+class CancellationCriteria(StoppingCriteria):
+    """
+    Stop the rows whose threading.Event is set.
+    """
+
+    def __init__(self, cancel_events):
+        """
+        :param cancel_events: One threading.Event (or None) per row of the batch.
+        """
+        self.cancel_events = cancel_events
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.tensor([event is not None and event.is_set() for event in self.cancel_events],
+                            dtype=torch.bool, device=input_ids.device)
+
+
+class DeadlineCriteria(StoppingCriteria):
+    """
+    Stop the rows whose deadline has passed.
+    """
+
+    def __init__(self, deadlines):
+        """
+        :param deadlines: One time.monotonic() timestamp (or None) per row of the batch.
+        """
+        self.deadlines = deadlines
+
+    def __call__(self, input_ids, scores, **kwargs):
+        now = time.monotonic()
+        return torch.tensor([deadline is not None and now >= deadline for deadline in self.deadlines],
+                            dtype=torch.bool, device=input_ids.device)
+
+
+def build_stopping_criteria(cancel_events=None, deadlines=None):
+    """
+    Build the criteria for one generate call from per-row cancel events and deadlines.
+
+    :return: StoppingCriteriaList, or None when no row can be cancelled or time out.
+    """
+    criteria = StoppingCriteriaList()
+    if cancel_events is not None and any(event is not None for event in cancel_events):
+        criteria.append(CancellationCriteria(cancel_events))
+    if deadlines is not None and any(deadline is not None for deadline in deadlines):
+        criteria.append(DeadlineCriteria(deadlines))
+    return criteria or None
+
+
+def stopped_early(cancel_event=None, deadline=None):
+    """
+    Whether a generation was cut short by its cancel event or its deadline, so its result must not be cached.
+    """
+    return (cancel_event is not None and cancel_event.is_set()) or (deadline is not None
+                                                                      and time.monotonic() >= deadline)
+
+
+def trim_at_stop_strings(text, stop_strings):
+    """
+    Cut the text at the first stop string it contains, which is left out.
+    """
+    if not stop_strings:
+        return text
+    positions = [text.find(stop_string) for stop_string in stop_strings]
+    positions = [position for position in positions if position >= 0]
+    return text[:min(positions)] if positions else text
+
+
+class StopStringFilter:
+    """
+    Wraps a streaming callback so that stop strings never reach it.
+
+    Text that could be the beginning of a stop string is held back until the next pieces show whether it is one.
+    Once a stop string appears, only the text before it is passed on and everything after is dropped.
+    """
+
+    def __init__(self, callback, stop_strings):
+        self.callback = callback
+        self.stop_strings = [stop_string for stop_string in stop_strings if stop_string]
+        self.pending = ''
+        self.stopped = False
+
+    def __call__(self, text):
+        if self.stopped:
+            return
+        self.pending += text
+        trimmed = trim_at_stop_strings(self.pending, self.stop_strings)
+        if len(trimmed) < len(self.pending):
+            self.stopped = True
+            self._emit(trimmed)
+            return
+        split = len(self.pending) - self._held_back_length()
+        ready, held = self.pending[:split], self.pending[split:]
+        self._emit(ready)
+        self.pending = held
+
+    def flush(self):
+        """
+        Pass on the held-back text once the generation is over.
+        """
+        if not self.stopped:
+            self._emit(self.pending)
+        self.pending = ''
+
+    def _held_back_length(self):
+        # Longest end of the pending text that starts a stop string.
+        longest = 0
+        for stop_string in self.stop_strings:
+            for length in range(min(len(stop_string) - 1, len(self.pending)), longest, -1):
+                if self.pending.endswith(stop_string[:length]):
+                    longest = length
+                    break
+        return longest
+
+    def _emit(self, text):
+        self.pending = ''
+        if text:
+            self.callback(text)
@@ -0,0 +1,62 @@
+import os
+
+import torch
+from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+from transformers import GPT2Config, GPT2LMHeadModel, GPTNeoConfig, GPTNeoForCausalLM, PreTrainedTokenizerFast
+
+# Tiny randomly-initialized stand-ins for the model families in the settings dialog. They load without network
+# access, so benchmarks and the headless server can be exercised offline.
+TINY_MODEL_FAMILIES = ('gpt2', 'gpt-neo')
+
+_EOS_TOKEN = '<|endoftext|>'
+_CORPUS = [
+    "What is quasar? A quasar is an extremely luminous active galactic nucleus.",
+    "The quick brown fox jumps over the lazy dog.",
+    "Local natural language processing models generate text one token at a time.",
+    "Temperature, top-k and top-p control how the next token is sampled.",
+    "0123456789 ,.;:!?'\"()[]{}<>-+*/=_@#$%&|\\~`^",
+]
+
+
+def create_tiny_model(directory, family='gpt2', vocab_size=512, hidden_size=64, num_layers=2, num_heads=2,
+                      context_size=256, seed=0):
+    """
+    Save a tiny randomly-initialized causal LM and a matching byte-level BPE tokenizer to a directory.
+
+    :param family: 'gpt2' or 'gpt-neo'.
+    :return: The directory, which can be passed as model name to AdvancedTextGenerator.
+    """
+    if family not in TINY_MODEL_FAMILIES:
+        raise ValueError(f"Unknown tiny model family '{family}'. Available families: {list(TINY_MODEL_FAMILIES)}")
+    if os.path.exists(os.path.join(directory, 'config.json')):
+        return directory
+    os.makedirs(directory, exist_ok=True)
+
+    tokenizer = Tokenizer(models.BPE())
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    trainer = trainers.BpeTrainer(vocab_size=vocab_size, special_tokens=[_EOS_TOKEN],
+                                  initial_alphabet=pre_tokenizers.ByteLevel.alphabet())
+    tokenizer.train_from_iterator(_CORPUS, trainer=trainer)
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=tokenizer, bos_token=_EOS_TOKEN, eos_token=_EOS_TOKEN,
+                                        unk_token=_EOS_TOKEN, model_max_length=context_size)
+    tokenizer.save_pretrained(directory)
+
+    eos_token_id = tokenizer.convert_tokens_to_ids(_EOS_TOKEN)
+    torch.manual_seed(seed)
+    if family == 'gpt2':
+        config = GPT2Config(vocab_size=len(tokenizer), n_positions=context_size, n_embd=hidden_size,
+                            n_layer=num_layers, n_head=num_heads, bos_token_id=eos_token_id,
+                            eos_token_id=eos_token_id)
+        model = GPT2LMHeadModel(config)
+    else:
+        # GPT-Neo alternates global and local attention layers.
+        attention_types = [[['global', 'local'], num_layers // 2]] if num_layers % 2 == 0 else \
+            [[['global'], num_layers]]
+        config = GPTNeoConfig(vocab_size=len(tokenizer), max_position_embeddings=context_size,
+                              hidden_size=hidden_size, num_layers=num_layers, num_heads=num_heads,
+                              attention_types=attention_types,
+                              window_size=context_size // 4, bos_token_id=eos_token_id, eos_token_id=eos_token_id)
+        model = GPTNeoForCausalLM(config)
+    model.save_pretrained(directory, safe_serialization=True)
+    return directory
@@ -0,0 +1,169 @@
+"""
+Inference backends: the engines AdvancedTextGenerator runs its models with.
+
+A backend loads a (model, tokenizer) pair for a device and precision. The model it returns must offer the
+model.generate interface of transformers for the arguments AdvancedTextGenerator passes, along with config, device and
+dtype attributes. PyTorch models have all of it already. Other engines subclass BackendModel, implement prefill and
+decode_step over their own key/value cache, and get generate from its sampling loop.
+"""
+import torch
+from transformers import (LogitsProcessorList, MinNewTokensLengthLogitsProcessor, RepetitionPenaltyLogitsProcessor,
+                          StoppingCriteriaList, StopStringCriteria, TemperatureLogitsWarper, TopKLogitsWarper,
+                          TopPLogitsWarper)
+from transformers.generation.utils import GenerateDecoderOnlyOutput
+
+
+class InferenceBackend:
+    """
+    Loads models for one engine.
+    """
+
+    # Identifier used in settings, command lines and model pool keys.
+    name = None
+    # Shown in the settings dialog.
+    label = None
+
+    def is_available(self):
+        """
+        Whether the packages the engine needs are installed.
+        """
+        return True
+
+    def check(self, device, precision):
+        """
+        Raise ValueError when the engine can't run the precision on the device.
+        """
+        raise NotImplementedError
+
+    def load(self, model_name, device, precision, report, load_metrics=None, placement=None):
+        """
+        Load the tokenizer and model.
+
+        :param report: Callable receiving (stage, percent) at every loading stage, raising to cancel the load.
+        :param load_metrics: Optional dictionary receiving load_s, peak_rss_mb, rss_increase_mb and peak_vram_mb,
+                             and the directory of the model store variant it was loaded from under variant.
+        :param placement: Optional plan from plan_placement to split the model across devices.
+        :return: (model, tokenizer)
+        """
+        raise NotImplementedError
+
+
+class BackendModel:
+    """
+    Model of an engine other than PyTorch, generating with a sampling loop over prefill and decode_step.
+
+    Key/values go in and out of generate in the legacy format of transformers, a tuple of (key, value) tensor pairs
+    per layer, so the prefix cache and conversations reuse them as with PyTorch models. In between, they stay in
+    whatever form the engine keeps them.
+    """
+
+    def __init__(self, config, device, dtype):
+        self.config = config
+        self.device = device
+        self.dtype = dtype
+
+    def prefill(self, input_ids, attention_mask, past_key_values=None):
+        """
+        Run the prompt through the model.
+
+        :param input_ids: Tokens not covered by past_key_values yet, (batch, tokens).
+        :param attention_mask: Mask of the past and new tokens, (batch, past + tokens).
+        :param past_key_values: Optional legacy key/values of the earlier tokens.
+        :return: (logits of the last position, engine key/values)
+        """
+        raise NotImplementedError
+
+    def decode_step(self, input_ids, attention_mask, past):
+        """
+        Run one new token per row through the model.
+
+        :param input_ids: (batch, 1)
+        :param past: Engine key/values returned by the previous prefill or decode_step.
+        :return: (logits, engine key/values)
+        """
+        raise NotImplementedError
+
+    def legacy_key_values(self, past):
+        """
+        Convert engine key/values to the legacy format of transformers.
+        """
+        raise NotImplementedError
+
+    def size_mb(self):
+        """
+        Memory taken by the weights, in MB.
+        """
+        return 0.0
+
+    def eval(self):
+        return self
+
+    @torch.no_grad()
+    def generate(self, input_ids, attention_mask=None, past_key_values=None, max_length=None, max_new_tokens=None,
+                 min_new_tokens=None, temperature=1.0, top_k=50, top_p=1.0, repetition_penalty=1.0, do_sample=False,
+                 pad_token_id=None, eos_token_id=None, streamer=None, stopping_criteria=None, stop_strings=None,
+                 tokenizer=None, return_dict_in_generate=False, assistant_model=None, **unused):
+        """
+        Same as model.generate of transformers for the arguments it takes.
+        """
+        if assistant_model is not None:
+            raise ValueError("Assisted generation needs PyTorch models")
+        if attention_mask is None:
+            attention_mask = torch.ones_like(input_ids)
+        if eos_token_id is None:
+            eos_token_id = self.config.eos_token_id
+        if pad_token_id is None:
+            pad_token_id = eos_token_id
+        prompt_length = input_ids.shape[-1]
+        if max_new_tokens is None:
+            max_new_tokens = (max_length or prompt_length + 20) - prompt_length
+
+        processors = LogitsProcessorList()
+        if repetition_penalty != 1.0:
+            processors.append(RepetitionPenaltyLogitsProcessor(repetition_penalty))
+        if min_new_tokens and eos_token_id is not None:
+            processors.append(MinNewTokensLengthLogitsProcessor(prompt_length, min_new_tokens, eos_token_id))
+        if do_sample:
+            if temperature != 1.0:
+                processors.append(TemperatureLogitsWarper(temperature))
+            if top_k:
+                processors.append(TopKLogitsWarper(top_k))
+            if top_p < 1.0:
+                processors.append(TopPLogitsWarper(top_p))
+        criteria = StoppingCriteriaList(stopping_criteria or [])
+        if stop_strings:
+            criteria.append(StopStringCriteria(tokenizer, stop_strings))
+
+        if streamer is not None:
+            streamer.put(input_ids.cpu())
+        past_length = past_key_values[0][0].shape[2] if past_key_values is not None else 0
+        logits, past = self.prefill(input_ids[:, past_length:], attention_mask, past_key_values)
+        unfinished = torch.ones(input_ids.shape[0], dtype=torch.bool)
+        for step in range(max_new_tokens):
+            scores = processors(input_ids, logits.float())
+            if do_sample:
+                next_tokens = torch.multinomial(torch.softmax(scores, dim=-1), num_samples=1).squeeze(1)
+            else:
+                next_tokens = torch.argmax(scores, dim=-1)
+            # Finished rows are padded until the others are done.
+            next_tokens = torch.where(unfinished, next_tokens, torch.full_like(next_tokens, pad_token_id))
+            input_ids = torch.cat([input_ids, next_tokens[:, None]], dim=-1)
+            attention_mask = torch.cat([attention_mask, attention_mask.new_ones((attention_mask.shape[0], 1))],
+                                       dim=-1)
+            if streamer is not None:
+                streamer.put(next_tokens.cpu())
+
+            if eos_token_id is not None:
+                unfinished &= next_tokens != eos_token_id
+            if criteria:
+                unfinished &= ~criteria(input_ids, scores).cpu()
+            if not unfinished.any() or step == max_new_tokens - 1:
+                break
+            logits, past = self.decode_step(next_tokens[:, None], attention_mask, past)
+
+        if streamer is not None:
+            streamer.end()
+        if not return_dict_in_generate:
+            return input_ids
+        # The key/values cover every token but the last one, as with model.generate.
+        return GenerateDecoderOnlyOutput(sequences=input_ids, past_key_values=self.legacy_key_values(past))
@@ -0,0 +1,270 @@
+"""
+ONNX Runtime engine for GPT-2 and GPT-Neo on CPU.
+
+The first load exports the PyTorch model to ONNX in a cache directory, along with an int8 copy quantized by ONNX
+Runtime when int8 is asked for. Later loads only open the exported graph. The graph takes the past key/values of every
+layer as inputs, with the past length as a dynamic axis, so one graph serves both prefill (with an empty past) and
+decoding. During decoding the key/values are bound to the session with IO binding and stay in ONNX Runtime's own
+buffers from one step to the next, never going through numpy or PyTorch.
+"""
+import importlib.util
+import json
+import os
+import re
+import shutil
+import time
+
+import numpy as np
+import psutil
+import torch
+import transformers
+from transformers import AutoConfig, AutoTokenizer
+
+from launcher.generators.ai.caches import legacy_key_values
+from launcher.generators.backends.base import BackendModel, InferenceBackend
+from launcher.generators.backends.torch_backend import TorchBackend
+from launcher.utils.profiling.memory import PeakMemorySampler
+
+DEFAULT_ONNX_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.lcnlp', 'onnx')
+
+SUPPORTED_MODEL_TYPES = ('gpt2', 'gpt_neo')
+ONNX_PRECISIONS = ('fp32', 'int8')
+OPSET_VERSION = 14
+
+# Bumped whenever the exported graph changes, so older exports are redone.
+EXPORT_FORMAT = 1
+
+
+def export_directory(cache_dir, model_name, precision):
+    return os.path.join(cache_dir, re.sub(r'[^A-Za-z0-9_.-]+', '_', model_name), precision)
+
+
+def export_info(model_name, config):
+    """
+    What an export depends on; an export made with different values is redone.
+    """
+    return {
+        'model_name': model_name,
+        'model_type': config.model_type,
+        'num_layers': config.num_hidden_layers,
+        'num_heads': config.num_attention_heads,
+        'head_dim': config.hidden_size // config.num_attention_heads,
+        'transformers': transformers.__version__,
+        'torch': torch.__version__,
+        'opset': OPSET_VERSION,
+        'format': EXPORT_FORMAT,
+    }
+
+
+def read_export_info(directory):
+    try:
+        with open(os.path.join(directory, 'export.json'), encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def directory_size_mb(directory):
+    return sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file()) / (1024 ** 2)
+
+
+def past_names(num_layers, prefix):
+    return [f"{prefix}.{layer}.{kind}" for layer in range(num_layers) for kind in ('key', 'value')]
+
+
+class _ExportWrapper(torch.nn.Module):
+    """
+    Flat signature for the ONNX graph: past key/values in, logits of the last position and present key/values out.
+    """
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask, position_ids, *past):
+        past_key_values = tuple((past[index], past[index + 1]) for index in range(0, len(past), 2))
+        outputs = self.model(input_ids=input_ids, attention_mask=attention_mask, position_ids=position_ids,
+                             past_key_values=past_key_values, use_cache=True, return_dict=True)
+        present = legacy_key_values(outputs.past_key_values)
+        return (outputs.logits[:, -1, :],) + tuple(tensor for layer in present for tensor in layer)
+
+
+def export_model(model_name, directory, report):
+    """
+    Export the fp32 model to directory/model.onnx.
+    """
+    model, _ = TorchBackend().load(model_name, torch.device('cpu'), 'fp32', report)
+    info = export_info(model_name, model.config)
+    num_layers, num_heads, head_dim = info['num_layers'], info['num_heads'], info['head_dim']
+
+    # Traced with one past position and two new tokens, so neither length is mistaken for a constant.
+    input_ids = torch.ones((1, 2), dtype=torch.long)
+    attention_mask = torch.ones((1, 3), dtype=torch.long)
+    position_ids = torch.tensor([[1, 2]], dtype=torch.long)
+    past = [torch.zeros((1, num_heads, 1, head_dim)) for _ in range(2 * num_layers)]
+
+    input_names = ['input_ids', 'attention_mask', 'position_ids'] + past_names(num_layers, 'past_key_values')
+    output_names = ['logits'] + past_names(num_layers, 'present')
+    dynamic_axes = {'input_ids': {0: 'batch', 1: 'tokens'}, 'attention_mask': {0: 'batch', 1: 'total_tokens'},
+                    'position_ids': {0: 'batch', 1: 'tokens'}, 'logits': {0: 'batch'}}
+    for name in past_names(num_layers, 'past_key_values'):
+        dynamic_axes[name] = {0: 'batch', 2: 'past_tokens'}
+    for name in past_names(num_layers, 'present'):
+        dynamic_axes[name] = {0: 'batch', 2: 'total_tokens'}
+
+    # Exported next to the final directory and renamed once complete, so an interrupted export is never used.
+    temporary = directory + '.tmp'
+    shutil.rmtree(temporary, ignore_errors=True)
+    os.makedirs(temporary)
+    with torch.no_grad():
+        torch.onnx.export(_ExportWrapper(model), (input_ids, attention_mask, position_ids, *past),
+                          os.path.join(temporary, 'model.onnx'), input_names=input_names,
+                          output_names=output_names, dynamic_axes=dynamic_axes, opset_version=OPSET_VERSION,
+                          do_constant_folding=True)
+    _finish_export(temporary, directory, info)
+
+
+def quantize_export(source, directory, info):
+    """
+    Quantize the weights of the fp32 export in source to int8 into directory.
+    """
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    temporary = directory + '.tmp'
+    shutil.rmtree(temporary, ignore_errors=True)
+    os.makedirs(temporary)
+    # Models over 2 GB keep their weights outside the protobuf.
+    quantize_dynamic(os.path.join(source, 'model.onnx'), os.path.join(temporary, 'model.onnx'),
+                     weight_type=QuantType.QInt8, use_external_data_format=directory_size_mb(source) > 2000)
+    _finish_export(temporary, directory, info)
+
+
+def _finish_export(temporary, directory, info):
+    with open(os.path.join(temporary, 'export.json'), 'w', encoding='utf-8') as file:
+        json.dump(info, file)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(temporary, directory)
+
+
+class OnnxCausalLM(BackendModel):
+    """
+    Exported causal LM running in an ONNX Runtime session.
+    """
+
+    def __init__(self, session, config, directory):
+        super().__init__(config, torch.device('cpu'), torch.float32)
+        self.session = session
+        self.directory = directory
+        self.num_layers = config.num_hidden_layers
+        self.num_heads = config.num_attention_heads
+        self.head_dim = config.hidden_size // config.num_attention_heads
+        self.past_names = past_names(self.num_layers, 'past_key_values')
+        self.present_names = past_names(self.num_layers, 'present')
+
+    def size_mb(self):
+        return directory_size_mb(self.directory)
+
+    def prefill(self, input_ids, attention_mask, past_key_values=None):
+        from onnxruntime import OrtValue
+
+        if past_key_values is None:
+            empty = np.zeros((input_ids.shape[0], self.num_heads, 0, self.head_dim), dtype=np.float32)
+            past = [OrtValue.ortvalue_from_numpy(empty) for _ in self.past_names]
+        else:
+            past = [OrtValue.ortvalue_from_numpy(tensor.float().contiguous().numpy())
+                    for layer in legacy_key_values(past_key_values) for tensor in layer]
+        return self._run(input_ids, attention_mask, past)
+
+    def decode_step(self, input_ids, attention_mask, past):
+        return self._run(input_ids, attention_mask, past)
+
+    def legacy_key_values(self, past):
+        tensors = [torch.from_numpy(value.numpy()) for value in past]
+        return tuple((tensors[index], tensors[index + 1]) for index in range(0, len(tensors), 2))
+
+    def _run(self, input_ids, attention_mask, past):
+        attention_mask = attention_mask.long()
+        # Left padding shifts the positions of the padded rows, as in prepare_inputs_for_generation.
+        position_ids = (attention_mask.cumsum(-1) - 1).clamp(min=0)[:, -input_ids.shape[-1]:]
+
+        binding = self.session.io_binding()
+        binding.bind_cpu_input('input_ids', input_ids.long().contiguous().numpy())
+        binding.bind_cpu_input('attention_mask', attention_mask.contiguous().numpy())
+        binding.bind_cpu_input('position_ids', position_ids.contiguous().numpy())
+        for name, value in zip(self.past_names, past):
+            binding.bind_ortvalue_input(name, value)
+        # Outputs are allocated by ONNX Runtime and the presents become the next step's past as they are.
+        binding.bind_output('logits', 'cpu')
+        for name in self.present_names:
+            binding.bind_output(name, 'cpu')
+        self.session.run_with_iobinding(binding)
+        outputs = binding.get_outputs()
+        return torch.from_numpy(outputs[0].numpy()), outputs[1:]
+
+
+class OnnxBackend(InferenceBackend):
+    """
+    GPT-2 and GPT-Neo exported to ONNX and run with ONNX Runtime on CPU, in fp32 or int8.
+    """
+
+    name = 'onnx'
+    label = 'ONNX Runtime (CPU)'
+
+    def __init__(self, cache_dir=DEFAULT_ONNX_CACHE_DIR, num_threads=None):
+        """
+        :param cache_dir: Where the exported models are kept between launches.
+        :param num_threads: Intra-op threads of the sessions, defaults to the number of physical cores.
+        """
+        self.cache_dir = cache_dir
+        self.num_threads = num_threads
+
+    def is_available(self):
+        return importlib.util.find_spec('onnxruntime') is not None
+
+    def check(self, device, precision):
+        if not self.is_available():
+            raise ValueError("The ONNX Runtime backend requires the onnxruntime package")
+        if device.type != 'cpu':
+            raise ValueError("The ONNX Runtime backend only runs on CPU")
+        if precision not in ONNX_PRECISIONS:
+            raise ValueError(f"The ONNX Runtime backend supports {list(ONNX_PRECISIONS)}, not {precision}")
+
+    def load(self, model_name, device, precision, report, load_metrics=None, placement=None):
+        if placement is not None:
+            raise ValueError("The ONNX Runtime backend can't split a model across devices")
+        self.check(device, precision)
+        import onnxruntime
+
+        report('read', 0)
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        config = AutoConfig.from_pretrained(model_name)
+        if config.model_type not in SUPPORTED_MODEL_TYPES:
+            raise ValueError(f"The ONNX Runtime backend supports {list(SUPPORTED_MODEL_TYPES)} models, "
+                             f"not {config.model_type}")
+
+        info = export_info(model_name, config)
+        fp32_directory = export_directory(self.cache_dir, model_name, 'fp32')
+        if read_export_info(fp32_directory) != info:
+            report('export', 10)
+            export_model(model_name, fp32_directory, lambda stage, percent: report(f"export: {stage}", 10))
+        directory = export_directory(self.cache_dir, model_name, precision)
+        if precision == 'int8' and read_export_info(directory) != info:
+            report('quantize', 60)
+            quantize_export(fp32_directory, directory, info)
+
+        report('materialize', 80)
+        start = time.perf_counter()
+        with PeakMemorySampler(cuda_devices=[]) as memory:
+            options = onnxruntime.SessionOptions()
+            options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+            options.intra_op_num_threads = self.num_threads or psutil.cpu_count(logical=False) or 0
+            session = onnxruntime.InferenceSession(os.path.join(directory, 'model.onnx'), options,
+                                                   providers=['CPUExecutionProvider'])
+        if load_metrics is not None:
+            load_metrics.update({
+                'load_s': time.perf_counter() - start,
+                'peak_rss_mb': memory.peak_rss_mb,
+                'rss_increase_mb': memory.peak_rss_mb - memory.start_rss_mb,
+                'peak_vram_mb': memory.peak_vram_mb,
+            })
+        return OnnxCausalLM(session, config, directory), tokenizer
@@ -0,0 +1,23 @@
+from launcher.generators.ai.parameters import BACKENDS
+from launcher.generators.backends.onnx_backend import OnnxBackend
+from launcher.generators.backends.torch_backend import TorchBackend
+
+DEFAULT_BACKEND = 'torch'
+
+BACKEND_CLASSES = {backend.name: backend for backend in (TorchBackend, OnnxBackend)}
+
+
+def get_backend(name=DEFAULT_BACKEND):
+    """
+    Create the backend registered under the name.
+    """
+    if name not in BACKEND_CLASSES:
+        raise ValueError(f"Unknown backend '{name}'. Available backends: {list(BACKENDS)}")
+    return BACKEND_CLASSES[name]()
+
+
+def available_backends():
+    """
+    Names of the backends whose packages are installed.
+    """
+    return [name for name in BACKENDS if BACKEND_CLASSES[name]().is_available()]
@@ -0,0 +1,89 @@
+import time
+
+import torch
+from transformers import AutoConfig, AutoModelForCausalLM, AutoTokenizer
+from transformers.utils import is_accelerate_available
+
+from launcher.generators.ai.model_store import ModelStore
+from launcher.generators.ai.precision import PRECISION_DTYPES, apply_precision, check_precision
+from launcher.generators.backends.base import InferenceBackend
+from launcher.utils.profiling.memory import PeakMemorySampler
+
+
+def cuda_device_indices(device, placement=None):
+    """
+    CUDA device indices a model lives on, to track their memory.
+    """
+    devices = [torch.device(placed) for placed in placement['devices']] if placement else [device]
+    return [placed.index or 0 for placed in devices if placed.type == 'cuda']
+
+
+class TorchBackend(InferenceBackend):
+    """
+    Eager PyTorch models from transformers, on any device and precision, optionally split across devices.
+    """
+
+    name = 'torch'
+    label = 'PyTorch'
+
+    # Loading stages reported to progress callbacks, with the progress reached once the stage starts. Weights are
+    # normally materialized on the device in their final dtype, so 'move to device' and 'cast' are often skipped.
+    LOAD_STAGES = (('read', 0), ('materialize', 25), ('move to device', 70), ('cast', 90))
+
+    def __init__(self, model_store=None):
+        """
+        :param model_store: ModelStore whose converted variants are loaded instead of the Hub checkpoints, defaults to
+                            the one in ~/.lcnlp/models.
+        """
+        self.model_store = model_store if model_store is not None else ModelStore()
+
+    def check(self, device, precision):
+        check_precision(precision, device)
+
+    def load(self, model_name, device, precision, report, load_metrics=None, placement=None):
+        """
+        Load the tokenizer and model, materializing the weights directly in the target dtype on the target device.
+
+        With accelerate installed, safetensors checkpoints are memory-mapped and copied tensor by tensor to the
+        device, so there is never a full fp32 copy of the model in host RAM. A variant converted by the model store
+        for the precision is loaded instead of the original checkpoint when there is one.
+
+        :param placement: Optional plan from plan_placement to split the model across devices, device is then the
+                          device of the embeddings.
+        """
+        if placement is not None and not is_accelerate_available():
+            raise ValueError("Splitting a model across devices requires the accelerate package")
+
+        stages = dict(self.LOAD_STAGES)
+        report('read', stages['read'])
+        source = self.model_store.resolve(model_name, precision)
+        tokenizer = AutoTokenizer.from_pretrained(source)
+        config = AutoConfig.from_pretrained(source)
+
+        report('materialize', stages['materialize'])
+        start = time.perf_counter()
+        with PeakMemorySampler(cuda_devices=cuda_device_indices(device, placement)) as memory:
+            load_kwargs = {'config': config, 'torch_dtype': PRECISION_DTYPES[precision]}
+            if placement is not None:
+                load_kwargs.update(low_cpu_mem_usage=True, device_map=placement['device_map'])
+            elif is_accelerate_available():
+                load_kwargs.update(low_cpu_mem_usage=True, device_map={'': device})
+            model = AutoModelForCausalLM.from_pretrained(source, **load_kwargs)
+
+            if placement is None and model.device != device:
+                report('move to device', stages['move to device'])
+                model = model.to(device)
+            if precision == 'int8':
+                report('cast', stages['cast'])
+                model = apply_precision(model, precision)
+        model.eval()
+
+        if load_metrics is not None:
+            load_metrics.update({
+                'load_s': time.perf_counter() - start,
+                'peak_rss_mb': memory.peak_rss_mb,
+                'rss_increase_mb': memory.peak_rss_mb - memory.start_rss_mb,
+                'peak_vram_mb': memory.peak_vram_mb,
+                'variant': source if source != model_name else None,
+            })
+        return model, tokenizer
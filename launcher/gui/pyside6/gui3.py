@@ -1,90 +1,196 @@
 import sys
-from PySide6.QtCore import QThread, Signal, Qt
-from PySide6.QtWidgets import (QApplication, QMainWindow, QVBoxLayout, QWidget, QLineEdit, QTextEdit, QPushButton,
+import threading
+
+from PySide6.QtCore import QObject, QThread, QTimer, Signal, Qt
+from PySide6.QtWidgets import (QApplication, QMainWindow, QVBoxLayout, QWidget, QLineEdit, QPushButton,
                                QLabel, QComboBox, QSpinBox, QDoubleSpinBox, QHBoxLayout, QDialog,
-                               QDialogButtonBox, QCheckBox)
+                               QDialogButtonBox, QCheckBox, QProgressBar, QListView, QAbstractItemView)
 from PySide6.QtGui import QFont
-from launcher.generators.ai.NLP_Generator import AdvancedTextGenerator
-from launcher.utils.devices.device_manager import DeviceManager
+from launcher.generators.ai.model_store import ModelStore, format_model_info
+from launcher.generators.ai.parameters import BACKENDS, PRECISIONS, SAMPLING_PARAMETERS
+from launcher.generators.ai.speculative import default_draft_model
+from launcher.gui.pyside6.transcript import TranscriptDelegate, TranscriptModel, TranscriptStore
+from launcher.utils.devices.placement import AUTO_DEVICE, format_placement
+from launcher.utils.devices.telemetry import format_sample, shared_sampler
+from launcher.utils.profiling.startup_timer import StartupTimer
+
+# torch and transformers are only imported by ModelLoaderThread, so that the window can paint before they are loaded.
+
+
+class GenerationSignals(QObject):
+    """
+    Carries the results of jobs running on the GenerationScheduler thread back to the GUI thread.
+    """
+    started = Signal(int)
+    new_text = Signal(int, str)
+    finished = Signal(int, str)
+    failed = Signal(int, str)
+    model_applied = Signal(object)
+    metrics = Signal(object)
+
+
+class ModelIndexSignals(QObject):
+    indexed = Signal(object)
 
 
-class TextGeneratorThread(QThread):
-    update_text = Signal(str)
+class ModelLoaderThread(QThread):
+    progress = Signal(str, int)
+    loaded = Signal(object)
+    failed = Signal(str)
+    cancelled = Signal()
 
-    def __init__(self, prompt, generator, max_length, temperature, top_k, top_p, repetition_penalty):
+    def __init__(self, generator, settings, startup_timer=None):
         super().__init__()
-        self.prompt = prompt
         self.generator = generator
-        self.max_length = max_length
-        self.temperature = temperature
-        self.top_k = top_k
-        self.top_p = top_p
-        self.repetition_penalty = repetition_penalty
+        self.settings = dict(settings)
+        self.startup_timer = startup_timer if startup_timer is not None else StartupTimer()
+        self.cancel_event = threading.Event()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def import_generator_module(self):
+        # Import the heavy dependencies one by one so the startup report shows what each of them costs.
+        for module_name in ('torch', 'transformers'):
+            self.startup_timer.import_module(module_name)
+        return self.startup_timer.import_module('launcher.generators.ai.NLP_Generator')
+
+    def create_generator(self, generator_module):
+        with self.startup_timer.measure('generator setup'):
+            return generator_module.AdvancedTextGenerator(
+                model_name=self.settings['model'],
+                device_id=self.settings['device'],
+                precision=self.settings['precision'],
+                load_on_init=False,
+                backend=self.settings['backend']
+            )
 
     def run(self):
-        generated_text = self.generator.generate_text(
-            self.prompt,
-            max_length=self.max_length,
-            temperature=self.temperature,
-            top_k=self.top_k,
-            top_p=self.top_p,
-            repetition_penalty=self.repetition_penalty
-        )
-        self.update_text.emit(generated_text)
+        try:
+            self.progress.emit('import', 0)
+            generator_module = self.import_generator_module()
+            if self.generator is None:
+                self.generator = self.create_generator(generator_module)
+        except Exception as e:
+            self.failed.emit(str(e))
+            return
+
+        try:
+            prepared = self.generator.prepare_model(
+                self.settings['model'],
+                device_id=self.settings['device'],
+                precision=self.settings['precision'],
+                progress_callback=self.progress.emit,
+                cancel_event=self.cancel_event,
+                draft_model_name=default_draft_model(self.settings['model']) if self.settings['speculative'] else None,
+                backend=self.settings['backend']
+            )
+        except generator_module.ModelLoadCancelled:
+            self.cancelled.emit()
+            return
+        except Exception as e:
+            self.failed.emit(str(e))
+            return
+        if self.cancel_event.is_set():
+            self.cancelled.emit()
+        else:
+            self.loaded.emit(prepared)
 
 
 class ConfigDialog(QDialog):
-    def __init__(self, parent=None, current_settings=None):
+    def __init__(self, parent=None, current_settings=None, available_devices=None, placement_planner=None,
+                 current_placement=None, model_store=None):
+        """
+        :param placement_planner: Optional callable (model_name, precision) returning a plan from
+                                  AdvancedTextGenerator.plan_placement, to preview the 'auto' device.
+        :param current_placement: Plan of the loaded model, if it was split across devices.
+        :param model_store: ModelStore listing the models on disk, defaults to the one in ~/.lcnlp/models.
+        """
         super().__init__(parent)
         self.setWindowTitle("Settings")
         self.setStyleSheet("background-color: #2e2e2e; color: #ffffff;")
-        self.setFixedSize(400, 650)
+        self.setFixedSize(400, 890)
+        self.placement_planner = placement_planner
 
         layout = QVBoxLayout(self)
 
+        # The known models and everything found on disk, described from the safetensors headers. The dialog opens
+        # with the index of the last scan and updates once a new scan finished in the background.
+        self.model_store = model_store if model_store is not None else ModelStore()
+        self.model_index = self.model_store.cached_index()
         self.model_selector = QComboBox()
-        self.model_selector.addItems(['gpt2', 'gpt2-medium', 'gpt2-large', 'gpt2-xl', 'EleutherAI/gpt-neo-1.3B',
-                                      'EleutherAI/gpt-neo-2.7B', 'EleutherAI/gpt-neo-125M', 'EleutherAI/gpt-j-6B',
-                                      'distilgpt2'])
+        self.model_selector.addItems(self.model_store.model_names(self.model_index))
         layout.addWidget(QLabel("Model:"))
         layout.addWidget(self.model_selector)
+        self.model_info_label = QLabel("")
+        self.model_info_label.setWordWrap(True)
+        layout.addWidget(self.model_info_label)
+        self.model_selector.currentTextChanged.connect(self.show_model_info)
+        self.show_model_info(self.model_selector.currentText())
+        self.start_model_index_refresh()
 
         self.device_selector = QComboBox()
-        self.device_selector.addItems(DeviceManager()._get_available_devices())
+        if available_devices is None:
+            from launcher.utils.devices.device_manager import DeviceManager
+            available_devices = DeviceManager()._get_available_devices()
+        self.device_selector.addItems(list(available_devices) + [AUTO_DEVICE])
         layout.addWidget(QLabel("Device:"))
         layout.addWidget(self.device_selector)
 
+        # With the 'auto' device, the transformer blocks are split across the GPUs and spill over to the CPU.
+        self.placement_label = QLabel(format_placement(current_placement) if current_placement else
+                                      "Placement: the whole model on the selected device")
+        self.placement_label.setWordWrap(True)
+        layout.addWidget(self.placement_label)
+        self.placement_button = QPushButton("Plan Placement")
+        self.placement_button.setStyleSheet("background-color: #3e3e3e; color: #ffffff; border: none;")
+        self.placement_button.setEnabled(placement_planner is not None)
+        self.placement_button.clicked.connect(self.show_placement)
+        layout.addWidget(self.placement_button)
+
         self.max_length_spinner = QSpinBox()
-        self.max_length_spinner.setRange(1, 4096)
+        self.max_length_spinner.setRange(*SAMPLING_PARAMETERS['max_length'][1:3])
         layout.addWidget(QLabel("Max Length:"))
         layout.addWidget(self.max_length_spinner)
 
         self.temperature_spinner = QDoubleSpinBox()
-        self.temperature_spinner.setRange(0.1, 2.0)
+        self.temperature_spinner.setRange(*SAMPLING_PARAMETERS['temperature'][1:3])
         self.temperature_spinner.setSingleStep(0.1)
         layout.addWidget(QLabel("Temperature:"))
         layout.addWidget(self.temperature_spinner)
 
         self.top_k_spinner = QSpinBox()
-        self.top_k_spinner.setRange(0, 100)
+        self.top_k_spinner.setRange(*SAMPLING_PARAMETERS['top_k'][1:3])
         layout.addWidget(QLabel("Top-k:"))
         layout.addWidget(self.top_k_spinner)
 
         self.top_p_spinner = QDoubleSpinBox()
-        self.top_p_spinner.setRange(0.0, 1.0)
+        self.top_p_spinner.setRange(*SAMPLING_PARAMETERS['top_p'][1:3])
         self.top_p_spinner.setSingleStep(0.05)
         layout.addWidget(QLabel("Top-p:"))
         layout.addWidget(self.top_p_spinner)
 
         self.repetition_penalty_spinner = QDoubleSpinBox()
-        self.repetition_penalty_spinner.setRange(1.0, 2.0)
+        self.repetition_penalty_spinner.setRange(*SAMPLING_PARAMETERS['repetition_penalty'][1:3])
         self.repetition_penalty_spinner.setSingleStep(0.1)
         layout.addWidget(QLabel("Repetition Penalty:"))
         layout.addWidget(self.repetition_penalty_spinner)
 
-        # Add Half Model Accuracy checkbox
-        self.half_model_accuracy_checkbox = QCheckBox("Half Model Accuracy")
-        layout.addWidget(self.half_model_accuracy_checkbox)
+        # fp16 needs CUDA, int8 dynamic quantization runs on CPU; the device is checked when the model loads.
+        self.precision_selector = QComboBox()
+        self.precision_selector.addItems(list(PRECISIONS))
+        layout.addWidget(QLabel("Precision:"))
+        layout.addWidget(self.precision_selector)
+
+        # onnx exports GPT-2 and GPT-Neo models to ONNX Runtime on their first load and runs them on CPU in fp32 or int8.
+        self.backend_selector = QComboBox()
+        self.backend_selector.addItems(list(BACKENDS))
+        layout.addWidget(QLabel("Backend:"))
+        layout.addWidget(self.backend_selector)
+
+        # Only used for models that have a draft model of the same family, e.g. gpt2-xl with distilgpt2.
+        self.speculative_checkbox = QCheckBox("Speculative Decoding (draft model)")
+        layout.addWidget(self.speculative_checkbox)
 
         self.load_settings(current_settings)
 
@@ -100,8 +206,53 @@ class ConfigDialog(QDialog):
         self.buttons.rejected.connect(self.reject)
         layout.addWidget(self.buttons)
 
+    def show_placement(self):
+        if self.device_selector.currentText() != AUTO_DEVICE:
+            self.placement_label.setText(f"Placement: the whole model on {self.device_selector.currentText()}")
+            return
+        try:
+            plan = self.placement_planner(self.model_selector.currentText(), self.precision_selector.currentText())
+        except Exception as e:
+            self.placement_label.setText(f"Placement: {e}")
+            return
+        self.placement_label.setText(format_placement(plan))
+
+    def show_model_info(self, model_name):
+        self.model_info_label.setText(format_model_info(self.model_index.get(model_name)))
+
+    def start_model_index_refresh(self):
+        # Scanning reads the header of every checkpoint in the Hugging Face cache, which takes a while with many
+        # models, so it runs off the GUI thread and the result comes back through a queued signal.
+        signals = ModelIndexSignals()
+        signals.indexed.connect(self.update_model_index)
+
+        def refresh():
+            try:
+                index = self.model_store.index(refresh=True)
+            except OSError as e:
+                print(f"Can't index the local models: {e}")
+                return
+            signals.indexed.emit(index)
+
+        threading.Thread(target=refresh, name='ModelIndex', daemon=True).start()
+
+    def update_model_index(self, index):
+        self.model_index = index
+        current = self.model_selector.currentText()
+        self.model_selector.blockSignals(True)
+        self.model_selector.clear()
+        self.model_selector.addItems(self.model_store.model_names(index))
+        if self.model_selector.findText(current) < 0:
+            self.model_selector.addItem(current)
+        self.model_selector.setCurrentText(current)
+        self.model_selector.blockSignals(False)
+        self.show_model_info(current)
+
     def load_settings(self, settings):
         if settings:
+            # Models loaded from a path or removed from disk since aren't in the list.
+            if self.model_selector.findText(settings['model']) < 0:
+                self.model_selector.addItem(settings['model'])
             self.model_selector.setCurrentText(settings['model'])
             self.device_selector.setCurrentText(settings['device'])
             self.max_length_spinner.setValue(settings['max_length'])
@@ -109,7 +260,9 @@ class ConfigDialog(QDialog):
             self.top_k_spinner.setValue(settings['top_k'])
             self.top_p_spinner.setValue(settings['top_p'])
             self.repetition_penalty_spinner.setValue(settings['repetition_penalty'])
-            self.half_model_accuracy_checkbox.setChecked(settings.get('half_model_accuracy', False))
+            self.precision_selector.setCurrentText(settings.get('precision', 'fp32'))
+            self.backend_selector.setCurrentText(settings.get('backend', 'torch'))
+            self.speculative_checkbox.setChecked(settings.get('speculative', False))
 
     def get_settings(self):
         return {
@@ -120,13 +273,27 @@ class ConfigDialog(QDialog):
             'top_k': self.top_k_spinner.value(),
             'top_p': self.top_p_spinner.value(),
             'repetition_penalty': self.repetition_penalty_spinner.value(),
-            'half_model_accuracy': self.half_model_accuracy_checkbox.isChecked()
+            'precision': self.precision_selector.currentText(),
+            'backend': self.backend_selector.currentText(),
+            'speculative': self.speculative_checkbox.isChecked()
         }
 
 
 class ChatWindow(QMainWindow):
-    def __init__(self):
+    model_ready = Signal()
+
+    # Settings that need a model (re)load to take effect.
+    MODEL_SETTINGS = ('model', 'device', 'precision', 'backend', 'speculative')
+
+    def __init__(self, startup_timer=None, transcript_path=None):
+        """
+        :param transcript_path: SQLite file keeping the chat messages, a temporary one by default.
+        """
         super().__init__()
+        self.startup_timer = startup_timer if startup_timer is not None else StartupTimer()
+        self.transcript = TranscriptModel(TranscriptStore(transcript_path), parent=self)
+        self.streaming_message_id = None
+        self.follow_stream = False
 
         # Initialize settings and generator before calling init_ui
         self.settings = {
@@ -137,16 +304,43 @@ class ChatWindow(QMainWindow):
             'top_k': 50,
             'top_p': 0.95,
             'repetition_penalty': 1.0,
-            'half_model_accuracy': False
+            'precision': 'fp32',
+            'backend': 'torch',
+            'speculative': False
         }
-        self.generator = AdvancedTextGenerator(model_name=self.settings['model'],
-                                               device_id=self.settings['device'],
-                                               half_model_accuracy=self.settings['half_model_accuracy'])
+        # The generator and its model are created in the background once the window is up.
+        self.generator = None
+        self.session = None
+        self.scheduler = None
+        self.message_count = 0
+        # Cancel events of the messages that are queued or being answered, by message id.
+        self.cancel_events = {}
+        self.signals = GenerationSignals()
+        self.signals.started.connect(self.start_generated_text)
+        self.signals.new_text.connect(self.display_generated_text)
+        self.signals.finished.connect(self.finish_generated_text)
+        self.signals.failed.connect(self.display_generation_error)
+        self.signals.model_applied.connect(self.finish_model_swap)
+        self.signals.metrics.connect(self.update_metrics)
+        self.loader_thread = None
+        self.finished_loaders = []
 
         self.setWindowTitle("LcNLP-Launcher")
         self.setGeometry(100, 100, 800, 600)
         self.setStyleSheet("background-color: #1e1e1e; color: #ffffff;")
         self.init_ui()
+        # Hardware load, sampled in the background and only read here.
+        self.telemetry = shared_sampler()
+        self.telemetry_timer = QTimer(self)
+        self.telemetry_timer.timeout.connect(self.update_telemetry)
+        self.telemetry_timer.start(1000)
+        self.startup_timer.mark('window created')
+        self.start_model_load(self.settings)
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        # Runs once the event loop has handled the pending paint of the freshly shown window.
+        QTimer.singleShot(0, lambda: self.startup_timer.mark('first paint'))
 
     def init_ui(self):
         central_widget = QWidget()
@@ -156,9 +350,22 @@ class ChatWindow(QMainWindow):
 
         # Верхняя панель с названием модели и кнопкой настроек
         header_layout = QHBoxLayout()
-        self.model_name_label = QLabel(f"Model: {self.settings['model']}  |  Device: {self.settings['device']}  |  Half Model Accuracy: {self.settings['half_model_accuracy']}")
+        header_labels_layout = QVBoxLayout()
+        self.model_name_label = QLabel(f"Model: {self.settings['model']}  |  Device: {self.settings['device']}  |  Precision: {self.settings['precision']}  |  Backend: {self.settings['backend']}")
         self.model_name_label.setStyleSheet("background-color: transparent; color: #ffffff; padding: 10px; border-radius: 10px;")
-        header_layout.addWidget(self.model_name_label)
+        header_labels_layout.addWidget(self.model_name_label)
+
+        # Performance of the last reply, filled in by update_metrics.
+        self.metrics_label = QLabel("")
+        self.metrics_label.setStyleSheet("background-color: transparent; color: #aaaaaa; padding: 0px 10px; font-size: 11px;")
+        self.metrics_label.hide()
+        header_labels_layout.addWidget(self.metrics_label)
+
+        # CPU, memory and GPU load, filled in by update_telemetry.
+        self.telemetry_label = QLabel("")
+        self.telemetry_label.setStyleSheet("background-color: transparent; color: #888888; padding: 0px 10px; font-size: 11px;")
+        header_labels_layout.addWidget(self.telemetry_label)
+        header_layout.addLayout(header_labels_layout)
 
         settings_button = QPushButton("⚙")
         settings_button.setStyleSheet("""
@@ -182,10 +389,37 @@ class ChatWindow(QMainWindow):
 
         main_layout.addLayout(header_layout)
 
-        self.chat_display = QTextEdit()
-        self.chat_display.setReadOnly(True)
-        self.chat_display.setStyleSheet("background-color: #2e2e2e; color: #ffffff; border: none;")
-        self.chat_display.setFont(QFont("Arial", 12))
+        loading_layout = QHBoxLayout()
+        self.loading_bar = QProgressBar()
+        self.loading_bar.setRange(0, 100)
+        self.loading_bar.setStyleSheet("background-color: #2e2e2e; color: #ffffff; border: none; border-radius: 5px;")
+        loading_layout.addWidget(self.loading_bar)
+
+        self.cancel_loading_button = QPushButton("Cancel")
+        self.cancel_loading_button.setStyleSheet("background-color: #3e3e3e; color: #ffffff; padding: 5px; border-radius: 5px;")
+        self.cancel_loading_button.clicked.connect(self.cancel_model_load)
+        loading_layout.addWidget(self.cancel_loading_button)
+
+        self.loading_widget = QWidget()
+        self.loading_widget.setLayout(loading_layout)
+        self.loading_widget.hide()
+        main_layout.addWidget(self.loading_widget)
+
+        # Only the visible messages are laid out and painted, the others stay in the transcript database.
+        self.chat_view = QListView()
+        self.chat_view.setModel(self.transcript)
+        # Remembers the size of every message, so a streamed reply growing by a line doesn't re-read the others.
+        self.chat_view.setItemDelegate(TranscriptDelegate(self.chat_view))
+        self.chat_view.verticalScrollBar().rangeChanged.connect(self.keep_scrolled_to_bottom)
+        self.chat_view.setWordWrap(True)
+        self.chat_view.setResizeMode(QListView.Adjust)
+        self.chat_view.setLayoutMode(QListView.Batched)
+        self.chat_view.setBatchSize(100)
+        self.chat_view.setSpacing(4)
+        self.chat_view.setVerticalScrollMode(QAbstractItemView.ScrollPerPixel)
+        self.chat_view.setSelectionMode(QAbstractItemView.NoSelection)
+        self.chat_view.setStyleSheet("background-color: #2e2e2e; color: #ffffff; border: none;")
+        self.chat_view.setFont(QFont("Arial", 12))
 
         clear_chat_button = QPushButton("Clear")
         clear_chat_button.setStyleSheet("""
@@ -233,6 +467,7 @@ class ChatWindow(QMainWindow):
         clear_chat_button.clicked.connect(self.clear_chat)
 
         send_button = QPushButton("➡")
+        self.send_button = send_button
         send_button.setStyleSheet("""
             QPushButton {
                 background-color: #3e3e3e; 
@@ -251,56 +486,246 @@ class ChatWindow(QMainWindow):
         send_button.setFixedSize(40, 40)
         send_button.clicked.connect(self.send_message)
 
+        stop_button = QPushButton("⏹")
+        self.stop_button = stop_button
+        stop_button.setStyleSheet(send_button.styleSheet())
+        stop_button.setFixedSize(40, 40)
+        stop_button.setToolTip("Stop generating")
+        stop_button.setEnabled(False)
+        stop_button.clicked.connect(self.stop_generation)
+
         input_layout.addWidget(clear_chat_button, alignment=Qt.AlignLeft)
         input_layout.addWidget(self.input_field)
+        input_layout.addWidget(stop_button, alignment=Qt.AlignRight)
         input_layout.addWidget(send_button, alignment=Qt.AlignRight)
 
-        main_layout.addWidget(self.chat_display)
+        main_layout.addWidget(self.chat_view)
         main_layout.addLayout(input_layout)
 
     def open_settings(self):
-        dialog = ConfigDialog(self, self.settings)
+        available_devices = self.generator.device_manager.available_devices if self.generator is not None else None
+        placement_planner = self.generator.plan_placement if self.generator is not None else None
+        current_placement = self.generator.placement if self.generator is not None else None
+        dialog = ConfigDialog(self, self.settings, available_devices, placement_planner, current_placement)
         if dialog.exec():
-            new_settings = dialog.get_settings()
-            self.settings.update(new_settings)
-            self.update_model(self.settings['model'])
-            self.update_device(self.settings['device'])
-            self.generator.half_model_accuracy = bool(self.settings['half_model_accuracy'])
+            requested = dict(self.settings, **dialog.get_settings())
+            if self.needs_model_load(requested):
+                self.start_model_load(requested)
+            # Sampling settings apply right away, the model ones once the new model is ready.
+            self.settings.update({key: value for key, value in requested.items() if key not in self.MODEL_SETTINGS})
             self.update_header()
 
-    def update_model(self, model_name):
-        self.generator.load_model(model_name)
-
-    def update_device(self, device_id):
-        self.generator.set_device(device_id)
-        self.generator.model.to(self.generator.device)
+    def needs_model_load(self, settings):
+        return (not self.has_model()
+                or any(settings[key] != self.settings[key] for key in self.MODEL_SETTINGS))
+
+    def start_model_load(self, settings):
+        self.cancel_model_load()
+        self.set_input_enabled(False)
+        self.loading_bar.setValue(0)
+        self.loading_bar.setFormat(f"Loading {settings['model']}...")
+        self.loading_widget.show()
+
+        # Models that were used before are still resident in the generator's model pool.
+        self.loader_thread = ModelLoaderThread(self.generator, settings, self.startup_timer)
+        self.loader_thread.progress.connect(self.update_model_load_progress)
+        self.loader_thread.loaded.connect(self.finish_model_load)
+        self.loader_thread.failed.connect(self.fail_model_load)
+        self.loader_thread.cancelled.connect(self.abort_model_load)
+        self.loader_thread.finished.connect(self.release_model_loader)
+        self.loader_thread.start()
+
+    def cancel_model_load(self):
+        if self.loader_thread is not None:
+            self.loader_thread.cancel()
+            # Keep a reference until the thread is done, loading can't be interrupted inside from_pretrained.
+            self.finished_loaders.append(self.loader_thread)
+            self.loader_thread = None
+            self.loading_widget.hide()
+            self.set_input_enabled(self.has_model())
+
+    def release_model_loader(self):
+        thread = self.sender()
+        if thread in self.finished_loaders:
+            self.finished_loaders.remove(thread)
+
+    def update_model_load_progress(self, stage, percent):
+        if self.sender() is self.loader_thread:
+            self.loading_bar.setValue(percent)
+            self.loading_bar.setFormat(f"Loading {self.loader_thread.settings['model']}: {stage} (%p%)")
+
+    def finish_model_load(self, prepared):
+        thread = self.sender()
+        if thread is not self.loader_thread:
+            return
+        self.loader_thread = None
+        self.finished_loaders.append(thread)
+        if self.generator is None:
+            from launcher.generators.ai.conversation import ConversationSession
+            from launcher.generators.ai.scheduler import GenerationScheduler
+            self.generator = thread.generator
+            # Called on the scheduler thread, the signal hands the metrics over to the GUI thread.
+            self.generator.add_metrics_callback(self.signals.metrics.emit)
+            self.session = ConversationSession(self.generator)
+            self.scheduler = GenerationScheduler(self.generator)
+        if prepared['load_metrics']:
+            from launcher.generators.ai.metrics import format_load_metrics
+            self.metrics_label.setText(format_load_metrics(prepared['load_metrics']))
+            self.metrics_label.show()
+        # The previous model keeps serving the queued messages until the swap comes up on the scheduler.
+        self.scheduler.submit_call(self.swap_model, prepared, thread.settings)
+
+    def swap_model(self, prepared, settings):
+        # Runs on the scheduler thread, between generations.
+        self.generator.apply_model(prepared)
+        self.session.reset()
+        self.signals.model_applied.emit(settings)
+
+    def finish_model_swap(self, settings):
+        for key in self.MODEL_SETTINGS:
+            self.settings[key] = settings[key]
+        if self.loader_thread is None:
+            self.loading_widget.hide()
+            self.set_input_enabled(True)
+        self.update_header()
+        self.startup_timer.mark('ready')
+        self.model_ready.emit()
+
+    def fail_model_load(self, error):
+        if self.sender() is self.loader_thread:
+            self.cancel_model_load()
+            self.add_message('error', f"Loading the model failed: {error}")
+
+    def abort_model_load(self):
+        if self.sender() is self.loader_thread:
+            self.cancel_model_load()
+
+    def has_model(self):
+        return self.generator is not None and self.generator.model is not None
+
+    def set_input_enabled(self, enabled):
+        self.input_field.setEnabled(enabled)
+        self.send_button.setEnabled(enabled)
+        self.input_field.setPlaceholderText("Type your message here..." if enabled else "Waiting for the model...")
 
     def update_header(self):
-        self.model_name_label.setText(f"Model: {self.settings['model']}  |  Device: {self.settings['device']}  |  Half model accuracy: {self.settings['half_model_accuracy']}")
+        self.model_name_label.setText(f"Model: {self.settings['model']}  |  Device: {self.settings['device']}  |  Precision: {self.settings['precision']}  |  Backend: {self.settings['backend']}")
+
+    def update_metrics(self, metrics):
+        from launcher.generators.ai.metrics import format_metrics
+        self.metrics_label.setText(format_metrics(metrics))
+        self.metrics_label.show()
+
+    def update_telemetry(self):
+        sample = self.telemetry.latest()
+        if sample is not None:
+            self.telemetry_label.setText(format_sample(sample))
 
     def send_message(self):
         user_text = self.input_field.text()
-        if user_text:
-            self.chat_display.append(f"<b>You:</b> {user_text}")
+        if user_text and self.has_model():
+            self.add_message('user', user_text)
             self.input_field.clear()
 
-            self.thread = TextGeneratorThread(
+            # A new message supersedes the reply that is still being generated, which keeps what it has so far.
+            self.stop_generation()
+            # Messages are served one after another by the scheduler, which owns the model.
+            self.message_count += 1
+            cancel_event = threading.Event()
+            self.cancel_events[self.message_count] = cancel_event
+            self.stop_button.setEnabled(True)
+            self.scheduler.submit_call(self.run_chat_turn, self.message_count, user_text, dict(self.settings),
+                                       cancel_event)
+
+    def stop_generation(self):
+        for cancel_event in self.cancel_events.values():
+            cancel_event.set()
+
+    def run_chat_turn(self, message_id, user_text, settings, cancel_event):
+        # Runs on the scheduler thread.
+        if cancel_event.is_set():
+            self.signals.finished.emit(message_id, '')
+            return
+        self.signals.started.emit(message_id)
+        try:
+            reply = self.session.generate_text(
                 user_text,
-                self.generator,
-                max_length=self.settings['max_length'],
-                temperature=self.settings['temperature'],
-                top_k=self.settings['top_k'],
-                top_p=self.settings['top_p'],
-                repetition_penalty=self.settings['repetition_penalty']
+                max_length=settings['max_length'],
+                temperature=settings['temperature'],
+                top_k=settings['top_k'],
+                top_p=settings['top_p'],
+                repetition_penalty=settings['repetition_penalty'],
+                on_text=lambda text: self.signals.new_text.emit(message_id, text),
+                cancel_event=cancel_event
             )
-            self.thread.update_text.connect(self.display_generated_text)
-            self.thread.start()
-
-    def display_generated_text(self, generated_text):
-        self.chat_display.append(f"<b>AI:</b> {generated_text}")
+        except Exception as e:
+            self.signals.failed.emit(message_id, str(e))
+            return
+        self.signals.finished.emit(message_id, reply)
+
+    def is_scrolled_to_bottom(self):
+        scroll_bar = self.chat_view.verticalScrollBar()
+        return scroll_bar.value() >= scroll_bar.maximum()
+
+    def add_message(self, role, text):
+        follow = self.is_scrolled_to_bottom()
+        self.transcript.append_message(role, text)
+        if follow:
+            self.chat_view.scrollToBottom()
+
+    def start_generated_text(self, message_id):
+        follow = self.is_scrolled_to_bottom()
+        self.streaming_message_id = message_id
+        self.transcript.start_streaming('ai')
+        if follow:
+            self.chat_view.scrollToBottom()
+
+    def display_generated_text(self, message_id, text):
+        if message_id != self.streaming_message_id:
+            return
+        follow = self.is_scrolled_to_bottom()
+        # Only the last row changes; TranscriptDelegate tells the view when it wrapped onto a new line.
+        self.follow_stream = follow
+        self.transcript.append_text(text)
+        if follow:
+            self.chat_view.scrollToBottom()
+
+    def keep_scrolled_to_bottom(self, minimum, maximum):
+        # The view lays out a reply that wrapped onto a new line after its text was appended.
+        if self.follow_stream:
+            self.chat_view.verticalScrollBar().setValue(maximum)
+
+    def finish_generated_text(self, message_id, reply=None):
+        self.cancel_events.pop(message_id, None)
+        self.stop_button.setEnabled(bool(self.cancel_events))
+        if message_id == self.streaming_message_id:
+            self.streaming_message_id = None
+            self.follow_stream = False
+            self.transcript.finish_streaming()
+
+    def display_generation_error(self, message_id, error):
+        self.finish_generated_text(message_id)
+        self.add_message('error', error)
 
     def clear_chat(self):
-        self.chat_display.clear()
+        self.stop_generation()
+        self.streaming_message_id = None
+        self.follow_stream = False
+        self.transcript.clear()
+        if self.session is not None:
+            self.session.reset()
+
+    def closeEvent(self, event):
+        self.telemetry_timer.stop()
+        self.stop_generation()
+        self.cancel_model_load()
+        if self.scheduler is not None:
+            self.scheduler.stop(wait=False)
+        # Replies still finishing on the scheduler thread must not reach the closed transcript.
+        self.signals.blockSignals(True)
+        self.transcript.finish_streaming()
+        self.transcript.store.close()
+        super().closeEvent(event)
 
 
 if __name__ == '__main__':
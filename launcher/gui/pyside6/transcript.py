@@ -0,0 +1,205 @@
+import os
+import sqlite3
+import tempfile
+import time
+from collections import OrderedDict
+
+from PySide6.QtCore import QAbstractListModel, QModelIndex, Qt
+from PySide6.QtGui import QColor
+from PySide6.QtWidgets import QStyledItemDelegate
+
+ROLE_LABELS = {'user': 'You', 'ai': 'AI', 'error': 'Error'}
+ROLE_COLORS = {'user': '#9cdcfe', 'ai': '#ffffff', 'error': '#ff6b6b'}
+
+
+class TranscriptStore:
+    """
+    Chat messages kept in SQLite, so the window only holds the ones on screen.
+    """
+
+    def __init__(self, path=None):
+        """
+        :param path: Database file, defaults to a temporary file that is deleted on close.
+        """
+        self.temporary = path is None
+        if path is None:
+            descriptor, path = tempfile.mkstemp(prefix='lcnlp-transcript-', suffix='.sqlite')
+            os.close(descriptor)
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS messages "
+                                "(id INTEGER PRIMARY KEY, role TEXT NOT NULL, text TEXT NOT NULL, created REAL)")
+
+    def count(self):
+        return self.connection.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+
+    def append(self, role, text):
+        with self.connection:
+            cursor = self.connection.execute("INSERT INTO messages (role, text, created) VALUES (?, ?, ?)",
+                                             (role, text, time.time()))
+        return cursor.lastrowid
+
+    def update(self, message_id, text):
+        with self.connection:
+            self.connection.execute("UPDATE messages SET text = ? WHERE id = ?", (text, message_id))
+
+    def fetch(self, offset, limit):
+        """
+        :return: List of (id, role, text) tuples of the messages at positions offset to offset + limit.
+        """
+        return self.connection.execute("SELECT id, role, text FROM messages ORDER BY id LIMIT ? OFFSET ?",
+                                       (limit, offset)).fetchall()
+
+    def clear(self):
+        with self.connection:
+            self.connection.execute("DELETE FROM messages")
+
+    def close(self):
+        self.connection.close()
+        if self.temporary:
+            os.remove(self.path)
+
+
+class TranscriptModel(QAbstractListModel):
+    """
+    List model over a TranscriptStore for a QListView.
+
+    Messages are read from the store a page at a time when the view asks for them, and only a few pages are kept in
+    memory. The message being streamed is held in memory until finish_streaming writes it to the store, so every
+    token only changes that one row.
+    """
+
+    def __init__(self, store, page_size=100, max_pages=8, parent=None):
+        super().__init__(parent)
+        self.store = store
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self._count = store.count()
+        self._pages = OrderedDict()
+        self._streaming = None
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self._count
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        message = self.message(index.row())
+        if message is None:
+            return None
+        _, message_role, text = message
+        if role == Qt.DisplayRole:
+            return f"{ROLE_LABELS.get(message_role, message_role)}: {text}"
+        if role == Qt.ForegroundRole:
+            return QColor(ROLE_COLORS.get(message_role, '#ffffff'))
+        return None
+
+    def message(self, row):
+        """
+        :return: The (id, role, text) tuple of the row.
+        """
+        if self._streaming is not None and row == self._streaming['row']:
+            return self._streaming['id'], self._streaming['role'], self._streaming['text']
+        page_number = row // self.page_size
+        page = self._pages.get(page_number)
+        if page is None:
+            page = self.store.fetch(page_number * self.page_size, self.page_size)
+            self._pages[page_number] = page
+            while len(self._pages) > self.max_pages:
+                self._pages.popitem(last=False)
+        else:
+            self._pages.move_to_end(page_number)
+        offset = row - page_number * self.page_size
+        return page[offset] if offset < len(page) else None
+
+    def append_message(self, role, text):
+        """
+        Add a finished message at the end.
+
+        :return: Its row.
+        """
+        self.finish_streaming()
+        row = self._count
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.store.append(role, text)
+        self._count += 1
+        self._pages.pop(row // self.page_size, None)
+        self.endInsertRows()
+        return row
+
+    def start_streaming(self, role, text=''):
+        """
+        Add a message at the end that receives text with append_text until finish_streaming.
+
+        :return: Its row.
+        """
+        row = self.append_message(role, text)
+        message_id = self.message(row)[0]
+        self._streaming = {'row': row, 'id': message_id, 'role': role, 'text': text}
+        return row
+
+    def append_text(self, text):
+        if self._streaming is None:
+            return
+        self._streaming['text'] += text
+        index = self.index(self._streaming['row'])
+        self.dataChanged.emit(index, index, [Qt.DisplayRole])
+
+    def finish_streaming(self):
+        streaming = self._streaming
+        if streaming is None:
+            return
+        self._streaming = None
+        self.store.update(streaming['id'], streaming['text'])
+        self._pages.pop(streaming['row'] // self.page_size, None)
+
+    def is_streaming(self):
+        return self._streaming is not None
+
+    def clear(self):
+        self.beginResetModel()
+        self._streaming = None
+        self.store.clear()
+        self._count = 0
+        self._pages.clear()
+        self.endResetModel()
+
+
+class TranscriptDelegate(QStyledItemDelegate):
+    """
+    Item delegate for a QListView over a TranscriptModel that remembers the size hint of every row.
+
+    Finished messages never change, so laying out the list again doesn't read them from the store or wrap their text
+    again. When a message changes, only its own size hint is recomputed, and the view is told with sizeHintChanged
+    only when its height changed, i.e. when a streamed reply wraps onto a new line.
+    """
+
+    def __init__(self, view):
+        super().__init__(view)
+        self.view = view
+        self._size_hints = {}
+        self._width = None
+        model = view.model()
+        model.dataChanged.connect(self._data_changed)
+        model.modelReset.connect(self._size_hints.clear)
+
+    def sizeHint(self, option, index):
+        width = self.view.viewport().width()
+        if width != self._width:
+            # Word wrapping depends on the width, every row wraps differently now.
+            self._width = width
+            self._size_hints.clear()
+        hint = self._size_hints.get(index.row())
+        if hint is None:
+            hint = super().sizeHint(option, index)
+            self._size_hints[index.row()] = hint
+        return hint
+
+    def _data_changed(self, top_left, bottom_right, roles=()):
+        for row in range(top_left.row(), bottom_right.row() + 1):
+            previous = self._size_hints.pop(row, None)
+            if previous is None:
+                continue
+            index = top_left.sibling(row, 0)
+            if self.view.sizeHintForIndex(index).height() != previous.height():
+                self.sizeHintChanged.emit(index)
@@ -0,0 +1,151 @@
+import json
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from launcher.generators.ai.parameters import validate_sampling_parameters
+
+
+class InferenceHTTPServer(ThreadingHTTPServer):
+    """
+    Local HTTP server answering completion requests with a shared GenerationScheduler.
+
+    Every connection is handled on its own thread, but all of them feed the same scheduler queue, so there is one
+    model no matter how many clients are connected. A ReplicaPool can stand in for the scheduler to spread the
+    requests over several CPU processes.
+    """
+    daemon_threads = True
+
+    def __init__(self, server_address, scheduler):
+        super().__init__(server_address, CompletionRequestHandler)
+        self.scheduler = scheduler
+
+
+class CompletionRequestHandler(BaseHTTPRequestHandler):
+    """
+    Endpoints:
+     - GET /health: model, device and precision currently served.
+     - POST /v1/completions: JSON body with 'prompt' (string or list of strings), optional sampling parameters
+       (max_length, temperature, top_k, top_p, repetition_penalty), 'do_sample', 'seed', 'stop' (string or list
+       of strings ending the reply), 'timeout' (seconds, including the wait in the queue) and 'stream'. Greedy and
+       seeded requests are answered from the generator's response cache when repeated. Streamed responses are sent as
+       newline-delimited JSON objects: {"text": piece} for each piece, then {"done": true, "text": full_text}. A
+       streamed generation stops when the client disconnects. Requests whose memory can't be found on the device
+       are answered with 503.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path != '/health':
+            self.send_json(404, {'error': f"Unknown endpoint '{self.path}'"})
+            return
+        generator = self.server.scheduler.generator
+        self.send_json(200, {
+            'status': 'ok' if generator.model is not None else 'no model',
+            'model': generator.model_name,
+            'device': str(generator.device),
+            'precision': generator.precision
+        })
+
+    def do_POST(self):
+        if self.path != '/v1/completions':
+            self.send_json(404, {'error': f"Unknown endpoint '{self.path}'"})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            body = json.loads(self.rfile.read(length) or b'{}')
+            if not isinstance(body, dict):
+                raise ValueError("The request body must be a JSON object")
+            prompt = body.get('prompt')
+            prompts = prompt if isinstance(prompt, list) else [prompt]
+            if not prompts or not all(isinstance(item, str) and item for item in prompts):
+                raise ValueError("'prompt' must be a non-empty string or a list of non-empty strings")
+            parameters = validate_sampling_parameters(body)
+            parameters['do_sample'] = bool(body.get('do_sample', True))
+            seed = body.get('seed')
+            if seed is not None and (isinstance(seed, bool) or not isinstance(seed, int)):
+                raise ValueError("'seed' must be an integer")
+            parameters['seed'] = seed
+            stop = body.get('stop')
+            stop = [stop] if isinstance(stop, str) else stop
+            if stop is not None and not (isinstance(stop, list) and all(isinstance(item, str) and item
+                                                                        for item in stop)):
+                raise ValueError("'stop' must be a non-empty string or a list of non-empty strings")
+            parameters['stop_strings'] = stop
+            timeout = body.get('timeout')
+            if timeout is not None:
+                if isinstance(timeout, bool) or not isinstance(timeout, (int, float)) or timeout <= 0:
+                    raise ValueError("'timeout' must be a positive number of seconds")
+                parameters['deadline'] = time.monotonic() + timeout
+            stream = bool(body.get('stream', False))
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+            return
+
+        if stream:
+            if len(prompts) != 1:
+                self.send_json(400, {'error': "Streaming supports a single prompt per request"})
+                return
+            self.stream_completion(prompts[0], parameters)
+        else:
+            self.complete(prompts, parameters)
+
+    def complete(self, prompts, parameters):
+        scheduler = self.server.scheduler
+        futures = [scheduler.submit(prompt, **parameters) for prompt in prompts]
+        try:
+            texts = [future.result() for future in futures]
+        except TimeoutError as e:
+            self.send_json(504, {'error': str(e)})
+            return
+        except MemoryError as e:
+            # Rejected by admission control, the same request may fit once the server is less busy.
+            self.send_json(503, {'error': str(e)})
+            return
+        except Exception as e:
+            self.send_json(500, {'error': str(e)})
+            return
+        self.send_json(200, {
+            'model': scheduler.generator.model_name,
+            'choices': [{'index': index, 'text': text} for index, text in enumerate(texts)]
+        })
+
+    def stream_completion(self, prompt, parameters):
+        pieces = queue.Queue()
+        cancel_event = threading.Event()
+        future = self.server.scheduler.submit(prompt, on_text=pieces.put, cancel_event=cancel_event, **parameters)
+        future.add_done_callback(lambda _: pieces.put(None))
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        try:
+            while True:
+                piece = pieces.get()
+                if piece is None:
+                    break
+                self.write_chunk({'text': piece})
+            if future.exception() is not None:
+                self.write_chunk({'error': str(future.exception())})
+            else:
+                self.write_chunk({'done': True, 'text': future.result()})
+            self.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            # The client went away, nobody wants the rest of the text.
+            cancel_event.set()
+            self.close_connection = True
+
+    def write_chunk(self, payload):
+        data = (json.dumps(payload) + '\n').encode('utf-8')
+        self.wfile.write(f"{len(data):X}\r\n".encode('ascii') + data + b'\r\n')
+        self.wfile.flush()
+
+    def send_json(self, status, payload):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
@@ -0,0 +1,202 @@
+import itertools
+import os
+import platform
+import statistics
+import tempfile
+import time
+
+import torch
+import transformers
+
+from launcher.generators.ai.NLP_Generator import AdvancedTextGenerator
+from launcher.generators.backends.registry import get_backend
+from launcher.generators.ai.tiny_models import create_tiny_model
+from launcher.utils.devices.telemetry import shared_sampler, summarize
+
+# Model names starting with this prefix are tiny randomly-initialized models created on the fly, e.g. 'tiny-gpt2'.
+TINY_MODEL_PREFIX = 'tiny-'
+
+# Metrics compared against a baseline, and whether a higher value is better.
+METRICS = {
+    'ttft_s': False,
+    'decode_tokens_per_s': True,
+    'latency_s': False,
+    'peak_rss_mb': False,
+    'peak_vram_mb': False,
+    'load_peak_rss_mb': False,
+}
+
+CONFIG_KEYS = ('model', 'device', 'precision', 'backend', 'prompt_length', 'max_length')
+# Reports made before a key existed ran with its default.
+CONFIG_DEFAULTS = {'backend': 'torch'}
+
+_PROMPT_TEXT = ("What is quasar? A quasar is an extremely luminous active galactic nucleus, powered by a "
+                "supermassive black hole surrounded by a gaseous accretion disc. ")
+
+
+def resolve_model(model_name, cache_dir):
+    """
+    Turn 'tiny-<family>' names into the path of a tiny model, created in cache_dir on first use.
+    """
+    if not model_name.startswith(TINY_MODEL_PREFIX):
+        return model_name
+    family = model_name[len(TINY_MODEL_PREFIX):]
+    return create_tiny_model(os.path.join(cache_dir, model_name), family=family)
+
+
+def build_prompt(tokenizer, length):
+    """
+    Build a prompt of roughly the given number of tokens.
+    """
+    text = _PROMPT_TEXT
+    while len(tokenizer(text)['input_ids']) < length:
+        text += _PROMPT_TEXT
+    return tokenizer.decode(tokenizer(text)['input_ids'][:length])
+
+
+def measure_generation(generator, prompt, max_length, seed=0):
+    """
+    Run one generation and measure it.
+
+    :return: Dictionary with time-to-first-token, decode tokens/s, end-to-end latency and peak memory.
+    """
+    # The same seed makes every repeat generate the same number of tokens.
+    torch.manual_seed(seed)
+    start = time.perf_counter()
+    generator.generate_text(prompt, max_length=max_length)
+    end = time.perf_counter()
+
+    metrics = generator.last_metrics
+    return {
+        'generated_tokens': metrics['generated_tokens'],
+        # Measured by the generator from the start of model.generate, so tokenization isn't included.
+        'ttft_s': metrics['prefill_s'],
+        'decode_tokens_per_s': metrics['decode_tokens_per_s'],
+        'latency_s': end - start,
+        'peak_rss_mb': metrics['peak_rss_mb'],
+        'peak_vram_mb': metrics['peak_vram_mb'],
+    }
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'torch': torch.__version__,
+        'transformers': transformers.__version__,
+        'torch_threads': torch.get_num_threads(),
+        'cuda_devices': [torch.cuda.get_device_name(i) for i in range(torch.cuda.device_count())]
+        if torch.cuda.is_available() else [],
+    }
+
+
+def run_benchmark(models, devices, precisions, prompt_lengths, max_lengths, repeats=3, warmup=1, cache_dir=None,
+                  log=print, backends=('torch',), telemetry_interval=0.25):
+    """
+    Benchmark AdvancedTextGenerator over the matrix of models, devices, precisions, backends, prompt lengths and max
+    lengths. Combinations of precision, device and backend that can't run are skipped.
+
+    :param cache_dir: Directory for the tiny models, a temporary one by default.
+    :param telemetry_interval: Seconds between two hardware samples taken during the measured repeats.
+    :return: Report dictionary with the environment and one result per combination, holding the median of the
+             repeats for every metric, and the CPU/GPU utilization over the repeats under 'telemetry'.
+    """
+    telemetry = shared_sampler(telemetry_interval)
+    temporary_dir = None
+    if cache_dir is None:
+        temporary_dir = tempfile.TemporaryDirectory(prefix='lcnlp-benchmark-')
+        cache_dir = temporary_dir.name
+
+    results = []
+    try:
+        for model_name, device_id, precision, backend in itertools.product(models, devices, precisions, backends):
+            try:
+                get_backend(backend).check(torch.device(device_id), precision)
+            except ValueError as e:
+                log(f"Skipping {model_name} on {device_id} in {precision} with {backend}: {e}")
+                continue
+
+            # The caches would answer the repeats without running the model, and a tuned CPU profile would make
+            # the results depend on the machine's earlier runs.
+            generator = AdvancedTextGenerator(model_name=resolve_model(model_name, cache_dir), device_id=device_id,
+                                              precision=precision, load_on_init=False, prefix_cache_mb=0,
+                                              response_cache_size=0, cpu_tuning=False, backend=backend)
+            generator.apply_model(generator.prepare_model(generator.model_name))
+            load_metrics = generator.last_load_metrics
+
+            for prompt_length, max_length in itertools.product(prompt_lengths, max_lengths):
+                prompt = build_prompt(generator.tokenizer, prompt_length)
+                for _ in range(warmup):
+                    measure_generation(generator, prompt, max_length)
+                started = time.time()
+                runs = [measure_generation(generator, prompt, max_length) for _ in range(repeats)]
+                utilization = summarize(telemetry.samples(since=started))
+
+                result = {
+                    'model': model_name,
+                    'device': device_id,
+                    'precision': precision,
+                    'backend': backend,
+                    'prompt_length': prompt_length,
+                    'max_length': max_length,
+                    'repeats': repeats,
+                    'generated_tokens': runs[-1]['generated_tokens'],
+                    'load_s': load_metrics['load_s'],
+                    'load_peak_rss_mb': load_metrics['peak_rss_mb'],
+                    'telemetry': utilization,
+                }
+                for metric in METRICS:
+                    if metric not in result:
+                        result[metric] = statistics.median(run[metric] for run in runs)
+                results.append(result)
+                log(format_result(result))
+            del generator
+    finally:
+        if temporary_dir is not None:
+            temporary_dir.cleanup()
+
+    return {'environment': environment(), 'results': results}
+
+
+def config_key(result):
+    return tuple(result.get(key, CONFIG_DEFAULTS.get(key)) for key in CONFIG_KEYS)
+
+
+def compare_with_baseline(report, baseline, threshold=0.1):
+    """
+    Compare the results of two reports made by run_benchmark.
+
+    :param threshold: Relative change from which a metric that got worse counts as a regression.
+    :return: List of comparisons {'config', 'metric', 'baseline', 'current', 'change', 'regression'} for every
+             metric of every combination present in both reports.
+    """
+    baseline_results = {config_key(result): result for result in baseline['results']}
+    comparisons = []
+    for result in report['results']:
+        previous = baseline_results.get(config_key(result))
+        if previous is None:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            old, new = previous.get(metric), result.get(metric)
+            if old is None or new is None or old == 0:
+                continue
+            change = (new - old) / old
+            worse = -change if higher_is_better else change
+            comparisons.append({
+                'config': dict(zip(CONFIG_KEYS, config_key(result))),
+                'metric': metric,
+                'baseline': old,
+                'current': new,
+                'change': change,
+                'regression': worse > threshold,
+            })
+    return comparisons
+
+
+def format_result(result):
+    return (f"{result['model']} | {result['device']} | {result['precision']} | {result['backend']} | prompt {result['prompt_length']} | "
+            f"max_length {result['max_length']}: TTFT {result['ttft_s'] * 1000:.1f} ms, "
+            f"decode {result['decode_tokens_per_s']:.1f} tokens/s, latency {result['latency_s']:.3f} s, "
+            f"peak RSS {result['peak_rss_mb']:.0f} MB, peak VRAM {result['peak_vram_mb']:.0f} MB")
@@ -0,0 +1,160 @@
+import json
+import os
+import platform
+import statistics
+import threading
+import time
+
+import torch
+
+DEFAULT_PROFILES_PATH = os.path.join(os.path.expanduser('~'), '.lcnlp', 'cpu_profiles.json')
+
+# CPUs the process was allowed to run on at startup, restored by the 'all' affinity.
+_STARTUP_AFFINITY = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else None
+
+
+def machine_id(device_info):
+    """
+    Identify the machine a profile was tuned on, from DeviceManager.get_device_info of the CPU.
+    """
+    processor = platform.processor() or platform.machine()
+    return f"{platform.node()} | {processor} | {device_info['CPU Cores']} cores, {device_info['CPU Threads']} threads"
+
+
+def cpu_topology():
+    """
+    Map every allowed logical CPU to its (package, core), read from sysfs on Linux.
+
+    :return: Dictionary {cpu: (package, core)}, or None when the topology isn't available.
+    """
+    if _STARTUP_AFFINITY is None:
+        return None
+    topology = {}
+    for cpu in _STARTUP_AFFINITY:
+        base = f'/sys/devices/system/cpu/cpu{cpu}/topology'
+        try:
+            with open(os.path.join(base, 'physical_package_id')) as file:
+                package = int(file.read())
+            with open(os.path.join(base, 'core_id')) as file:
+                core = int(file.read())
+        except (OSError, ValueError):
+            return None
+        topology[cpu] = (package, core)
+    return topology
+
+
+def affinity_options():
+    """
+    List the CPU sets worth trying: all allowed CPUs, one logical CPU per physical core (no hyperthread siblings),
+    and the physical cores of the first socket on multi-socket hosts.
+
+    :return: Dictionary mapping the affinity name to its sorted list of CPUs, or None for no pinning.
+    """
+    options = {'all': _STARTUP_AFFINITY}
+    topology = cpu_topology()
+    if not topology:
+        return options
+
+    first_cpu_of_core = {}
+    for cpu, core in sorted(topology.items()):
+        first_cpu_of_core.setdefault(core, cpu)
+    physical = sorted(first_cpu_of_core.values())
+    if len(physical) < len(topology):
+        options['physical'] = physical
+    packages = sorted({package for package, _ in first_cpu_of_core})
+    if len(packages) > 1:
+        options['socket0'] = sorted(cpu for (package, _), cpu in first_cpu_of_core.items() if package == packages[0])
+    return options
+
+
+def candidate_settings(physical_cores):
+    """
+    Build the (affinity, cpus, num_threads) settings to benchmark.
+    """
+    candidates = []
+    for affinity, cpus in affinity_options().items():
+        available = len(cpus) if cpus else os.cpu_count()
+        thread_counts = {available, max(1, available // 2), min(physical_cores, available)}
+        for num_threads in sorted(thread_counts):
+            candidates.append({'affinity': affinity, 'cpus': cpus, 'num_threads': num_threads})
+    return candidates
+
+
+def apply_cpu_settings(settings):
+    """
+    Apply a profile: the intra-op thread count and the CPU affinity of every thread of the process.
+    """
+    torch.set_num_threads(settings['num_threads'])
+    cpus = settings.get('cpus') or _STARTUP_AFFINITY
+    if cpus is None or not hasattr(os, 'sched_setaffinity'):
+        return
+    # sched_setaffinity only changes one thread, torch's worker threads already exist.
+    for thread_id in os.listdir('/proc/self/task'):
+        try:
+            os.sched_setaffinity(int(thread_id), cpus)
+        except OSError:
+            pass  # The thread exited meanwhile
+
+
+def tune_cpu(benchmark, physical_cores, repeats=2, log=None, cancel_event=None):
+    """
+    Benchmark every candidate setting and keep the fastest one applied.
+
+    :param benchmark: Callable running a short generation and returning its tokens per second.
+    :param log: Optional callable receiving one line per candidate.
+    :param cancel_event: Optional threading.Event checked between candidates; once set, the fastest setting
+                         measured so far is applied and None is returned.
+    :return: Profile dictionary with the best 'affinity', 'cpus', 'num_threads' and 'tokens_per_s', plus all the
+             measured 'candidates'.
+    """
+    results = []
+    for settings in candidate_settings(physical_cores):
+        if cancel_event is not None and cancel_event.is_set():
+            if results:
+                apply_cpu_settings(max(results, key=lambda result: result['tokens_per_s']))
+            return None
+        apply_cpu_settings(settings)
+        # The first run warms up the thread pool and the allocator for the new settings.
+        benchmark()
+        tokens_per_s = statistics.median(benchmark() for _ in range(repeats))
+        results.append(dict(settings, tokens_per_s=tokens_per_s))
+        if log is not None:
+            log(f"{settings['affinity']} affinity, {settings['num_threads']} threads: {tokens_per_s:.1f} tokens/s")
+
+    best = max(results, key=lambda result: result['tokens_per_s'])
+    apply_cpu_settings(best)
+    return dict(best, tuned_at=time.time(), candidates=results)
+
+
+class CpuProfileStore:
+    """
+    Tuned CPU settings per (machine, model), persisted as JSON.
+    """
+
+    def __init__(self, path=DEFAULT_PROFILES_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _read(self):
+        try:
+            with open(self.path) as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable CPU profiles in {self.path}: {e}")
+            return {}
+
+    def get(self, machine, model):
+        with self._lock:
+            return self._read().get(machine, {}).get(model)
+
+    def put(self, machine, model, profile):
+        with self._lock:
+            profiles = self._read()
+            profiles.setdefault(machine, {})[model] = profile
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            temporary_path = self.path + '.tmp'
+            with open(temporary_path, 'w') as file:
+                json.dump(profiles, file, indent=2)
+            os.replace(temporary_path, self.path)
@@ -1,7 +1,65 @@
+import threading
+
 import torch
-import GPUtil
 import psutil
 
+from launcher.utils.devices.telemetry import running_sampler, shared_sampler
+
+# What doesn't change while the process runs, probed once and shared by every DeviceManager.
+_inventory = None
+_inventory_lock = threading.Lock()
+
+
+def _probe_inventory():
+    devices = []
+    cuda = {}
+    if torch.cuda.is_available():
+        for i in range(torch.cuda.device_count()):
+            devices.append(f'cuda:{i}')
+            device_properties = torch.cuda.get_device_properties(i)
+            cuda[i] = {
+                'Device ID': i,
+                'Device Name': device_properties.name,
+                'Total Memory (MB)': device_properties.total_memory / (1024 ** 2),
+                'Compute Capability': f"{device_properties.major}.{device_properties.minor}",
+            }
+        # Additional details from GPUtil, imported here since it is only needed for CUDA devices
+        try:
+            import GPUtil
+            for gpu in GPUtil.getGPUs():
+                if gpu.id in cuda:
+                    cuda[gpu.id]['Manufacturer'] = gpu.name.split()[0]  # Extracting manufacturer from the name
+                    cuda[gpu.id]['Model'] = gpu.name  # Full model name
+                    cuda[gpu.id]['Driver Version'] = gpu.driver
+        except Exception as e:
+            print(f"Couldn't read the GPU details: {e}")
+    devices.append('cpu')
+
+    frequency = psutil.cpu_freq()
+    cpu = {
+        'Device Name': 'CPU',
+        'CPU Cores': psutil.cpu_count(logical=False),
+        'CPU Threads': psutil.cpu_count(logical=True),
+        'CPU Frequency (MHz)': frequency.current if frequency is not None else None,
+        'Total Memory (MB)': psutil.virtual_memory().total / (1024 ** 2),
+    }
+    return {'devices': devices, 'cuda': cuda, 'cpu': cpu}
+
+
+def device_inventory(refresh=False):
+    """
+    The devices of the machine and their fixed details, probed on first use.
+
+    :param refresh: Probe again, e.g. after a GPU was added.
+    :return: Dictionary with 'devices' (device ids, CUDA devices first), 'cuda' ({index: details}) and 'cpu'
+             (details).
+    """
+    global _inventory
+    with _inventory_lock:
+        if _inventory is None or refresh:
+            _inventory = _probe_inventory()
+        return _inventory
+
 
 class DeviceManager:
     def __init__(self):
@@ -12,12 +70,7 @@ class DeviceManager:
         """
         Returns a list of available devices (GPUs) and CPU.
         """
-        devices = []
-        if torch.cuda.is_available():
-            for i in range(torch.cuda.device_count()):
-                devices.append(f'cuda:{i}')
-        devices.append('cpu')
-        return devices
+        return list(device_inventory()['devices'])
 
     def set_device(self, device_id):
         """
@@ -44,41 +97,70 @@ class DeviceManager:
         for device in self.available_devices:
             print(f" - {device}")
 
-    def get_device_info(self):
+    def get_inventory(self):
         """
-        Print detailed information about the selected device.
+        Collect the memory of every available device, without changing the selected device.
+
+        :return: List of {'device', 'name', 'total_mb', 'free_mb'} dictionaries, CUDA devices first.
+        """
+        selected = self.device
+        inventory = []
+        try:
+            for device_id in self.available_devices:
+                self.device = torch.device(device_id)
+                device_info = self.get_device_info(verbose=False)
+                inventory.append({
+                    'device': device_id,
+                    'name': device_info['Device Name'],
+                    'total_mb': device_info['Total Memory (MB)'],
+                    'free_mb': device_info['Available Memory (MB)'],
+                })
+        finally:
+            self.device = selected
+        return inventory
+
+    def get_device_info(self, verbose=False):
+        """
+        Collect detailed information about the selected device.
+
+        The fixed details come from the shared inventory and only the memory figures are read again, so this is
+        cheap enough to call while a model generates.
+
+        :param verbose: Print the collected information.
+        :return: Dictionary with the device details and memory figures in MB.
         """
         if self.device is None:
             raise ValueError("No device selected. Use 'set_device' to select a device.")
 
-        device_info = {}
+        inventory = device_inventory()
         if self.device.type == 'cuda':
             device_id = int(self.device.index)
-            device_properties = torch.cuda.get_device_properties(device_id)
+            free_memory, _ = torch.cuda.mem_get_info(device_id)
 
-            device_info['Device ID'] = device_id
-            device_info['Device Name'] = device_properties.name
+            device_info = dict(inventory['cuda'][device_id])
             device_info['Memory Allocated (MB)'] = torch.cuda.memory_allocated(device_id) / (1024 ** 2)
             device_info['Memory Cached (MB)'] = torch.cuda.memory_reserved(device_id) / (1024 ** 2)
-            device_info['Total Memory (MB)'] = device_properties.total_memory / (1024 ** 2)
-            device_info['Driver Version'] = device_properties.driver_version
-            device_info['Compute Capability'] = f"{device_properties.major}.{device_properties.minor}"
-
-            # Additional details from GPUtil
-            gpus = GPUtil.getGPUs()
-            for gpu in gpus:
-                if gpu.id == device_id:
-                    device_info['Manufacturer'] = gpu.name.split()[0]  # Extracting manufacturer from the name
-                    device_info['Model'] = gpu.name  # Full model name
-                    break
+            device_info['Available Memory (MB)'] = free_memory / (1024 ** 2)
         else:
             # For CPU
-            device_info['Device Name'] = 'CPU'
-            device_info['CPU Cores'] = psutil.cpu_count(logical=False)
-            device_info['CPU Threads'] = psutil.cpu_count(logical=True)
-            device_info['CPU Frequency (MHz)'] = psutil.cpu_freq().current
+            device_info = dict(inventory['cpu'])
+            device_info['Available Memory (MB)'] = psutil.virtual_memory().available / (1024 ** 2)
+            # The current frequency changes with the load; the sampler has a recent one when it runs.
+            sampler = running_sampler()
+            sample = sampler.latest() if sampler is not None else None
+            if sample is not None and sample['cpu_freq_mhz'] is not None:
+                device_info['CPU Frequency (MHz)'] = sample['cpu_freq_mhz']
+
+        if verbose:
+            print("Device Information:")
+            for key, value in device_info.items():
+                print(f"{key}: {value}")
+        return device_info
 
-        print("Device Information:")
-        for key, value in device_info.items():
-            print(f"{key}: {value}")
+    def telemetry(self, interval=None):
+        """
+        The background sampler of the process, started on first use; see launcher.utils.devices.telemetry.
 
+        :param interval: Optional new sampling interval in seconds.
+        """
+        return shared_sampler(interval)
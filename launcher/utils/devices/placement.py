@@ -0,0 +1,137 @@
+"""
+Placement of a model's transformer blocks across several devices.
+
+The planner works on plain numbers: the model config and an inventory of devices with their free memory, as returned
+by DeviceManager.get_inventory or built by simulated_inventory. It doesn't touch torch, so placements can be planned
+and checked on machines without the devices.
+"""
+
+# Device id selecting automatic placement instead of a single device.
+AUTO_DEVICE = 'auto'
+
+# Module names of the supported architectures: embeddings (with the tied lm_head), the prefix of the numbered
+# transformer blocks and the modules after the last block.
+LAYOUTS = {
+    'gpt2': {
+        'embeddings': ('transformer.wte', 'transformer.wpe', 'lm_head'),
+        'blocks': 'transformer.h',
+        'final': ('transformer.ln_f',),
+    },
+    'gpt_neo': {
+        'embeddings': ('transformer.wte', 'transformer.wpe', 'lm_head'),
+        'blocks': 'transformer.h',
+        'final': ('transformer.ln_f',),
+    },
+}
+
+
+def simulated_inventory(gpu_free_mb=(), cpu_free_mb=16384):
+    """
+    Build a device inventory without querying the hardware, e.g. simulated_inventory([8000, 8000], 32000) for two
+    GPUs with 8 GB free each and 32 GB of RAM.
+    """
+    inventory = [{'device': f'cuda:{index}', 'name': f'Simulated GPU {index}', 'total_mb': free_mb,
+                  'free_mb': free_mb} for index, free_mb in enumerate(gpu_free_mb)]
+    inventory.append({'device': 'cpu', 'name': 'Simulated CPU', 'total_mb': cpu_free_mb, 'free_mb': cpu_free_mb})
+    return inventory
+
+
+def estimate_module_sizes_mb(config, dtype_bytes=4):
+    """
+    Estimate the weight memory of the embeddings, of one transformer block and of the final modules from a config.
+
+    :param dtype_bytes: Bytes per parameter, 4 for fp32 and 2 for fp16/bf16.
+    :return: Dictionary with 'embeddings', 'block' and 'final' sizes in MB.
+    """
+    hidden = config.hidden_size
+    inner = getattr(config, 'n_inner', None) or getattr(config, 'intermediate_size', None) or 4 * hidden
+    positions = getattr(config, 'max_position_embeddings', 0)
+
+    embeddings = (config.vocab_size + positions) * hidden
+    if not getattr(config, 'tie_word_embeddings', True):
+        embeddings += config.vocab_size * hidden
+    # Query/key/value and output projections, the two MLP projections and two layer norms, with their biases.
+    block = 4 * hidden * hidden + 4 * hidden + 2 * hidden * inner + inner + hidden + 4 * hidden
+    final = 2 * hidden
+
+    to_mb = dtype_bytes / (1024 ** 2)
+    return {'embeddings': embeddings * to_mb, 'block': block * to_mb, 'final': final * to_mb}
+
+
+def plan_placement(config, inventory, dtype_bytes=4, reserve_fraction=0.15):
+    """
+    Split a model across the devices of the inventory: the GPUs in order, then the CPU for the blocks that don't fit.
+
+    Blocks stay contiguous, so hidden states only move between devices once per device boundary. The embeddings go
+    first, together with the lm_head they are tied to, and the final layer norm follows the last block.
+
+    :param inventory: List of {'device', 'free_mb'} dictionaries, see DeviceManager.get_inventory.
+    :param reserve_fraction: Fraction of the free memory of every device kept for activations and key/values.
+    :return: Dictionary with the 'device_map' for from_pretrained, the 'primary_device' inputs go to, the
+             placement per device under 'devices' and the total 'size_mb'. Raises ValueError when the model doesn't
+             fit or the architecture isn't supported.
+    """
+    layout = LAYOUTS.get(config.model_type)
+    if layout is None:
+        raise ValueError(f"Automatic placement doesn't support '{config.model_type}' models, "
+                         f"only {', '.join(LAYOUTS)}")
+
+    # GPUs first, CPU last, so only what doesn't fit on the GPUs spills to RAM.
+    inventory = sorted(inventory, key=lambda entry: entry['device'] == 'cpu')
+    budgets = [(entry['device'], entry['free_mb'] * (1 - reserve_fraction)) for entry in inventory]
+    sizes = estimate_module_sizes_mb(config, dtype_bytes)
+
+    device_map = {}
+    devices = {}
+    position = 0
+
+    def place(names, size_mb, label):
+        nonlocal position
+        while position < len(budgets):
+            device, budget_mb = budgets[position]
+            placed = devices.setdefault(device, {'modules': [], 'size_mb': 0.0, 'budget_mb': budget_mb})
+            if placed['size_mb'] + size_mb <= budget_mb:
+                for name in names:
+                    device_map[name] = device
+                placed['modules'].append(label)
+                placed['size_mb'] += size_mb
+                return
+            position += 1
+        raise ValueError(f"The model needs about {total_mb:.0f} MB and doesn't fit in the free memory of "
+                         f"{', '.join(device for device, _ in budgets)}")
+
+    total_mb = sizes['embeddings'] + sizes['block'] * config.num_hidden_layers + sizes['final']
+    place(layout['embeddings'], sizes['embeddings'], 'embeddings')
+    for index in range(config.num_hidden_layers):
+        place((f"{layout['blocks']}.{index}",), sizes['block'], index)
+    place(layout['final'], sizes['final'], 'final norm')
+
+    return {
+        'device_map': device_map,
+        'primary_device': device_map[layout['embeddings'][0]],
+        'devices': {device: placed for device, placed in devices.items() if placed['modules']},
+        'size_mb': total_mb,
+    }
+
+
+def format_placement(plan):
+    """
+    Describe a placement, one line per device, e.g. "cuda:0: embeddings, blocks 0-17 (1450 of 6800 MB)".
+    """
+    lines = []
+    for device, placed in plan['devices'].items():
+        blocks = [module for module in placed['modules'] if isinstance(module, int)]
+        parts = [module for module in placed['modules'] if module == 'embeddings']
+        if blocks:
+            parts.append(f"block {blocks[0]}" if len(blocks) == 1 else f"blocks {blocks[0]}-{blocks[-1]}")
+        parts += [module for module in placed['modules'] if module == 'final norm']
+        lines.append(f"{device}: {', '.join(parts)} ({placed['size_mb']:.0f} of {placed['budget_mb']:.0f} MB)")
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    from transformers import GPT2Config
+
+    # gpt2-xl over two small GPUs, the rest spills to the CPU.
+    gpt2_xl = GPT2Config(n_embd=1600, n_layer=48, n_head=25)
+    print(format_placement(plan_placement(gpt2_xl, simulated_inventory([2048, 2048], 16384))))
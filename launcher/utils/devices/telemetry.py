@@ -0,0 +1,230 @@
+"""
+Background hardware telemetry.
+
+A daemon thread samples CPU and GPU utilization, memory and clocks at a fixed interval into a ring buffer, so the GUI
+and the benchmarks read recent values without probing the hardware themselves. Reading never blocks on a probe.
+
+GPUs are read through NVML (the nvidia-ml-py package) when it is installed, which takes microseconds per call, and
+through GPUtil otherwise, which runs nvidia-smi for every sample. This module doesn't import torch, so the GUI can use
+it before the model is loaded.
+"""
+import os
+import threading
+import time
+from collections import deque
+
+import psutil
+
+DEFAULT_INTERVAL_S = 1.0
+DEFAULT_CAPACITY = 600
+
+
+class _NvmlReader:
+    def __init__(self):
+        import pynvml
+
+        pynvml.nvmlInit()
+        self.nvml = pynvml
+        self.handles = [pynvml.nvmlDeviceGetHandleByIndex(index) for index in range(pynvml.nvmlDeviceGetCount())]
+
+    def read(self):
+        nvml = self.nvml
+        gpus = []
+        for index, handle in enumerate(self.handles):
+            utilization = nvml.nvmlDeviceGetUtilizationRates(handle)
+            memory = nvml.nvmlDeviceGetMemoryInfo(handle)
+            gpus.append({
+                'device': f'cuda:{index}',
+                'utilization_percent': float(utilization.gpu),
+                'memory_used_mb': memory.used / (1024 ** 2),
+                'memory_total_mb': memory.total / (1024 ** 2),
+                'sm_clock_mhz': nvml.nvmlDeviceGetClockInfo(handle, nvml.NVML_CLOCK_SM),
+                'memory_clock_mhz': nvml.nvmlDeviceGetClockInfo(handle, nvml.NVML_CLOCK_MEM),
+                'temperature_c': nvml.nvmlDeviceGetTemperature(handle, nvml.NVML_TEMPERATURE_GPU),
+            })
+        return gpus
+
+
+class _GPUtilReader:
+    def __init__(self):
+        import GPUtil
+
+        self.gputil = GPUtil
+
+    def read(self):
+        return [{
+            'device': f'cuda:{gpu.id}',
+            'utilization_percent': gpu.load * 100,
+            'memory_used_mb': gpu.memoryUsed,
+            'memory_total_mb': gpu.memoryTotal,
+            'sm_clock_mhz': None,
+            'memory_clock_mhz': None,
+            'temperature_c': gpu.temperature,
+        } for gpu in self.gputil.getGPUs()]
+
+
+def gpu_reader():
+    """
+    The fastest available way to read the GPUs, or None without NVIDIA GPUs.
+    """
+    for reader in (_NvmlReader, _GPUtilReader):
+        try:
+            gpu_reader = reader()
+            if gpu_reader.read():
+                return gpu_reader
+        except Exception:
+            continue
+    return None
+
+
+class TelemetrySampler:
+    """
+    Samples the hardware in a background thread into a ring buffer of the latest samples.
+
+    Every sample is a dictionary with 'time' (time.time()), 'cpu_percent', 'cpu_freq_mhz', 'ram_used_mb',
+    'ram_available_mb', 'process_rss_mb' and 'gpus', a list with one {'device', 'utilization_percent',
+    'memory_used_mb', 'memory_total_mb', 'sm_clock_mhz', 'memory_clock_mhz', 'temperature_c'} dictionary per GPU.
+    Values a reader can't provide are None.
+    """
+
+    def __init__(self, interval=DEFAULT_INTERVAL_S, capacity=DEFAULT_CAPACITY, gpus=True):
+        """
+        :param interval: Seconds between two samples, can be changed while running.
+        :param capacity: Number of samples kept, older ones are overwritten.
+        :param gpus: Sample the GPUs too.
+        """
+        self.interval = interval
+        self._samples = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._gpus = gpus
+        self._gpu_reader = None
+        self._process = psutil.Process(os.getpid())
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        with self._lock:
+            if self.running:
+                return self
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='TelemetrySampler', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join()
+
+    def _run(self):
+        if self._gpus:
+            self._gpu_reader = gpu_reader()
+        # The first cpu_percent call only starts the measurement.
+        psutil.cpu_percent(interval=None)
+        while not self._stop.wait(self.interval):
+            try:
+                sample = self.sample()
+            except Exception as e:
+                print(f"Telemetry sample failed: {e}")
+                continue
+            with self._lock:
+                self._samples.append(sample)
+
+    def sample(self):
+        """
+        Take one sample now.
+        """
+        virtual_memory = psutil.virtual_memory()
+        frequency = psutil.cpu_freq()
+        return {
+            'time': time.time(),
+            'cpu_percent': psutil.cpu_percent(interval=None),
+            'cpu_freq_mhz': frequency.current if frequency is not None else None,
+            'ram_used_mb': (virtual_memory.total - virtual_memory.available) / (1024 ** 2),
+            'ram_available_mb': virtual_memory.available / (1024 ** 2),
+            'process_rss_mb': self._process.memory_info().rss / (1024 ** 2),
+            'gpus': self._gpu_reader.read() if self._gpu_reader is not None else [],
+        }
+
+    def latest(self):
+        """
+        :return: The most recent sample, or None before the first one.
+        """
+        with self._lock:
+            return self._samples[-1] if self._samples else None
+
+    def samples(self, since=None):
+        """
+        :param since: Optional time.time() timestamp, only samples taken from then on are returned.
+        :return: List of samples, oldest first.
+        """
+        with self._lock:
+            samples = list(self._samples)
+        if since is not None:
+            samples = [sample for sample in samples if sample['time'] >= since]
+        return samples
+
+
+def summarize(samples):
+    """
+    Mean and peak CPU and GPU utilization and memory over samples, e.g. the ones taken during a benchmark run.
+
+    :return: Dictionary of summary values, empty without samples.
+    """
+    if not samples:
+        return {}
+    summary = {
+        'cpu_percent_mean': sum(sample['cpu_percent'] for sample in samples) / len(samples),
+        'cpu_percent_peak': max(sample['cpu_percent'] for sample in samples),
+        'process_rss_mb_peak': max(sample['process_rss_mb'] for sample in samples),
+    }
+    gpu_samples = [gpu for sample in samples for gpu in sample['gpus']]
+    if gpu_samples:
+        summary['gpu_utilization_percent_mean'] = (sum(gpu['utilization_percent'] for gpu in gpu_samples)
+                                                   / len(gpu_samples))
+        summary['gpu_memory_used_mb_peak'] = max(gpu['memory_used_mb'] for gpu in gpu_samples)
+    return summary
+
+
+def format_sample(sample):
+    """
+    One-line summary of a sample for the status bar.
+    """
+    parts = [f"CPU {sample['cpu_percent']:.0f}%", f"RAM {sample['ram_used_mb'] / 1024:.1f} GB",
+             f"process {sample['process_rss_mb'] / 1024:.1f} GB"]
+    for gpu in sample['gpus']:
+        parts.append(f"{gpu['device']} {gpu['utilization_percent']:.0f}%, "
+                     f"{gpu['memory_used_mb'] / 1024:.1f}/{gpu['memory_total_mb'] / 1024:.1f} GB")
+    return '  |  '.join(parts)
+
+
+_shared_sampler = None
+_shared_lock = threading.Lock()
+
+
+def shared_sampler(interval=None):
+    """
+    The sampler of the process, started on first use.
+
+    :param interval: Optional new interval in seconds.
+    """
+    global _shared_sampler
+    with _shared_lock:
+        if _shared_sampler is None:
+            _shared_sampler = TelemetrySampler(interval or DEFAULT_INTERVAL_S)
+        elif interval is not None:
+            _shared_sampler.interval = interval
+        return _shared_sampler.start()
+
+
+def running_sampler():
+    """
+    The sampler of the process when something started it, without starting it.
+    """
+    sampler = _shared_sampler
+    return sampler if sampler is not None and sampler.running else None
@@ -0,0 +1,52 @@
+import threading
+
+import psutil
+import torch
+
+
+class PeakMemorySampler:
+    """
+    Context manager measuring the peak resident memory (RSS) of the process, and the peak CUDA memory, while the
+    block runs.
+
+    RSS is polled from a background thread, so very short spikes between two samples can be missed.
+    """
+
+    def __init__(self, interval=0.005, cuda_devices=None):
+        """
+        :param interval: Seconds between two RSS samples.
+        :param cuda_devices: CUDA devices to track, defaults to all visible ones.
+        """
+        self.interval = interval
+        if cuda_devices is None:
+            cuda_devices = list(range(torch.cuda.device_count())) if torch.cuda.is_available() else []
+        self.cuda_devices = cuda_devices
+        self.start_rss_mb = 0.0
+        self.peak_rss_mb = 0.0
+        self.peak_vram_mb = 0.0
+        self._process = psutil.Process()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        for device in self.cuda_devices:
+            torch.cuda.reset_peak_memory_stats(device)
+        self.start_rss_mb = self.peak_rss_mb = self._rss_mb()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stop.set()
+        self._thread.join()
+        self.peak_rss_mb = max(self.peak_rss_mb, self._rss_mb())
+        self.peak_vram_mb = sum(torch.cuda.max_memory_allocated(device) for device in self.cuda_devices) / (1024 ** 2)
+        return False
+
+    def _rss_mb(self):
+        return self._process.memory_info().rss / (1024 ** 2)
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak_rss_mb = max(self.peak_rss_mb, self._rss_mb())
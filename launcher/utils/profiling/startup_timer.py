@@ -0,0 +1,87 @@
+import importlib
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+
+class StartupTimer:
+    """
+    Records how long the launcher takes to start: the time spent importing heavy modules and the time at which
+    each startup phase (e.g. 'first paint', 'ready') was reached.
+    """
+
+    def __init__(self, budgets=None):
+        """
+        :param budgets: Optional dictionary mapping phase names to the maximum number of seconds they may take.
+        """
+        self.start = time.perf_counter()
+        self.budgets = dict(budgets or {})
+        self.phases = {}
+        self.imports = {}
+        self._lock = threading.Lock()
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def mark(self, phase):
+        """
+        Record the moment a phase is reached. Only the first mark of a phase counts.
+        """
+        with self._lock:
+            self.phases.setdefault(phase, self.elapsed())
+
+    @contextmanager
+    def measure(self, name):
+        """
+        Record how long the block took under the given name in the import breakdown.
+        """
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.imports.setdefault(name, time.perf_counter() - begin)
+
+    def import_module(self, name):
+        """
+        Import a module and record the time it took, if it wasn't imported yet.
+        """
+        if name in sys.modules:
+            return sys.modules[name]
+        with self.measure(name):
+            return importlib.import_module(name)
+
+    def over_budget(self):
+        """
+        Return the phases that took longer than their budget, as {phase: (seconds, budget)}.
+        """
+        return {phase: (self.phases[phase], budget) for phase, budget in self.budgets.items()
+                if phase in self.phases and self.phases[phase] > budget}
+
+    def report(self):
+        with self._lock:
+            return {
+                'phases': dict(sorted(self.phases.items(), key=lambda item: item[1])),
+                'imports': dict(sorted(self.imports.items(), key=lambda item: item[1], reverse=True)),
+                'budgets': dict(self.budgets),
+                'over_budget': {phase: seconds for phase, (seconds, _) in self.over_budget().items()}
+            }
+
+    def format_report(self):
+        report = self.report()
+        lines = ["Startup phases (s since launch):"]
+        for phase, seconds in report['phases'].items():
+            budget = report['budgets'].get(phase)
+            note = f"  (budget {budget:.2f}, OVER)" if phase in report['over_budget'] else \
+                f"  (budget {budget:.2f})" if budget is not None else ""
+            lines.append(f" - {phase}: {seconds:.3f}{note}")
+        lines.append("Imports (s):")
+        for name, seconds in report['imports'].items():
+            lines.append(f" - {name}: {seconds:.3f}")
+        return "\n".join(lines)
+
+    def save_report(self, path):
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(self.report(), file, indent=2)
@@ -0,0 +1,53 @@
+import argparse
+import os
+
+from launcher.generators.ai.model_store import VARIANT_DTYPES, ModelStore, format_model_info
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="List the models on disk and convert them into safetensors variants that load without a cast.")
+    parser.add_argument('--offline', action='store_true', help="Never contact the Hugging Face Hub.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    commands.add_parser('list', help="Index the Hugging Face cache and the store, and list the models.")
+
+    convert = commands.add_parser('convert', help="Save a model in the given dtypes, e.g. fp16 for CUDA.")
+    convert.add_argument('model', help="Model name or path to a local model directory.")
+    convert.add_argument('--dtypes', nargs='+', default=['fp32'], choices=VARIANT_DTYPES)
+
+    verify = commands.add_parser('verify', help="Hash every file of a model's variants and compare with the "
+                                                "manifest.")
+    verify.add_argument('model')
+
+    remove = commands.add_parser('remove', help="Delete converted variants of a model.")
+    remove.add_argument('model')
+    remove.add_argument('--dtypes', nargs='+', default=list(VARIANT_DTYPES), choices=VARIANT_DTYPES)
+    return parser.parse_args()
+
+
+def main():
+    arguments = parse_arguments()
+    if arguments.offline:
+        # Must be set before transformers is imported.
+        os.environ['HF_HUB_OFFLINE'] = '1'
+
+    store = ModelStore()
+    if arguments.command == 'list':
+        for name, entry in sorted(store.index(refresh=True).items()):
+            print(f"{name}: {format_model_info(entry)}")
+    elif arguments.command == 'convert':
+        store.convert(arguments.model, arguments.dtypes)
+    elif arguments.command == 'verify':
+        entry = store.describe(arguments.model)
+        if entry is None or not entry['variants']:
+            print(f"{arguments.model} has no converted variants")
+            return
+        for dtype, directory in sorted(entry['variants'].items()):
+            print(f"{dtype}: {'ok' if store.verify(directory, full=True) else 'damaged'}")
+    elif arguments.command == 'remove':
+        store.remove(arguments.model, arguments.dtypes)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+import argparse
+import os
+import sys
+
+from launcher.generators.ai.parameters import BACKENDS, PRECISIONS
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Serve a LcNLP Launcher model over local HTTP without the GUI.")
+    parser.add_argument('--model', default='gpt2', help="Model name or path to a local model directory.")
+    parser.add_argument('--device', default='cpu',
+                        help="Device to run on, e.g. 'cpu', 'cuda:0', or 'auto' to split the model across all GPUs "
+                             "and the CPU.")
+    parser.add_argument('--precision', default='fp32', choices=PRECISIONS,
+                        help="Precision to load the model in; int8 uses dynamic quantization on CPU.")
+    parser.add_argument('--backend', default='torch', choices=BACKENDS,
+                        help="Engine to run the model with; onnx exports GPT-2 and GPT-Neo models to ONNX Runtime on "
+                             "their first load and runs them on CPU.")
+    parser.add_argument('--draft-model',
+                        help="Small model with the same tokenizer for speculative decoding, or 'auto' to pick the "
+                             "draft of the model's family.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--max-batch-size', type=int, default=8,
+                        help="Maximum number of queued prompts generated together.")
+    parser.add_argument('--replicas', type=int, default=0,
+                        help="Serve with this many CPU replica processes, each pinned to its own cores and sharing "
+                             "the weights, instead of one batching scheduler.")
+    parser.add_argument('--no-cpu-tuning', action='store_true',
+                        help="Don't benchmark CPU thread counts and affinities on the first CPU run of a model.")
+    parser.add_argument('--compile', action='store_true',
+                        help="Decode with a torch.compile'd model, compiled in the background after loading and "
+                             "cached on disk for the next launch. Not used with --replicas.")
+    parser.add_argument('--offline', action='store_true', help="Never contact the Hugging Face Hub.")
+    return parser.parse_args()
+
+
+def main():
+    arguments = parse_arguments()
+    if arguments.offline:
+        # Must be set before transformers is imported.
+        os.environ['HF_HUB_OFFLINE'] = '1'
+
+    from launcher.generators.ai.NLP_Generator import AdvancedTextGenerator
+    from launcher.generators.ai.scheduler import GenerationScheduler
+    from launcher.generators.ai.speculative import default_draft_model
+    from launcher.server.http_server import InferenceHTTPServer
+
+    # Replicas get their threads and cores from the replica pool, not from a tuned profile.
+    cpu_tuning = not arguments.no_cpu_tuning and not arguments.replicas
+    generator = AdvancedTextGenerator(model_name=arguments.model, device_id=arguments.device,
+                                      precision=arguments.precision, cpu_tuning=cpu_tuning,
+                                      apply_cpu_profiles=not arguments.replicas, backend=arguments.backend,
+                                      # Compiled models can't be shared with replica processes.
+                                      compile_mode=arguments.compile and not arguments.replicas)
+    if generator.model is None:
+        sys.exit(f"Could not load model '{arguments.model}'")
+    draft_model_name = arguments.draft_model
+    if draft_model_name == 'auto':
+        draft_model_name = default_draft_model(arguments.model)
+    if draft_model_name:
+        generator.apply_model(generator.prepare_model(arguments.model, draft_model_name=draft_model_name))
+
+    if arguments.replicas:
+        from launcher.generators.ai.replicas import ReplicaPool
+        scheduler = ReplicaPool(generator, replicas=arguments.replicas).start()
+    else:
+        scheduler = GenerationScheduler(generator, max_batch_size=arguments.max_batch_size).start()
+    server = InferenceHTTPServer((arguments.host, arguments.port), scheduler)
+    print(f"Serving {arguments.model} on http://{arguments.host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        scheduler.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+import json
+import os
+import tempfile
+import unittest
+
+from launcher.generators.ai.bulk import checkpoint_path, generate_jsonl
+
+
+class FakeTokenizer:
+
+    def __call__(self, text):
+        return {'input_ids': text.split()}
+
+
+class FakeGenerator:
+    """
+    Echoes the prompts, enough for generate_jsonl.
+    """
+
+    tokenizer = FakeTokenizer()
+
+    def generate_batch(self, prompts, **parameters):
+        return [prompt + '!' for prompt in prompts]
+
+
+class GenerateJsonlTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory(prefix='lcnlp-test-')
+        self.addCleanup(directory.cleanup)
+        self.input_path = os.path.join(directory.name, 'prompts.jsonl')
+        self.output_path = os.path.join(directory.name, 'results.jsonl')
+        with open(self.input_path, 'w', encoding='utf-8') as file:
+            for index in range(5):
+                file.write(json.dumps({'id': index, 'prompt': f"prompt {index}"}) + '\n')
+
+    def read_output(self):
+        with open(self.output_path, 'rb') as file:
+            data = file.read()
+        self.assertNotIn(b'\0', data)
+        return [json.loads(line) for line in data.decode('utf-8').splitlines()]
+
+    def test_resumes_from_checkpoint(self):
+        self.assertEqual(generate_jsonl(FakeGenerator(), self.input_path, self.output_path, window=2, log=id), 5)
+        with open(self.input_path, 'a', encoding='utf-8') as file:
+            file.write(json.dumps({'id': 5, 'prompt': "prompt 5"}) + '\n')
+        self.assertEqual(generate_jsonl(FakeGenerator(), self.input_path, self.output_path, window=2, log=id), 6)
+        self.assertEqual([record['id'] for record in self.read_output()], list(range(6)))
+
+    def test_invalid_stop_fails_only_its_line(self):
+        with open(self.input_path, 'a', encoding='utf-8') as file:
+            for index, stop in enumerate([3, {'a': 1}, [''], ['.', 4]], start=5):
+                file.write(json.dumps({'id': index, 'prompt': f"prompt {index}", 'stop': stop}) + '\n')
+            file.write(json.dumps({'id': 9, 'prompt': "prompt 9", 'stop': ['.', '\n']}) + '\n')
+        self.assertEqual(generate_jsonl(FakeGenerator(), self.input_path, self.output_path, log=id), 10)
+        records = {record['id']: record for record in self.read_output()}
+        self.assertEqual(sorted(records), list(range(10)))
+        for index in range(5, 9):
+            self.assertIn('stop', records[index]['error'])
+        self.assertEqual(records[9]['text'], "prompt 9!")
+
+    def test_restarts_when_output_is_shorter_than_checkpoint(self):
+        generate_jsonl(FakeGenerator(), self.input_path, self.output_path, window=2, log=id)
+        with open(self.output_path, 'r+b') as file:
+            file.truncate(10)
+        self.assertEqual(generate_jsonl(FakeGenerator(), self.input_path, self.output_path, window=2, log=id), 5)
+        self.assertEqual(sorted(record['id'] for record in self.read_output()), list(range(5)))
+
+    def test_restarts_when_output_is_missing(self):
+        generate_jsonl(FakeGenerator(), self.input_path, self.output_path, window=2, log=id)
+        os.remove(self.output_path)
+        self.assertTrue(os.path.exists(checkpoint_path(self.output_path)))
+        self.assertEqual(generate_jsonl(FakeGenerator(), self.input_path, self.output_path, window=2, log=id), 5)
+        self.assertEqual(len(self.read_output()), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
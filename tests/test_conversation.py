@@ -0,0 +1,52 @@
+import importlib.util
+import os
+import tempfile
+import unittest
+
+HAS_TORCH = all(importlib.util.find_spec(name) is not None for name in ('torch', 'transformers'))
+
+
+@unittest.skipUnless(HAS_TORCH, "needs torch and transformers")
+class SpeculativeConversationTest(unittest.TestCase):
+    """
+    Chat turns always carry the user prefix as a stop string, which the draft model's generate must not receive.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        from launcher.generators.ai.NLP_Generator import AdvancedTextGenerator
+        from launcher.generators.ai.tiny_models import create_tiny_model
+
+        cls.directory = tempfile.TemporaryDirectory(prefix='lcnlp-test-')
+        model = create_tiny_model(os.path.join(cls.directory.name, 'tiny-gpt2'))
+        draft = create_tiny_model(os.path.join(cls.directory.name, 'tiny-draft'), num_layers=1)
+        cls.generator = AdvancedTextGenerator(model_name=model, device_id='cpu', load_on_init=False,
+                                              prefix_cache_mb=0, response_cache_size=0, cpu_tuning=False)
+        cls.generator.apply_model(cls.generator.prepare_model(model, draft_model_name=draft))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def test_conversation_turn_with_draft_model(self):
+        from launcher.generators.ai.conversation import ConversationSession
+
+        session = ConversationSession(self.generator)
+        pieces = []
+        reply = session.generate_text("What is quasar?", max_length=16, on_text=pieces.append)
+        self.assertNotIn(f"\n{session.user_prefix}", reply)
+        self.assertNotIn(f"\n{session.user_prefix}", ''.join(pieces))
+        self.assertEqual(self.generator.last_metrics['draft_model'], self.generator.draft_model_name)
+
+        session.generate_text("And a pulsar?", max_length=16)
+        self.assertEqual(len(session.history), 4)
+
+    def test_stop_strings_with_draft_model(self):
+        text = self.generator.generate_text("The quick brown fox", max_length=16, stop_strings=['.', 'e'])
+        reply = text[len("The quick brown fox"):]
+        self.assertNotIn('.', reply)
+        self.assertNotIn('e', reply)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import http.client
+import importlib.util
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+HAS_TORCH = all(importlib.util.find_spec(name) is not None for name in ('torch', 'transformers', 'psutil'))
+
+
+@unittest.skipUnless(HAS_TORCH, "needs torch, transformers and psutil")
+class InferenceHTTPServerTest(unittest.TestCase):
+    """
+    The HTTP endpoints, served by a scheduler around a tiny model.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        from launcher.generators.ai.NLP_Generator import AdvancedTextGenerator
+        from launcher.generators.ai.scheduler import GenerationScheduler
+        from launcher.generators.ai.tiny_models import create_tiny_model
+        from launcher.server.http_server import InferenceHTTPServer
+
+        cls.directory = tempfile.TemporaryDirectory(prefix='lcnlp-test-')
+        model = create_tiny_model(os.path.join(cls.directory.name, 'tiny-gpt2'))
+        generator = AdvancedTextGenerator(model_name=model, device_id='cpu', prefix_cache_mb=0,
+                                          response_cache_size=0, cpu_tuning=False)
+        cls.scheduler = GenerationScheduler(generator).start()
+        cls.server = InferenceHTTPServer(('127.0.0.1', 0), cls.scheduler)
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        cls.scheduler.stop()
+        cls.directory.cleanup()
+
+    def request(self, method, path, body=None):
+        connection = http.client.HTTPConnection(*self.server.server_address, timeout=60)
+        self.addCleanup(connection.close)
+        data = json.dumps(body).encode('utf-8') if body is not None else None
+        connection.request(method, path, body=data, headers={'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        return response.status, response.getheader('Content-Type'), response.read()
+
+    def test_health(self):
+        status, _, data = self.request('GET', '/health')
+        self.assertEqual(status, 200)
+        health = json.loads(data)
+        self.assertEqual(health['status'], 'ok')
+        self.assertEqual(health['device'], 'cpu')
+
+    def test_completion(self):
+        status, _, data = self.request('POST', '/v1/completions',
+                                       {'prompt': ["Hello", "The sky"], 'max_length': 8, 'seed': 1})
+        self.assertEqual(status, 200)
+        choices = json.loads(data)['choices']
+        self.assertEqual([choice['index'] for choice in choices], [0, 1])
+        self.assertTrue(choices[1]['text'].startswith("The sky"))
+
+    def test_streamed_completion(self):
+        status, content_type, data = self.request('POST', '/v1/completions',
+                                                  {'prompt': "Hello", 'max_length': 8, 'stream': True})
+        self.assertEqual(status, 200)
+        self.assertEqual(content_type, 'application/x-ndjson')
+        lines = [json.loads(line) for line in data.decode('utf-8').splitlines()]
+        self.assertTrue(lines[-1]['done'])
+        self.assertTrue(all('text' in line and 'done' not in line for line in lines[:-1]))
+        self.assertIn(''.join(line['text'] for line in lines[:-1]), lines[-1]['text'])
+
+    def test_invalid_parameter(self):
+        status, _, data = self.request('POST', '/v1/completions', {'prompt': "Hello", 'temperature': 5})
+        self.assertEqual(status, 400)
+        self.assertIn('temperature', json.loads(data)['error'])
+
+    def test_deadline(self):
+        status, _, data = self.request('POST', '/v1/completions', {'prompt': "Hello", 'timeout': 1e-6})
+        self.assertEqual(status, 504)
+        self.assertIn('deadline', json.loads(data)['error'])
+
+
+if __name__ == '__main__':
+    unittest.main()
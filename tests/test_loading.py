@@ -0,0 +1,51 @@
+import importlib.util
+import os
+import tempfile
+import unittest
+
+HAS_TORCH = all(importlib.util.find_spec(name) is not None for name in ('torch', 'transformers', 'psutil'))
+
+
+@unittest.skipUnless(HAS_TORCH, "needs torch, transformers and psutil")
+class TorchBackendLoadTest(unittest.TestCase):
+    """
+    TorchBackend.load reports how long the load took and the memory it needed.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory(prefix='lcnlp-test-')
+        self.addCleanup(self.directory.cleanup)
+
+    def test_load_metrics(self):
+        import psutil
+        import torch
+
+        from launcher.generators.ai.model_store import ModelStore
+        from launcher.generators.ai.tiny_models import create_tiny_model
+        from launcher.generators.backends.torch_backend import TorchBackend
+
+        model_name = create_tiny_model(os.path.join(self.directory.name, 'tiny-gpt2'))
+        store = ModelStore(root=os.path.join(self.directory.name, 'store'),
+                           hub_cache=os.path.join(self.directory.name, 'hub'))
+        stages = []
+        load_metrics = {}
+        model, tokenizer = TorchBackend(model_store=store).load(
+            model_name, torch.device('cpu'), 'fp32', lambda stage, progress: stages.append(stage),
+            load_metrics=load_metrics)
+        post_load_rss_mb = psutil.Process().memory_info().rss / (1024 ** 2)
+
+        self.assertEqual(stages[:2], ['read', 'materialize'])
+        for key in ('load_s', 'peak_rss_mb', 'rss_increase_mb', 'peak_vram_mb'):
+            self.assertIn(key, load_metrics)
+        self.assertGreater(load_metrics['load_s'], 0)
+        self.assertGreaterEqual(load_metrics['rss_increase_mb'], 0)
+        self.assertEqual(load_metrics['peak_vram_mb'], 0)
+        self.assertIsNone(load_metrics['variant'])
+        # The peak includes the RSS at the end of the load; allow for pages touched since then.
+        self.assertGreaterEqual(load_metrics['peak_rss_mb'] + 1, post_load_rss_mb)
+        self.assertEqual(model.device.type, 'cpu')
+        self.assertIsNotNone(tokenizer.eos_token_id)
+
+
+if __name__ == '__main__':
+    unittest.main()
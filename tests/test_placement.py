@@ -0,0 +1,79 @@
+import importlib.util
+import unittest
+from types import SimpleNamespace
+
+from launcher.utils.devices.placement import plan_placement, simulated_inventory
+
+HAS_TORCH = all(importlib.util.find_spec(name) is not None for name in ('torch', 'transformers'))
+
+
+def gpt2_config(hidden_size=1600, num_layers=48, num_heads=25):
+    """
+    The config fields plan_placement reads, defaulting to gpt2-xl.
+    """
+    return SimpleNamespace(model_type='gpt2', vocab_size=50257, max_position_embeddings=1024, hidden_size=hidden_size,
+                           num_hidden_layers=num_layers, num_attention_heads=num_heads, n_inner=None,
+                           tie_word_embeddings=True)
+
+
+def expected_modules(num_layers):
+    return ({'transformer.wte', 'transformer.wpe', 'lm_head', 'transformer.ln_f'}
+            | {f'transformer.h.{index}' for index in range(num_layers)})
+
+
+class PlanPlacementTest(unittest.TestCase):
+
+    def test_spills_blocks_to_cpu(self):
+        config = gpt2_config()
+        plan = plan_placement(config, simulated_inventory([2048, 2048], 16384))
+        device_map = plan['device_map']
+
+        self.assertEqual(plan['primary_device'], 'cuda:0')
+        self.assertEqual(list(plan['devices']), ['cuda:0', 'cuda:1', 'cpu'])
+        self.assertEqual(device_map['lm_head'], device_map['transformer.wte'])
+        self.assertEqual(device_map['transformer.ln_f'], 'cpu')
+        for placed in plan['devices'].values():
+            self.assertLessEqual(placed['size_mb'], placed['budget_mb'])
+        # Blocks stay contiguous: the device only changes at the GPU/GPU and GPU/CPU boundaries.
+        block_devices = [device_map[f'transformer.h.{index}'] for index in range(config.num_hidden_layers)]
+        changes = [index for index in range(1, len(block_devices)) if block_devices[index] != block_devices[index - 1]]
+        self.assertEqual(len(changes), 2)
+        self.assertEqual(block_devices[-1], 'cpu')
+
+    def test_fits_on_one_gpu(self):
+        plan = plan_placement(gpt2_config(768, 12, 12), simulated_inventory([8192], 16384))
+        self.assertEqual(set(plan['device_map'].values()), {'cuda:0'})
+        self.assertEqual(list(plan['devices']), ['cuda:0'])
+
+    def test_raises_when_the_model_does_not_fit(self):
+        with self.assertRaises(ValueError):
+            plan_placement(gpt2_config(), simulated_inventory([1024], 2048))
+
+    def test_raises_for_unsupported_architectures(self):
+        config = gpt2_config()
+        config.model_type = 'llama'
+        with self.assertRaises(ValueError):
+            plan_placement(config, simulated_inventory([8192]))
+
+    def test_device_map_covers_every_module(self):
+        config = gpt2_config()
+        plan = plan_placement(config, simulated_inventory([2048, 2048], 16384))
+        self.assertEqual(set(plan['device_map']), expected_modules(config.num_hidden_layers))
+
+    @unittest.skipUnless(HAS_TORCH, "needs torch and transformers")
+    def test_device_map_covers_every_parameter_of_the_model(self):
+        import torch
+        from transformers import GPT2Config, GPT2LMHeadModel
+
+        config = GPT2Config(n_embd=64, n_layer=4, n_head=2, vocab_size=512)
+        with torch.device('meta'):
+            model = GPT2LMHeadModel(config)
+        plan = plan_placement(config, simulated_inventory([1], 1024))
+        names = [name for name, _ in model.named_parameters()] + [name for name, _ in model.named_buffers()]
+        for name in names:
+            self.assertTrue(any(name == module or name.startswith(f'{module}.') for module in plan['device_map']),
+                            name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+import importlib.util
+import os
+import tempfile
+import unittest
+
+HAS_TORCH = all(importlib.util.find_spec(name) is not None for name in ('torch', 'transformers'))
+
+
+@unittest.skipUnless(HAS_TORCH, "needs torch and transformers")
+class Int8PrecisionTest(unittest.TestCase):
+
+    def test_lm_head_stays_tied(self):
+        import torch
+        from transformers import AutoModelForCausalLM
+
+        from launcher.generators.ai.precision import apply_precision, check_precision
+        from launcher.generators.ai.tiny_models import create_tiny_model
+
+        try:
+            check_precision('int8', torch.device('cpu'))
+        except ValueError as e:
+            self.skipTest(str(e))
+        with tempfile.TemporaryDirectory(prefix='lcnlp-test-') as directory:
+            model = AutoModelForCausalLM.from_pretrained(create_tiny_model(os.path.join(directory, 'tiny-gpt2')))
+        model = apply_precision(model.eval(), 'int8')
+
+        self.assertIs(type(model.lm_head), torch.nn.Linear)
+        self.assertIs(model.lm_head.weight, model.transformer.wte.weight)
+        self.assertIsInstance(model.transformer.h[0].mlp.c_fc, torch.ao.nn.quantized.dynamic.Linear)
+        with torch.no_grad():
+            logits = model(torch.tensor([[1, 2, 3]])).logits
+        self.assertEqual(logits.shape[-1], model.config.vocab_size)
+
+
+if __name__ == '__main__':
+    unittest.main()